@@ -1,60 +1,375 @@
 #!/usr/bin/env python3
 
 import os
-import importlib
+import hmac
+import atexit
+import functools
 import logging
 from flask import Flask, request, jsonify
-from utils.processing import handle_media
+from utils.processing import handle_media, is_season_ep_or_movie, format_quick_message
+from utils.download import get_poster_mimetype, IMAGE_BASE_URL
+from utils.circuit_breaker import breakers_status
+from utils.budget import budget_stats
+from utils.cache import cache_stats
+from utils.timeouts import timeouts_status
+from utils.tracing import start_trace, span, get_spans, summarize, get_trace_id
+from utils.log import setup_logging, logging_stats
+from utils.profiling import maybe_profile, request_profiling, profiling_status
+from utils.delivery import get_queue, delivery_stats, pending_deliveries, wait_for_deliveries
+from utils.admission import create_controller, Rejected
+from utils.routing import load_routing_table, event_attributes
+from utils.cluster import create_cluster, FORWARDED_HEADER, NODE_HEADER
+from utils.connector import load_connectors, get_poster_widths, get_languages
+from utils.notify import Notification, run_in_background, count as count_notification, notify_first_stats
+from utils import digest, http_client
+from utils.dns_cache import dns_cache_stats
+from utils.imdb_index import get_index as get_imdb_index
+from config.settings import (ADMIN_TOKEN, BASE_URL, JELLYFIN_API_URL, SKIP_EPISODE_NOTIFICATIONS, NOTIFY_FIRST,
+                             NOTIFY_FIRST_EDIT_WAIT, GUNICORN_PRELOAD, DELIVERY_SHUTDOWN_TIMEOUT)
 
 app = Flask(__name__)
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-#logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s')
+setup_logging()
 
-CONNECTORS_DIR = 'connectors'
+# Bounds the work accepted by this worker, see process_data
+admission = create_controller(pending_deliveries)
+# None unless cluster mode is enabled (CLUSTER_SELF_URL)
+cluster = create_cluster()
 
-def load_connectors():
+connectors = load_connectors()
+# None when ROUTING_FILE is not set: every event goes to every connector
+routing_table = load_routing_table(list(connectors))
+
+def get_connector_options(connector, options: dict) -> dict:
     """
-    Load connectors dynamically from the connectors directory.
+    Get the options of a connector, with the poster variant matching its width.
+
+    Args:
+        connector (Connector): The connector
+        options (dict): Options shared by all connectors
 
     Returns:
-        dict: Dictionary of connectors.
+        dict: Options with `picture_path` and `picture_mimetype` set for this connector,
+        without poster if it does not show images.
     """
-    connectors = {}
-    for root, dirs, files in os.walk(CONNECTORS_DIR):
-        # Skip the template directory
-        if "template" in root.split(os.sep):
-            continue
-        for file in files:
-            if file.endswith('_service.py'):
-                connector_name = root.split(os.sep)[-1]
-                module_name = f"{CONNECTORS_DIR}.{connector_name}.{file[:-3]}"
-                module = importlib.import_module(module_name)
-                connectors[connector_name] = module
-    return connectors
+    if not connector.supports("image"):
+        return dict(options, send_image=False, picture_path=None)
+    picture_path = (options.get('posters') or {}).get(connector.poster_width) or options.get('picture_path')
+    connector_options = dict(options, picture_path=picture_path)
+    if picture_path:
+        connector_options['picture_mimetype'] = get_poster_mimetype(picture_path)
+    return connector_options
 
-connectors = load_connectors()
+def send_to_connector(connector_name: str, connector, message: dict, options: dict):
+    """
+    Send the formatted message to a single connector.
+
+    In NOTIFY_FIRST mode, the options of a message carry its `notification`:
+    the first message is sent as an editable one, and the enriched message
+    (`edit` option) replaces it.
+
+    Args:
+        connector_name (str): Name of the connector
+        connector (Connector): The connector
+        message (dict): Message to be sent.
+        options (dict): Additional options for the message
+    """
+    notification = options.get('notification')
+    try:
+        with span(f"connector.{connector_name}"):
+            if notification:
+                response = send_notification(connector_name, connector, notification, message, options)
+            else:
+                response = connector.send(message, get_connector_options(connector, options))
+        if response:
+            logging.info(f"Message sent to {connector_name} successfully.", extra={"sampled": True})
+    except Exception as e:
+        logging.error(f"Failed to send message to {connector_name}: {e}")
+
+def send_notification(connector_name: str, connector, notification: Notification, message: dict, options: dict):
+    """
+    Send the first message of a notify-first event, or edit it with the enriched message.
+
+    An edit waits for the first message to be sent. If it could not be, the
+    enriched message is sent as a new message instead.
+
+    Args:
+        connector_name (str): Name of the connector
+        connector (Connector): The connector, supporting edits
+        notification (Notification): The first message of the event on this connector
+        message (dict): Message to be sent.
+        options (dict): Additional options for the message
+
+    Returns:
+        The message ID or the response of the connector, None if nothing was sent.
+    """
+    connector_options = get_connector_options(connector, options)
+    del connector_options['notification']
+    connector_options.pop('edit', None)
+    if not options.get('edit'):
+        message_id = None
+        try:
+            message_id = connector.send_editable(message, connector_options)
+        finally:
+            notification.set_sent(message_id)
+        if message_id:
+            count_notification("notified")
+        return message_id
+    message_id = notification.wait(NOTIFY_FIRST_EDIT_WAIT)
+    if message_id:
+        count_notification("edited")
+        return connector.edit(message_id, message, connector_options)
+    logging.warning(f"No first message to edit on {connector_name}, sending the enriched message instead.")
+    count_notification("not_edited")
+    return connector.send(message, connector_options)
+
+def send_batch_to_connector(connector_name: str, connector, items: list):
+    """
+    Send several formatted messages to a connector in one batch.
+
+    Notify-first messages are sent one by one, so they can be edited.
+
+    Args:
+        connector_name (str): Name of the connector
+        connector (Connector): The connector, with `send_many`
+        items (list): (message, options) tuples
+    """
+    for message, options in items:
+        if options.get('notification'):
+            send_to_connector(connector_name, connector, message, options)
+    items = [(message, options) for message, options in items if not options.get('notification')]
+    if not items:
+        return
+    try:
+        with span(f"connector.{connector_name}", batch=len(items)):
+            responses = connector.send_many([(message, get_connector_options(connector, options))
+                                             for message, options in items])
+        sent = sum(1 for response in responses if response)
+        logging.info(f"Batch of {len(items)} messages sent to {connector_name}, {sent} successfully.",
+                     extra={"sampled": sent == len(items)})
+    except Exception as e:
+        logging.error(f"Failed to send batch of {len(items)} messages to {connector_name}: {e}")
+
+def warm_up_connections() -> list:
+    """
+    Resolve and connect to TMDB, Jellyfin and the services of the connectors.
+
+    Called when a gunicorn worker starts (see gunicorn.conf.py), so the first
+    events do not pay the DNS resolutions and TLS handshakes.
+
+    Returns:
+        list: DNS and connection timings of each host.
+    """
+    destinations = [("tmdb", BASE_URL), ("tmdb_images", IMAGE_BASE_URL), ("jellyfin", JELLYFIN_API_URL)]
+    destinations += [(name, url) for name, connector in connectors.items() for url in connector.destinations]
+    return http_client.warm_up(destinations)
+
+_drained_pid = None
+
+def drain_deliveries(timeout: float = DELIVERY_SHUTDOWN_TIMEOUT):
+    """
+    Wait for the messages queued for delivery before the process exits, once per process.
+
+    Jellyfin already got its response for them. Called by the gunicorn
+    `worker_exit` hook with the graceful timeout (see gunicorn.conf.py), and
+    at exit for the other servers.
+
+    Args:
+        timeout (float, optional): Maximum time to wait in seconds.
+    """
+    global _drained_pid
+    if _drained_pid == os.getpid():
+        return
+    _drained_pid = os.getpid()
+    wait_for_deliveries(timeout)
+
+atexit.register(drain_deliveries)
+
+def preload_shared_state():
+    """
+    Load the read-only state that is otherwise loaded lazily, so it is shared by the workers.
+
+    Called in the gunicorn master when the application is preloaded
+    (GUNICORN_PRELOAD, see gunicorn.conf.py), before the workers are forked.
+    The connectors, routing table and compiled patterns are already loaded
+    when this module is imported.
+    """
+    get_imdb_index()
+
+def start_worker():
+    """
+    Start the background threads of this process again in a forked worker.
+
+    Threads do not survive a fork: with a preloaded application, the log writer
+    started in the master has no thread in the workers, and the digest scheduler
+    and cluster health checks are only started in the workers, so no thread of
+    the master holds a lock when it forks.
+    """
+    setup_logging()
+    digest.start_scheduler(connectors, send_digest)
+    if cluster:
+        cluster.start()
+
+def get_connector_queue(connector_name: str):
+    """
+    Get the delivery queue of a loaded connector.
+
+    Args:
+        connector_name (str): Name of the connector
+
+    Returns:
+        DeliveryQueue: The queue of the connector.
+    """
+    connector = connectors[connector_name]
+    return get_queue(connector_name, functools.partial(send_to_connector, connector_name, connector),
+                     send_many=functools.partial(send_batch_to_connector, connector_name, connector),
+                     capabilities=connector.capabilities)
+
+def send_digest(connector_name: str, message: dict, options: dict) -> bool:
+    """
+    Send a digest message to a connector.
 
-def send_to_all_connectors(connectors:dict, message: dict, options: dict):
+    Sent right away by the digest scheduler instead of being queued, so its
+    events are only removed from the buffer once it was sent.
+
+    Args:
+        connector_name (str): Name of the connector
+        message (dict): Digest message to be sent.
+        options (dict): Additional options for the message
+
+    Returns:
+        bool: True if the connector sent the message.
+    """
+    connector = connectors[connector_name]
+    try:
+        with span(f"connector.{connector_name}"):
+            response = connector.send(message, get_connector_options(connector, options))
+    except Exception as e:
+        logging.error(f"Failed to send digest to {connector_name}: {e}")
+        return False
+    return bool(response)
+
+def send_to_all_connectors(connectors:dict, message: dict, options: dict, kind: str = "movie", messages: dict = None,
+                           notifications: dict = None):
     """
-    Send the formatted message to all connectors.
+    Queue the formatted message for delivery to all connectors.
+
+    Each connector has its own delivery queue, in which the message goes to the
+    lane of its kind, so movies are not delayed by a flood of episodes.
+    Connectors in digest mode buffer the event for their next summary instead.
 
     Args:
         connectors (dict): The loaded connectors
         message (dict): Message to be sent.
         options (dict): Additional options for the message
+        kind (str, optional): Kind of event ("movie", "serie", "season" or "episode")
+        messages (dict, optional): The message by language, each connector getting the
+            one in its language (`message` if there is none).
+        notifications (dict, optional): The first message of a notify-first event by
+            connector, edited with this message.
     """
     if not message:  # if message is None or empty
         logging.warning("No message to send. Skipping sending to connectors.")
         return
 
-    for connector_name, connector_module in connectors.items():
+    for connector_name, connector in connectors.items():
+        connector_message = (messages or {}).get(connector.language) or message
+        if digest.get_schedule(connector_name):
+            digest.add_event(connector_name, kind, connector_message, get_connector_options(connector, options))
+            continue
+        connector_options = options
+        if connector_name in (notifications or {}):
+            connector_options = dict(options, notification=notifications[connector_name], edit=True)
+        get_connector_queue(connector_name).submit(kind, connector_message, connector_options)
+
+def route_event(data: dict, kind: str, message: dict = None, certain: bool = False) -> dict:
+    """
+    Get the connectors an event must be sent to, according to the routing table.
+
+    Args:
+        data (dict): The media data.
+        kind (str): Kind of event ("movie", "serie", "season" or "episode").
+        message (dict, optional): The formatted message. Without it, the routes are
+            matched on the attributes known before the enrichment only.
+        certain (bool, optional): Without the message, only get the connectors whose
+            route matches on the attributes of the payload alone, which the enriched
+            attributes (resolution, audio languages) cannot exclude.
+
+    Returns:
+        dict: The connectors to send the event to.
+    """
+    if routing_table is None:
+        return connectors
+    partial = message is None and not certain
+    destinations = routing_table.match(event_attributes(data, kind, message), partial=partial)
+    return {name: module for name, module in connectors.items() if name in destinations}
+
+def dispatch_event(data: dict, notifications: dict = None):
+    """
+    Enrich an event and queue the resulting message for delivery to the connectors it is routed to.
+
+    Events no connector can want (e.g. episodes when every route is for movies)
+    are dropped before the enrichment, and posters are only downloaded in the
+    sizes of the candidate connectors.
+
+    Args:
+        data (dict): The media data, in the format of the Jellyfin webhook template.
+        notifications (dict, optional): The first message of the event by connector,
+            in NOTIFY_FIRST mode, see `notify_first`.
+    """
+    digest.start_scheduler(connectors, send_digest)
+    kind = is_season_ep_or_movie(data.get('media_type', ''), data.get('title', ''))
+    candidates = route_event(data, kind)
+    if not candidates:
+        logging.info(f"No route for {data.get('title')}, skipping it.")
+        return
+
+    result = handle_media(data, data.get('item_id', ''), get_poster_widths(candidates), get_languages(candidates))
+    options = {"send_image": result['send_image'], "picture_path": result['picture_path'], "posters": result['posters']}
+    send_to_all_connectors(route_event(data, result['kind'], result['message']), result['message'], options,
+                           result['kind'], result['messages'], notifications)
+
+def notify_first(data: dict, on_done) -> bool:
+    """
+    Send a minimal notification of an event right away, and enrich it in the background.
+
+    Connectors supporting edits get the minimal message from the webhook
+    payload now, edited in place once the event is enriched. The others
+    only get the enriched message, as well as those whose route depends on
+    enriched attributes. Seasons, which are not enriched, and connectors in
+    digest mode are left to `dispatch_event`.
+
+    Args:
+        data (dict): The media data, in the format of the Jellyfin webhook template.
+        on_done (callable): Called once the background enrichment is over.
+
+    Returns:
+        bool: True if the event is enriched in the background, False if it must be dispatched as usual.
+    """
+    kind = is_season_ep_or_movie(data.get('media_type', ''), data.get('title', ''))
+    if kind not in ("movie", "serie", "episode") or (kind == "episode" and SKIP_EPISODE_NOTIFICATIONS):
+        return False
+    # A connector routed on enriched attributes may be excluded once they are known,
+    # its first message could then never be edited: it only gets the enriched one
+    editable = {name: connector for name, connector in route_event(data, kind, certain=True).items()
+                if connector.capabilities.edits and not digest.get_schedule(name)}
+    if not editable:
+        return False
+
+    message = format_quick_message(data, kind)
+    notifications = {}
+    for connector_name in editable:
+        notifications[connector_name] = Notification()
+        get_connector_queue(connector_name).submit(kind, message, {"send_image": False, "picture_path": None,
+                                                                   "notification": notifications[connector_name]})
+
+    def enrich():
         try:
-            response = connector_module.send_message(message, options)
-            if response:
-                logging.info(f"Message sent to {connector_name} successfully.")
-        except Exception as e:
-            logging.error(f"Failed to send message to {connector_name}: {e}")
+            dispatch_event(data, notifications)
+        finally:
+            on_done()
+    run_in_background(enrich)
+    return True
 
 @app.after_request
 def add_security_headers(response):
@@ -67,37 +382,156 @@ def add_security_headers(response):
     response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
     return response
 
+@app.route('/status', methods=['GET'])
+def status():
+    """
+    Endpoint exposing the state of the outbound dependencies for operators.
+
+    Returns:
+        Response: JSON with the circuit breaker state and timeout of each dependency, the latency budget,
+        cache counters, delivery lanes and capabilities of each connector, connection warm-up, admission,
+        logging and cluster state.
+    """
+    return jsonify({
+        'admission': admission.stats(),
+        'circuit_breakers': breakers_status(),
+        'timeouts': timeouts_status(),
+        'latency_budget': budget_stats(),
+        'caches': cache_stats(),
+        'delivery': delivery_stats(),
+        'notify_first': dict(notify_first_stats(), enabled=NOTIFY_FIRST),
+        'connections': {'dns_cache': dns_cache_stats(), 'warmup': http_client.warmup_report()},
+        'connectors': {name: dict(connector.capabilities.as_dict(), interface_version=connector.interface_version,
+                                  language=connector.language)
+                       for name, connector in connectors.items()},
+        'logging': logging_stats(),
+        'cluster': cluster.status() if cluster else None
+    })
+
+@app.route('/cluster/health', methods=['GET'])
+def cluster_health():
+    """
+    Health check used by the other nodes of the cluster.
+
+    Returns:
+        Response: JSON with the URL of this node.
+    """
+    if not cluster:
+        return jsonify({'message': 'Cluster mode is disabled'}), 404
+    return jsonify({'node': cluster.self_url})
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    """
+    Admin endpoint to profile the next N requests handled by this worker.
+
+    Requires the `X-Admin-Token` header to match ADMIN_TOKEN. POST a JSON body
+    such as {"requests": 10} to enable profiling, GET to see the current state.
+
+    Returns:
+        Response: JSON with the profiling state.
+    """
+    if not ADMIN_TOKEN or not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+        return jsonify({'message': 'Forbidden'}), 403
+
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            count = int(data.get('requests', 1))
+        except (TypeError, ValueError):
+            return jsonify({'message': 'requests must be an integer!'}), 400
+        request_profiling(count)
+    return jsonify(profiling_status())
+
 @app.route('/api', methods=['POST'])
 def receive_data():
     """
     Endpoint to receive and process incoming data.
 
+    Each request gets a trace ID, returned in the `X-Trace-Id` header and
+    carried in the log records, and a summary of its spans is logged.
+
+    Returns:
+        Response: JSON response indicating success or failure.
+    """
+    trace_id = start_trace(request.headers.get('X-Trace-Id'))
+    with maybe_profile(trace_id), span("receive_data"):
+        response = process_data()
+    logging.info(f"Request timings: {summarize(get_spans())}", extra={"sampled": True})
+    response = app.make_response(response)
+    response.headers['X-Trace-Id'] = trace_id
+    if cluster and NODE_HEADER not in response.headers:
+        response.headers[NODE_HEADER] = cluster.self_url
+    return response
+
+def process_data():
+    """
+    Validate and process the incoming data, then send it to the connectors.
+
+    The data is validated before any outbound request. In cluster mode, an
+    event owned by another node is forwarded to it. Then the request must
+    be admitted: when the worker is overloaded, it is rejected right away with
+    429 or 503 and a Retry-After header, so Jellyfin retries later instead of
+    waiting for a timeout.
+
     Returns:
         Response: JSON response indicating success or failure.
     """
     if not request.is_json:
         return jsonify({'message': 'Data is not json!'}), 400
 
-    data = request.json
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'message': 'Data is not a json object!'}), 400
     media_type = data.get('media_type', '')
     title = data.get('title', '')
-    imdb = data.get('imdb', '')
-    tmdb = data.get('tmdb', '')
-    item_id = data.get('item_id', '')
 
+    if not media_type or not title:
+        return jsonify({'message': 'Missing media_type or title!'}), 400
+
+    if cluster and not request.headers.get(FORWARDED_HEADER):
+        owner = cluster.owner(data)
+        if not cluster.is_local(owner):
+            try:
+                forwarded = cluster.forward(owner, data, {'X-Trace-Id': get_trace_id()})
+            except Rejected as e:
+                logging.warning(f"Rejected {title} with {e.status_code}: {e.reason}")
+                response = jsonify({'message': e.reason})
+                response.headers['Retry-After'] = str(e.retry_after)
+                return response, e.status_code
+            if forwarded is not None:
+                response = app.response_class(forwarded.content, status=forwarded.status_code,
+                                              mimetype=forwarded.headers.get('Content-Type', 'application/json'))
+                for header in ('Retry-After', NODE_HEADER):
+                    if header in forwarded.headers:
+                        response.headers[header] = forwarded.headers[header]
+                return response
+            # The owner is down and was removed from the ring, process the event here
+
+    try:
+        admission.acquire()
+    except Rejected as e:
+        logging.warning(f"Rejected {title} with {e.status_code}: {e.reason}")
+        response = jsonify({'message': e.reason})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, e.status_code
+
+    # In NOTIFY_FIRST mode, the request stays admitted until its background enrichment is over
+    in_background = False
     try:
-        if media_type and title:
-            result = handle_media(data, item_id)
-            message = result['message']
-            send_image = result['send_image']
-            picture_path = result['picture_path']
-            options = {"send_image": send_image, "picture_path": picture_path}
-            send_to_all_connectors(connectors, message, options)
-            return jsonify({'message': 'Data received successfully!'})
-        else:
-            return jsonify({'message': 'Missing media_type or title!'}), 400
+        in_background = NOTIFY_FIRST and notify_first(data, admission.release)
+        if not in_background:
+            dispatch_event(data)
+        return jsonify({'message': 'Data received successfully!'})
     except Exception as e:
         logging.error(f"Error handling media: {e}")
         return jsonify({'message': 'Internal server error'}), 500
+    finally:
+        if not in_background:
+            admission.release()
 
 
+# Flush the digests even when no new event comes in. A preloaded application is imported
+# in the gunicorn master, the scheduler is then started in each worker (see start_worker)
+if not GUNICORN_PRELOAD:
+    digest.start_scheduler(connectors, send_digest)
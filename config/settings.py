@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import os
+import tempfile
 from dotenv import load_dotenv
 
 dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env')
@@ -12,8 +13,8 @@ TMDB_API_KEY = os.getenv("TMDB_API_KEY")
 LANGUAGE = os.getenv("LANGUAGE", "fr-FR")
 LANGUAGE2 = os.getenv("LANGUAGE2", "en-US")
 
-# Base URL for TMDB API
-BASE_URL = "https://api.themoviedb.org/3"
+# Base URL for TMDB API (overridden to test against a fake TMDB)
+BASE_URL = os.getenv("TMDB_API_URL", "https://api.themoviedb.org/3")
 
 # Jellyfin API configuration
 JELLYFIN_API_URL = os.getenv("JELLYFIN_API_URL")
@@ -22,3 +23,134 @@ JELLYFIN_USER_ID = os.getenv("JELLYFIN_USER_ID")
 
 # Notifications configuration
 SKIP_EPISODE_NOTIFICATIONS = os.getenv("SKIP_EPISODE_NOTIFICATIONS", "False").lower() == "true"
+
+# Circuit breakers (one per outbound dependency: tmdb, tmdb_images, jellyfin and each connector)
+CIRCUIT_BREAKER_FAILURE_RATE = float(os.getenv("CIRCUIT_BREAKER_FAILURE_RATE", "0.5"))
+CIRCUIT_BREAKER_MIN_CALLS = int(os.getenv("CIRCUIT_BREAKER_MIN_CALLS", "5"))
+CIRCUIT_BREAKER_WINDOW = int(os.getenv("CIRCUIT_BREAKER_WINDOW", "20"))
+CIRCUIT_BREAKER_OPEN_SECONDS = float(os.getenv("CIRCUIT_BREAKER_OPEN_SECONDS", "30"))
+
+# Per-event latency budget (0 disables it). Optional stages are skipped once it is spent.
+# Stages: tmdb_details, trailers, poster, technical_details, imdb_to_tmdb, episode_link
+EVENT_BUDGET_SECONDS = float(os.getenv("EVENT_BUDGET_SECONDS", "15"))
+EVENT_BUDGET_REQUIRED_STAGES = [stage.strip() for stage in os.getenv("EVENT_BUDGET_REQUIRED_STAGES", "tmdb_details").split(",") if stage.strip()]
+EVENT_BUDGET_WORKERS = int(os.getenv("EVENT_BUDGET_WORKERS", "8"))
+
+# Caches (TMDB lookups and posters), shared on disk by all workers and the warm-up command
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(tempfile.gettempdir(), "jellyhookapi"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "86400"))
+CACHE_MEMORY_ITEMS = int(os.getenv("CACHE_MEMORY_ITEMS", "1024"))
+# Posters unused for POSTER_CACHE_TTL seconds are removed, then the least recently used ones
+# above POSTER_CACHE_MAX_MB, checked every POSTER_PRUNE_INTERVAL seconds
+POSTER_CACHE_TTL = float(os.getenv("POSTER_CACHE_TTL", str(30 * 86400)))
+POSTER_CACHE_MAX_MB = float(os.getenv("POSTER_CACHE_MAX_MB", "500"))
+POSTER_PRUNE_INTERVAL = float(os.getenv("POSTER_PRUNE_INTERVAL", "300"))
+
+# Maximum number of TMDB requests per second, per process (0 disables the limit)
+TMDB_RATE_LIMIT = float(os.getenv("TMDB_RATE_LIMIT", "10"))
+
+# Tracing: spans are appended as JSON lines to this file when set
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+
+# Admin endpoints (disabled when ADMIN_TOKEN is empty)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "jellyhookapi-profiles"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
+# Delivery to the connectors: one queue per connector, with one lane per event kind.
+# Can be set per connector with a _<NAME> suffix, e.g. DELIVERY_LANE_WEIGHTS_DISCORD
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "2"))
+DELIVERY_LANE_WEIGHTS = os.getenv("DELIVERY_LANE_WEIGHTS", "movie:8,serie:4,season:2,episode:1")
+DELIVERY_MAX_WAIT_SECONDS = float(os.getenv("DELIVERY_MAX_WAIT_SECONDS", "60"))
+# Seconds a process waits at exit for its queued messages (gunicorn workers use its graceful timeout)
+DELIVERY_SHUTDOWN_TIMEOUT = float(os.getenv("DELIVERY_SHUTDOWN_TIMEOUT", "30"))
+
+def get_connector_setting(connector_name: str, key: str, default: str = None, inherit: bool = True) -> str:
+    """
+    Get a setting overridden per connector, e.g. DELIVERY_WORKERS_DISCORD for DELIVERY_WORKERS.
+
+    Args:
+        connector_name (str): Name of the connector.
+        key (str): Name of the global setting.
+        default (str, optional): Value if neither the connector nor the global setting is set.
+        inherit (bool, optional): Fall back to the global setting. If False, only the
+            connector setting is read.
+
+    Returns:
+        str: The value of the setting.
+    """
+    suffix = connector_name.upper().replace("-", "_")
+    return os.getenv(f"{key}_{suffix}", os.getenv(key, default) if inherit else default)
+
+# Persistent local data (digest buffer, polling cursor...)
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(__file__), '..', 'data'))
+
+# Digest mode: set DIGEST_SCHEDULE_<NAME> (e.g. DIGEST_SCHEDULE_WHATSAPP=daily@20:00) to buffer
+# the events of a connector and send them as one summary message
+DIGEST_CHECK_INTERVAL = float(os.getenv("DIGEST_CHECK_INTERVAL", "30"))
+
+# Offline IMDb to TMDB index (python -m utils.imdb_index build), used when the file exists
+IMDB_INDEX_PATH = os.getenv("IMDB_INDEX_PATH", os.path.join(DATA_DIR, "imdb_index.bin"))
+
+# Polling ingestion (poller.py): list the items added to Jellyfin instead of receiving webhooks
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "60"))
+POLL_PAGE_SIZE = int(os.getenv("POLL_PAGE_SIZE", "100"))
+POLL_ITEM_TYPES = [item_type.strip() for item_type in os.getenv("POLL_ITEM_TYPES", "Movie,Series,Season,Episode").split(",") if item_type.strip()]
+
+# Admission control on /api, per worker: 429 above ADMISSION_MAX_IN_FLIGHT requests being processed,
+# 503 when the requests in flight plus the messages waiting for delivery reach ADMISSION_MAX_PENDING (0 disables a limit)
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "16"))
+ADMISSION_MAX_PENDING = int(os.getenv("ADMISSION_MAX_PENDING", "500"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "10"))
+
+# Routing (optional): JSON file of routes sending events to some connectors only, see README
+ROUTING_FILE = os.getenv("ROUTING_FILE", "")
+
+# Logging: written by a background thread, as text or JSON lines
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "urllib3=WARNING")  # per logger or module, e.g. connectors.matrix=DEBUG
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()  # text or json
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))  # fraction of the success lines kept
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # records beyond it are dropped
+
+# Technical details of Jellyfin items: reused without request for JELLYFIN_ITEM_CACHE_TTL seconds
+# (duplicate webhooks, retries, episodes of a season fetched together), then while the item is unchanged
+JELLYFIN_ITEM_CACHE_TTL = float(os.getenv("JELLYFIN_ITEM_CACHE_TTL", "600"))
+JELLYFIN_ITEM_CACHE_ITEMS = int(os.getenv("JELLYFIN_ITEM_CACHE_ITEMS", "4096"))
+
+# Cluster mode (optional): each event is processed by the node owning its series or item on a
+# consistent hash ring. Every node gets the same CLUSTER_PEERS, and its own URL in CLUSTER_SELF_URL
+CLUSTER_SELF_URL = os.getenv("CLUSTER_SELF_URL", "")
+CLUSTER_PEERS = [peer.strip() for peer in os.getenv("CLUSTER_PEERS", "").split(",") if peer.strip()]
+CLUSTER_VIRTUAL_NODES = int(os.getenv("CLUSTER_VIRTUAL_NODES", "100"))
+CLUSTER_HEALTH_INTERVAL = float(os.getenv("CLUSTER_HEALTH_INTERVAL", "5"))
+CLUSTER_FORWARD_TIMEOUT = float(os.getenv("CLUSTER_FORWARD_TIMEOUT", "30"))
+
+# Timeouts of outbound requests, per host: percentile of the recent latencies times a factor,
+# between a floor and a ceiling (which can be set per dependency, e.g. HTTP_TIMEOUT_CEILING_WHATSAPP)
+HTTP_TIMEOUT_DEFAULT = float(os.getenv("HTTP_TIMEOUT_DEFAULT", "10"))  # until enough requests were observed
+HTTP_TIMEOUT_FLOOR = float(os.getenv("HTTP_TIMEOUT_FLOOR", "2"))
+HTTP_TIMEOUT_CEILING = float(os.getenv("HTTP_TIMEOUT_CEILING", "30"))
+HTTP_TIMEOUT_PERCENTILE = float(os.getenv("HTTP_TIMEOUT_PERCENTILE", "0.99"))
+HTTP_TIMEOUT_FACTOR = float(os.getenv("HTTP_TIMEOUT_FACTOR", "3"))
+HTTP_TIMEOUT_WINDOW = int(os.getenv("HTTP_TIMEOUT_WINDOW", "200"))
+HTTP_TIMEOUT_MIN_SAMPLES = int(os.getenv("HTTP_TIMEOUT_MIN_SAMPLES", "20"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+
+# Connections: pooled per process, warmed up at worker boot (gunicorn.conf.py)
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+WARMUP_CONNECTIONS = os.getenv("WARMUP_CONNECTIONS", "True").lower() == "true"
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "5"))
+# Addresses of the warmed up hosts are cached, and reused while the resolver fails
+DNS_CACHE_TTL = float(os.getenv("DNS_CACHE_TTL", "300"))
+DNS_CACHE_STALE_TTL = float(os.getenv("DNS_CACHE_STALE_TTL", "3600"))
+
+# Notify-first delivery: a minimal notification is sent from the webhook payload right away,
+# then edited in place once the event is enriched (connectors without edits only get the full message)
+NOTIFY_FIRST = os.getenv("NOTIFY_FIRST", "False").lower() == "true"
+NOTIFY_FIRST_WORKERS = int(os.getenv("NOTIFY_FIRST_WORKERS", "4"))  # events enriched in the background at once
+NOTIFY_FIRST_EDIT_WAIT = float(os.getenv("NOTIFY_FIRST_EDIT_WAIT", "30"))  # seconds an edit waits for the first message
+
+# Gunicorn preload: the application is loaded once in the master and shared by the forked workers
+# (copy-on-write), see gunicorn.conf.py
+GUNICORN_PRELOAD = os.getenv("GUNICORN_PRELOAD", "False").lower() == "true"
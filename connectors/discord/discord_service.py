@@ -2,14 +2,30 @@
 
 import os
 import json
+import contextlib
 import requests
 from dotenv import load_dotenv
 from datetime import datetime
 import logging
+from utils import http_client
 
 load_dotenv()
 
 DISCORD_WEBHOOK_URL = os.getenv("DISCORD_WEBHOOK_URL")
+# Connected to when a worker starts
+DESTINATIONS = [DISCORD_WEBHOOK_URL]
+# Width of the poster shown in the embed
+POSTER_WIDTH = int(os.getenv("DISCORD_POSTER_WIDTH", "500"))
+# Pending notifications are packed into webhook messages of up to 10 embeds,
+# sent when full or after BATCH_LINGER seconds
+MAX_BATCH_SIZE = 10
+BATCH_LINGER = float(os.getenv("DISCORD_BATCH_LINGER", "1"))
+# Discord limits per message
+MAX_EMBED_CHARS = 6000
+MAX_FILES = 10
+MAX_UPLOAD_SIZE = int(os.getenv("DISCORD_MAX_UPLOAD_SIZE", str(8 * 1024 * 1024)))
+# Language of the TMDB texts and trailers, LANGUAGE if not set
+LANGUAGE = os.getenv("DISCORD_LANGUAGE")
 
 def format_message_for_discord(message: dict, options: dict) -> dict:
     """
@@ -22,15 +38,17 @@ def format_message_for_discord(message: dict, options: dict) -> dict:
     Returns:
         dict: The formatted payload for Discord.
     """
-    trailers = message.get("trailer", [])
+    trailers = message.get("trailer") or []
+    # Language of each trailer, e.g. "FR" and "EN"
+    labels = [language.split("-")[0].upper() for language in message.get("trailer_languages") or ["fr", "en"]]
     if len(trailers) == 1:
         trailer_text = f"\n[Trailer]({trailers[0]})"
     elif len(trailers) == 2:
-        trailer_text = f"\n[Trailer FR]({trailers[0]})\n[Trailer EN]({trailers[1]})"
+        trailer_text = f"\n[Trailer {labels[0]}]({trailers[0]})\n[Trailer {labels[1]}]({trailers[1]})"
     else:
         trailer_text = ""
 
-    links = message.get("media_link", {})
+    links = message.get("media_link", {}) or {}
     link_text = ""
     if "imdb" in links:
         link_text += f"\n[IMDb]({links['imdb']})"
@@ -39,7 +57,7 @@ def format_message_for_discord(message: dict, options: dict) -> dict:
 
     embed = {
         "title": message.get("title", "Notification"),
-        "description": message.get("description","") + "\n" + link_text.strip() + "\n" + trailer_text.strip(),
+        "description": (message.get("description") or "") + "\n" + link_text.strip() + "\n" + trailer_text.strip(),
         "color": 3447003,  # light blue
         "fields": [],
         "footer": {
@@ -78,10 +96,134 @@ def format_message_for_discord(message: dict, options: dict) -> dict:
     }
 
     if options.get('send_image') and options.get('picture_path'):
-        data["embeds"][0]["image"] = {"url": f"attachment://{os.path.basename(options['picture_path'])}"}
+        data["embeds"][0]["image"] = {"url": f"attachment://{attachment_name(options['picture_path'])}"}
 
     return data
 
+def attachment_name(picture_path: str) -> str:
+    """
+    Get the name of the attachment of a poster, referenced by `attachment://` in the embeds.
+
+    Args:
+        picture_path (str): Path of the poster.
+
+    Returns:
+        str: The attachment name.
+    """
+    return os.path.basename(picture_path)
+
+def embed_chars(embed: dict) -> int:
+    """
+    Count the characters of an embed towards the 6000 characters limit of a message.
+
+    Args:
+        embed (dict): The embed.
+
+    Returns:
+        int: Number of characters of the title, description, fields and footer.
+    """
+    count = len(embed.get("title", "")) + len(embed.get("description", ""))
+    count += sum(len(field["name"]) + len(field["value"]) for field in embed.get("fields", []))
+    return count + len(embed.get("footer", {}).get("text", ""))
+
+def pack_embeds(items: list) -> list:
+    """
+    Pack notifications into webhook messages, within the Discord limits.
+
+    A message holds up to MAX_BATCH_SIZE embeds, MAX_EMBED_CHARS characters
+    and MAX_FILES attachments totalling MAX_UPLOAD_SIZE bytes. A poster used
+    by several embeds is attached once.
+
+    Args:
+        items (list): (message, options) tuples.
+
+    Returns:
+        list: The messages, as (payload, attachments, indexes) tuples, where attachments
+        maps attachment names to (path, mimetype), and indexes are the positions of their items.
+    """
+    batches = []
+    embeds, attachments, indexes, chars, size = [], {}, [], 0, 0
+    for index, (message, options) in enumerate(items):
+        poster, file_size = None, 0
+        if options.get('send_image') and options.get('picture_path'):
+            try:
+                file_size = os.path.getsize(options['picture_path'])
+                poster = (attachment_name(options['picture_path']), options['picture_path'],
+                          options.get('picture_mimetype', 'image/jpeg'))
+            except OSError as e:
+                # e.g. pruned from the cache: the other notifications of the batch are still sent
+                logging.warning(f"Poster unavailable, sending the notification without it: {e}")
+                options = dict(options, send_image=False)
+        embed = format_message_for_discord(message, options)["embeds"][0]
+        poster_size = file_size if poster and poster[0] not in attachments else 0
+        if embeds and (len(embeds) >= MAX_BATCH_SIZE or chars + embed_chars(embed) > MAX_EMBED_CHARS
+                       or (poster_size and (len(attachments) >= MAX_FILES or size + poster_size > MAX_UPLOAD_SIZE))):
+            batches.append(({"content": "", "embeds": embeds}, attachments, indexes))
+            embeds, attachments, indexes, chars, size = [], {}, [], 0, 0
+            poster_size = file_size
+        if poster and poster[0] not in attachments:
+            attachments[poster[0]] = poster[1:]
+            size += poster_size
+        embeds.append(embed)
+        indexes.append(index)
+        chars += embed_chars(embed)
+    if embeds:
+        batches.append(({"content": "", "embeds": embeds}, attachments, indexes))
+    return batches
+
+def post_payload(payload: dict, attachments: dict, method: str = "POST", url: str = None, params: dict = None) -> requests.Response:
+    """
+    Post a message to the Discord webhook, with its attachments.
+
+    Args:
+        payload (dict): The message, with its embeds.
+        attachments (dict): Attachment names mapped to (path, mimetype).
+        method (str, optional): "PATCH" to edit a message.
+        url (str, optional): URL of the request. Defaults to the webhook.
+        params (dict, optional): Query parameters of the request.
+
+    Returns:
+        requests.Response: Response from the Discord API.
+    """
+    url = url or DISCORD_WEBHOOK_URL
+    if not attachments:
+        return http_client.request("discord", method, url, json=payload, params=params)
+    with contextlib.ExitStack() as stack:
+        files = {'payload_json': (None, json.dumps(payload), 'application/json')}
+        for number, (name, (path, mimetype)) in enumerate(attachments.items()):
+            files[f'files[{number}]'] = (name, stack.enter_context(open(path, 'rb')), mimetype)
+        return http_client.request("discord", method, url, files=files, params=params)
+
+def send_many(items: list) -> list:
+    """
+    Send several messages to the Discord webhook, packed into multi-embed messages.
+
+    Args:
+        items (list): (message, options) tuples
+
+    Returns:
+        list: The response of the webhook message carrying each item, None for the items not sent.
+    """
+    if not DISCORD_WEBHOOK_URL:
+        logging.error("DISCORD_WEBHOOK_URL is not set in the environment variables.")
+        raise ValueError("DISCORD_WEBHOOK_URL is not set in the environment variables.")
+
+    responses = [None] * len(items)
+    for payload, attachments, indexes in pack_embeds(items):
+        response = None
+        try:
+            response = post_payload(payload, attachments)
+            response.raise_for_status()
+            titles = ", ".join(embed.get('title', '') for embed in payload["embeds"])
+            logging.info(f"Message sent to Discord: {titles}", extra={"sampled": True})
+        except (requests.exceptions.RequestException, OSError) as e:
+            logging.error(f"An error occurred: {e}")
+            logging.error(f"Response content: {response.content if response is not None else 'No response'}")
+            continue
+        for index in indexes:
+            responses[index] = response
+    return responses
+
 def send_message(message: dict, options: dict = None) -> requests.Response:
     """
     Send message to a Discord webhook
@@ -93,32 +235,58 @@ def send_message(message: dict, options: dict = None) -> requests.Response:
     Returns:
         requests.Response: Response from the Discord API.
     """
+    return send_many([(message, options or {})])[0]
+
+def send_editable_message(message: dict, options: dict = None) -> str:
+    """
+    Send a message to the Discord webhook on its own, to edit it later.
+
+    Args:
+        message (dict): Message to send
+        options (dict, optional): Additional options for the message
+
+    Returns:
+        str: ID of the webhook message, None if it was not sent.
+    """
     if not DISCORD_WEBHOOK_URL:
-        logging.error("DISCORD_WEBHOOK_URL is not set in the environment variables.")
         raise ValueError("DISCORD_WEBHOOK_URL is not set in the environment variables.")
+    payload, attachments, _ = pack_embeds([(message, options or {})])[0]
+    try:
+        # wait=true: the webhook returns the created message, with its ID
+        response = post_payload(payload, attachments, params={"wait": "true"})
+        response.raise_for_status()
+        logging.info(f"Message sent to Discord: {message.get('title', '')}", extra={"sampled": True})
+        return response.json().get("id")
+    except (requests.exceptions.RequestException, OSError, ValueError) as e:
+        logging.error(f"An error occurred: {e}")
+        return None
+
+def edit_message(message_id: str, message: dict, options: dict = None) -> requests.Response:
+    """
+    Replace a webhook message, with the poster of the new message as its attachment.
 
-    payload = format_message_for_discord(message, options)
+    Args:
+        message_id (str): ID returned by `send_editable_message`.
+        message (dict): New message
+        options (dict, optional): Additional options for the message
 
+    Returns:
+        requests.Response: Response from the Discord API, None if the message was not edited.
+    """
+    payload, attachments, _ = pack_embeds([(message, options or {})])[0]
+    # The attachments kept by the message, here only the new poster if any
+    payload["attachments"] = [{"id": number, "filename": name} for number, name in enumerate(attachments)]
+    response = None
     try:
-        files = None
-        if options.get('send_image') and options.get('picture_path'):
-            files = {
-                'payload_json': (None, json.dumps(payload), 'application/json'),
-                'file1': (open(options['picture_path'], 'rb'))
-            }
-            response = requests.post(DISCORD_WEBHOOK_URL, files=files)
-        else:
-            response = requests.post(DISCORD_WEBHOOK_URL, json=payload)
-
+        response = post_payload(payload, attachments, method="PATCH", url=f"{DISCORD_WEBHOOK_URL}/messages/{message_id}")
         response.raise_for_status()
-        logging.info(f"Message sent successfully: {message}")
-    except requests.exceptions.RequestException as e:
+        logging.info(f"Message edited on Discord: {message.get('title', '')}", extra={"sampled": True})
+        return response
+    except (requests.exceptions.RequestException, OSError) as e:
         logging.error(f"An error occurred: {e}")
-        logging.error(f"Response content: {response.content if response else 'No response'}")
+        logging.error(f"Response content: {response.content if response is not None else 'No response'}")
         return None
 
-    return response
-
 if __name__ == "__main__":
     message = {
         "title": "Sample Title",
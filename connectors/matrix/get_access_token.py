@@ -15,7 +15,7 @@ payload = {
     "password": password
 }
 
-response = requests.post(url, headers=headers, json=payload)
+response = requests.post(url, headers=headers, json=payload, timeout=30)
 access_token = response.json().get("access_token")
 print(f"Access Token: {access_token}")
 
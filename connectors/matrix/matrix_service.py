@@ -1,18 +1,56 @@
 #!/usr/bin/env python3
 
 import os
+import html
+import uuid
+import tempfile
 import requests
 from dotenv import load_dotenv
 import logging
-#import tempfile # Ajout pour gérer le fichier temporaire de l'image
-
-logging.basicConfig(level=logging.DEBUG,format='%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s')
+from utils import http_client
 
 load_dotenv()
 
 MATRIX_URL = os.getenv("MATRIX_URL")
 ACCESS_TOKEN = os.getenv("ACCESS_TOKEN")
 ROOM_ID = os.getenv("ROOM_ID")
+# Connected to when a worker starts
+DESTINATIONS = [MATRIX_URL]
+POSTER_WIDTH = int(os.getenv("MATRIX_POSTER_WIDTH", "342"))
+# Send the poster and the text as one captioned image event instead of two events
+SINGLE_EVENT = os.getenv("MATRIX_SINGLE_EVENT", "False").lower() == "true"
+SEND_RETRIES = int(os.getenv("MATRIX_SEND_RETRIES", "2"))
+# Language of the TMDB texts and trailers, LANGUAGE if not set
+LANGUAGE = os.getenv("MATRIX_LANGUAGE")
+
+def format_technical_details(technical_details: dict) -> str:
+    """
+    Format the video, audio and subtitles of a media on one line.
+
+    Args:
+        technical_details (dict): The technical details of the message.
+
+    Returns:
+        str: The formatted details, empty if there are none.
+    """
+    tech_info_parts = []
+
+    video = technical_details.get('video', {})
+    if video:
+        video_str = f"🎥 {video.get('resolution', '')} | {video.get('codec', '')} | {video.get('hdr', '')}"
+        tech_info_parts.append(video_str)
+
+    audio_list = technical_details.get('audio')
+    if audio_list:
+        audio_str = f"🔊 {' | '.join(audio_list)}"
+        tech_info_parts.append(audio_str)
+
+    subs_list = technical_details.get('subtitles')
+    if subs_list:
+        subs_str = f"💬 {' | '.join(subs_list)}"
+        tech_info_parts.append(subs_str)
+
+    return '  •  '.join(tech_info_parts)
 
 def format_message(message: dict) -> str:
     """
@@ -33,27 +71,9 @@ def format_message(message: dict) -> str:
         if message.get('title'):
             message_parts.append(f"*{message.get('title')}*")
 
-        technical_details = message.get("technical_details")
-        if technical_details:
-            tech_info_parts = []
-
-            video = technical_details.get('video', {})
-            if video:
-                video_str = f"🎥 {video.get('resolution', '')} | {video.get('codec', '')} | {video.get('hdr', '')}"
-                tech_info_parts.append(video_str)
-
-            audio_list = technical_details.get('audio')
-            if audio_list:
-                audio_str = f"🔊 {' | '.join(audio_list)}"
-                tech_info_parts.append(audio_str)
-
-            subs_list = technical_details.get('subtitles')
-            if subs_list:
-                subs_str = f"💬 {' | '.join(subs_list)}"
-                tech_info_parts.append(subs_str)
-
-            if tech_info_parts:
-                message_parts.append(f"> {'  •  '.join(tech_info_parts)}")
+        tech_info = format_technical_details(message.get("technical_details") or {})
+        if tech_info:
+            message_parts.append(f"> {tech_info}")
 
         if message.get('description'):
             message_parts.append(f"```{message.get('description')}```")
@@ -70,14 +90,16 @@ def format_message(message: dict) -> str:
             #links_section.append(f"• TMDb: {links['tmdb']}")
 
         trailers = message.get("trailer") or []
+        # Language of each trailer, e.g. "FR" and "EN"
+        labels = [language.split("-")[0].upper() for language in message.get("trailer_languages") or ["fr", "en"]]
         if len(trailers) == 1:
             links_section.append(f"[Trailer]({trailers[0]})")
         elif len(trailers) >= 2:
-            links_section.append(f"[Trailer FR]({trailers[0]})")
-            links_section.append(f"[Trailer EN]({trailers[1]})")
+            links_section.append(f"[Trailer {labels[0]}]({trailers[0]})")
+            links_section.append(f"[Trailer {labels[1]}]({trailers[1]})")
             # if your service does not support markdown link format, uncomment the next lines
-            #links_section.append(f"• Trailer FR: {trailers[0]}")
-            #links_section.append(f"• Trailer EN: {trailers[1]}")
+            #links_section.append(f"• Trailer {labels[0]}: {trailers[0]}")
+            #links_section.append(f"• Trailer {labels[1]}: {trailers[1]}")
 
         if links_section:
             message_parts.append("\n".join(links_section))
@@ -90,7 +112,9 @@ def format_message(message: dict) -> str:
 
 def html_format_message(message: dict) -> str:
     """
-    Format message for Matrix channel in HTML.
+    Format message for Matrix channel in HTML, with the same parts as `format_message`.
+
+    Every value is escaped: titles, descriptions and links come from TMDB and Jellyfin.
 
     Args:
         message (dict): Message to send.
@@ -102,42 +126,49 @@ def html_format_message(message: dict) -> str:
         if not message:
             return ""
 
-        trailers = message.get("trailer") or []
-        if len(trailers) == 1:
-            trailer_text = f'<br><a href="{trailers[0]}">Trailer</a>'
-        elif len(trailers) >= 2:
-            trailer_text = f'<br><a href="{trailers[0]}">Trailer FR</a><br><a href="{trailers[1]}">Trailer EN</a>'
-        else:
-            trailer_text = ""
+        message_parts = []
 
-        links = message.get("media_link", {}) or {}
-        link_text = ""
-        if "imdb" in links and links["imdb"]:
-            link_text += f'<br><br><a href="{links["imdb"]}">IMDb</a>'
-        if "tmdb" in links and links["tmdb"]:
-            link_text += f'<br><a href="{links["tmdb"]}">TMDb</a>'
+        if message.get('title'):
+            message_parts.append(f"<h1>{html.escape(message.get('title'))}</h1>")
 
-        formatted_message = ""
-        if message.get("title"):
-             formatted_message += f'<h1>{message.get("title")}</h1><br/>'
+        tech_info = format_technical_details(message.get("technical_details") or {})
+        if tech_info:
+            message_parts.append(f"<blockquote>{html.escape(tech_info)}</blockquote>")
 
         if message.get('description'):
-            formatted_message += f'<pre>{message.get("description")}</pre>'
+            message_parts.append(f"<pre>{html.escape(message.get('description'))}</pre>")
+
+        links_section = []
+        links = message.get("media_link", {}) or {}
+        if links.get("imdb"):
+            links_section.append(f'<a href="{html.escape(links["imdb"])}">IMDb</a>')
+        if links.get("tmdb"):
+            links_section.append(f'<a href="{html.escape(links["tmdb"])}">TMDb</a>')
+
+        trailers = message.get("trailer") or []
+        labels = [language.split("-")[0].upper() for language in message.get("trailer_languages") or ["fr", "en"]]
+        if len(trailers) == 1:
+            links_section.append(f'<a href="{html.escape(trailers[0])}">Trailer</a>')
+        elif len(trailers) >= 2:
+            links_section.append(f'<a href="{html.escape(trailers[0])}">Trailer {html.escape(labels[0])}</a>')
+            links_section.append(f'<a href="{html.escape(trailers[1])}">Trailer {html.escape(labels[1])}</a>')
 
-        formatted_message += link_text
-        formatted_message += trailer_text
-        return formatted_message
+        if links_section:
+            message_parts.append("<br>".join(links_section))
+
+        return "<br><br>".join(message_parts)
 
     except Exception as e:
         logging.error(f"Error formatting message: {e}", exc_info=True)
         return ""
 
-def upload_image(image_path: str) -> str:
+def upload_image(image_path: str, mimetype: str = "image/jpeg") -> str:
     """
     Upload image to the Matrix server.
 
     Args:
         image_path (str): The local path to the image.
+        mimetype (str, optional): The mime type of the image.
 
     Returns:
         str: The content URI of the uploaded image.
@@ -147,14 +178,14 @@ def upload_image(image_path: str) -> str:
         return ""
 
     try:
-        url = f"{MATRIX_URL}/_matrix/media/r0/upload?filename={os.path.basename(image_path)}"
+        url = f"{MATRIX_URL}/_matrix/media/v3/upload?filename={os.path.basename(image_path)}"
 
         headers = {
             "Authorization": f"Bearer {ACCESS_TOKEN}",
-            "Content-Type": "image/jpeg"
+            "Content-Type": mimetype
         }
         with open(image_path, 'rb') as image_file:
-            response = requests.post(url, headers=headers, data=image_file)
+            response = http_client.post("matrix", url, headers=headers, data=image_file)
 
         response.raise_for_status()
         return response.json().get("content_uri")
@@ -163,10 +194,48 @@ def upload_image(image_path: str) -> str:
         logging.error(f"Error uploading image: {e}")
         return ""
 
+def send_event(content: dict) -> requests.Response:
+    """
+    Send an m.room.message event to the room.
+
+    The event is sent with `PUT .../send/m.room.message/{txnId}`: the transaction
+    ID is kept across retries, so the server never creates the event twice.
+
+    Args:
+        content (dict): Content of the event.
+
+    Returns:
+        requests.Response: The response from the Matrix server.
+
+    Raises:
+        requests.exceptions.RequestException: If the event could not be sent.
+    """
+    # associated documentation: https://spec.matrix.org/latest/client-server-api/#put_matrixclientv3roomsroomidsendeventtypetxnid
+    txn_id = f"jellyhookapi-{uuid.uuid4().hex}"
+    url = f"{MATRIX_URL}/_matrix/client/v3/rooms/{ROOM_ID}/send/m.room.message/{txn_id}"
+    headers = {
+        "Authorization": f"Bearer {ACCESS_TOKEN}",
+        "Content-Type": "application/json"
+    }
+    for attempt in range(SEND_RETRIES + 1):
+        try:
+            response = http_client.put("matrix", url, headers=headers, json=content)
+            if response.status_code < 500 or attempt == SEND_RETRIES:
+                response.raise_for_status()
+                return response
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == SEND_RETRIES:
+                raise
+        logging.warning(f"Retrying Matrix event {txn_id} ({attempt + 1}/{SEND_RETRIES}).")
+
 def send_message(message: dict, options: dict = None) -> requests.Response:
     """
     Send a message to a Matrix room.
 
+    With MATRIX_SINGLE_EVENT, a message with a poster is sent as one captioned
+    m.image event (upload + one event). Otherwise the poster and the text are
+    sent as two events.
+
     Args:
         message (dict): The message to send.
         options (dict): Additional options for the message, including image path.
@@ -177,51 +246,52 @@ def send_message(message: dict, options: dict = None) -> requests.Response:
     if options is None:
         options = {}
 
-    headers = {
-        "Authorization": f"Bearer {ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
     try:
+        formatted_message = format_message(message)
+        if not formatted_message:
+            logging.warning("Formatted message is empty, not sending text message.")
+            return None # Ne rien envoyer si le message est vide
+
         # Check if we need to send the image
         send_image = options.get('send_image')
         image_path = options.get('picture_path')
+        image_mimetype = options.get('picture_mimetype', 'image/jpeg')
         if send_image:
             if not image_path:
                 logging.error("send_image is True but picture_path is missing.")
             else:
                 # Upload the image and get the content URI
-                image_uri = upload_image(image_path)
+                image_uri = upload_image(image_path, image_mimetype)
                 if image_uri:
-                    # Send the image message
-                    send_image_url = f"{MATRIX_URL}/_matrix/client/r0/rooms/{ROOM_ID}/send/m.room.message"
                     image_info = {
                         "msgtype": "m.image",
                         "body": os.path.basename(image_path),
                         "url": image_uri,
                         "info": {
-                            "mimetype": "image/jpeg"
+                            "mimetype": image_mimetype,
+                            "size": os.path.getsize(image_path)
                         }
                     }
                     # resolution not hardcoded, let matrix handle this
-                    # "info": {"size": os.path.getsize(image_path), "w": 342, "h": 513}
-
-                    response = requests.post(send_image_url, headers=headers, json=image_info)
-                    response.raise_for_status()
-                    logging.info("Image sent successfully to Matrix.")
+                    if SINGLE_EVENT:
+                        # Media caption: body is the caption when filename is set
+                        # https://spec.matrix.org/latest/client-server-api/#media-captions
+                        image_info.update({
+                            "body": formatted_message,
+                            "filename": os.path.basename(image_path),
+                            "format": "org.matrix.custom.html",
+                            "formatted_body": html_format_message(message)
+                        })
+                        response = send_event(image_info)
+                        logging.info("Captioned image sent successfully to Matrix.", extra={"sampled": True})
+                        return response
+
+                    send_event(image_info)
+                    logging.info("Image sent successfully to Matrix.", extra={"sampled": True})
                 else:
                     logging.error("Failed to upload image, skipping image sending.")
 
-        # Send the formatted text message
-        formatted_message = format_message(message)
-        #html_formatted_message = html_format_message(message) # Optionnel, car vous ne l'utilisez pas
-
-        if not formatted_message:
-            logging.warning("Formatted message is empty, not sending text message.")
-            return None # Ne rien envoyer si le message est vide
-
         # Send the formatted message
-        send_text_url = f"{MATRIX_URL}/_matrix/client/r0/rooms/{ROOM_ID}/send/m.room.message"
-        # associated documentation: https://spec.matrix.org/latest/client-server-api/#send-m-room-message
         # changed from m.notice to m.text and comment format and formatted_body as I encounter issue sending message.
         text_info = {
             "msgtype": "m.text", # m.notice: for automated client, no answer expected
@@ -229,18 +299,83 @@ def send_message(message: dict, options: dict = None) -> requests.Response:
             #"format": "org.matrix.custom.html", # format used in formatted_body
             #"formatted_body": html_formatted_message # formatted version of body. Required if format is specified
         }
-        response = requests.post(send_text_url, headers=headers, json=text_info)
-        response.raise_for_status()
-        logging.info("Text message sent successfully to Matrix.")
+        response = send_event(text_info)
+        logging.info("Text message sent successfully to Matrix.", extra={"sampled": True})
 
         return response
     except requests.exceptions.RequestException as e:
         logging.error(f"Error sending message to Matrix: {e}")
-        if e.response:
+        if e.response is not None:
             logging.error(f"Response body: {e.response.text}")
         return None
 
+def send_editable_message(message: dict, options: dict = None) -> str:
+    """
+    Send a message to a Matrix room, to edit it later.
+
+    Args:
+        message (dict): The message to send.
+        options (dict): Additional options for the message.
+
+    Returns:
+        str: ID of the event carrying the text, None if it was not sent.
+    """
+    response = send_message(message, options)
+    if response is None:
+        return None
+    try:
+        return response.json().get("event_id")
+    except ValueError:
+        return None
+
+def edit_message(event_id: str, message: dict, options: dict = None) -> requests.Response:
+    """
+    Replace the text of a message with an m.replace edit.
+
+    The poster of the new message, if any, is sent as a reply to the edited
+    message: an edit cannot turn a text event into an image.
+
+    Args:
+        event_id (str): ID returned by `send_editable_message`.
+        message (dict): The new message.
+        options (dict): Additional options for the message, including image path.
+
+    Returns:
+        Response object: The response from the Matrix server, None if the message was not edited.
+    """
+    # associated documentation: https://spec.matrix.org/latest/client-server-api/#event-replacements
+    options = options or {}
+    formatted_message = format_message(message)
+    if not formatted_message:
+        logging.warning("Formatted message is empty, not editing the message.")
+        return None
+    try:
+        image_path = options.get('picture_path')
+        if options.get('send_image') and image_path:
+            image_mimetype = options.get('picture_mimetype', 'image/jpeg')
+            image_uri = upload_image(image_path, image_mimetype)
+            if image_uri:
+                send_event({
+                    "msgtype": "m.image",
+                    "body": os.path.basename(image_path),
+                    "url": image_uri,
+                    "info": {"mimetype": image_mimetype, "size": os.path.getsize(image_path)},
+                    "m.relates_to": {"m.in_reply_to": {"event_id": event_id}}
+                })
+        response = send_event({
+            "msgtype": "m.text",
+            "body": f"* {formatted_message}",  # fallback for clients without edits
+            "m.new_content": {"msgtype": "m.text", "body": formatted_message},
+            "m.relates_to": {"rel_type": "m.replace", "event_id": event_id}
+        })
+        logging.info("Message edited successfully on Matrix.", extra={"sampled": True})
+        return response
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Error editing message on Matrix: {e}")
+        return None
+
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s')
     message = {
         "title": "Example Title",
         "description": "Example Description",
@@ -261,7 +396,7 @@ if __name__ == "__main__":
 
     try:
         with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_file:
-            response = requests.get(image_url, stream=True)
+            response = http_client.get("tmdb_images", image_url, stream=True)
             response.raise_for_status()
             for chunk in response.iter_content(chunk_size=8192):
                 tmp_file.write(chunk)
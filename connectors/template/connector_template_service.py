@@ -4,6 +4,7 @@ import os
 import requests
 from dotenv import load_dotenv
 import logging
+from utils import http_client
 
 load_dotenv()
 
@@ -11,6 +12,8 @@ API_URL = os.getenv("NEW_SERVICE_API_URL")
 API_KEY = os.getenv("NEW_SERVICE_API_KEY")
 USERNAME = os.getenv("NEW_SERVICE_USERNAME")
 PASSWORD = os.getenv("NEW_SERVICE_PASSWORD")
+# Language of the TMDB texts and trailers, LANGUAGE if not set
+LANGUAGE = os.getenv("NEW_SERVICE_LANGUAGE")
 
 def format_message(message: dict) -> str:
     """
@@ -24,15 +27,17 @@ def format_message(message: dict) -> str:
     """
     try:
         # Markdown formatted
-        trailers = message.get("trailer", [])
+        trailers = message.get("trailer") or []
+        # Language of each trailer, e.g. "FR" and "EN"
+        labels = [language.split("-")[0].upper() for language in message.get("trailer_languages") or ["fr", "en"]]
         if len(trailers) == 1:
             trailer_text = f"\n[Trailer]({trailers[0]})"
         elif len(trailers) == 2:
-            trailer_text = f"\n[Trailer FR]({trailers[0]})\n[Trailer EN]({trailers[1]})"
+            trailer_text = f"\n[Trailer {labels[0]}]({trailers[0]})\n[Trailer {labels[1]}]({trailers[1]})"
         else:
             trailer_text = ""
 
-        links = message.get("media_link", {})
+        links = message.get("media_link", {}) or {}
         link_text = ""
         if "imdb" in links:
             link_text += f"\n\n[IMDb]({links['imdb']})"
@@ -68,7 +73,8 @@ def send_message(message: dict, options: dict = None) -> requests.Response:
     data = {'message': formatted_message}
 
     try:
-        response = requests.post(url, headers={'Authorization': f'Bearer {API_KEY}'}, data=data, auth=auth)
+        # Use the name of the connector as dependency name so it gets its own circuit breaker
+        response = http_client.post("new-service", url, headers={'Authorization': f'Bearer {API_KEY}'}, data=data, auth=auth)
         response.raise_for_status()
     except requests.exceptions.RequestException as e:
         logging.error(f"Error sending message: {e}")
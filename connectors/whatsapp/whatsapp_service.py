@@ -4,6 +4,7 @@ import os
 import requests
 from dotenv import load_dotenv
 import logging
+from utils import http_client
 
 load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
 
@@ -11,6 +12,12 @@ WHATSAPP_API_URL = os.getenv("WHATSAPP_API_URL")
 WHATSAPP_NUMBER = os.getenv("WHATSAPP_NUMBER")
 WHATSAPP_API_USERNAME = os.getenv("WHATSAPP_API_USERNAME")
 WHATSAPP_API_PWD = os.getenv("WHATSAPP_API_PWD")
+# Connected to when a worker starts
+DESTINATIONS = [WHATSAPP_API_URL]
+# Small thumbnail: WhatsApp shows the image inline at a small size anyway
+POSTER_WIDTH = int(os.getenv("WHATSAPP_POSTER_WIDTH", "185"))
+# Language of the TMDB texts and trailers, LANGUAGE if not set
+LANGUAGE = os.getenv("WHATSAPP_LANGUAGE")
 
 def format_message(message: dict) -> str:
     """
@@ -23,15 +30,17 @@ def format_message(message: dict) -> str:
         str: Formatted message for WhatsApp.
     """
 
-    trailers = message.get("trailer", [])
+    trailers = message.get("trailer") or []
+    # Language of each trailer, e.g. "FR" and "EN"
+    labels = [language.split("-")[0].upper() for language in message.get("trailer_languages") or ["fr", "en"]]
     if len(trailers) == 1:
         trailer_text = f"\n• Trailer: {trailers[0]}"
     elif len(trailers) == 2:
-        trailer_text = f"\n• Trailer FR: {trailers[0]}\n• Trailer EN: {trailers[1]}"
+        trailer_text = f"\n• Trailer {labels[0]}: {trailers[0]}\n• Trailer {labels[1]}: {trailers[1]}"
     else:
         trailer_text = ""
 
-    links = message.get("media_link", {})
+    links = message.get("media_link", {}) or {}
     link_text = ""
     if "imdb" in links:
         link_text += f"\n\n• IMDb: {links['imdb']}"
@@ -68,16 +77,31 @@ def send_message(message: dict, options: dict = None) -> requests.Response:
 
     if options and send_image and picture_path:
         data['caption'] = formatted_message
-        data['compress'] = "True"
-        files = {'image': ('image', open(options['picture_path'], 'rb'), 'image/png')}
+        # The poster is already a small variant, no need to recompress it
+        data['compress'] = "False"
     else:
         data['message'] = formatted_message
-        files = None
+
+    picture = None
+    if 'caption' in data:
+        try:
+            picture = open(picture_path, 'rb')
+        except OSError as e:
+            # e.g. pruned from the cache since the enrichment: send the text alone
+            logging.warning(f"Poster unavailable, sending the message without it: {e}")
+            url = f"{WHATSAPP_API_URL}/send/message"
+            data['message'] = data.pop('caption')
+            del data['compress']
 
     try:
-        response = requests.post(url, headers=headers, data=data, auth=auth, files=files)
+        if picture:
+            with picture:
+                files = {'image': (os.path.basename(picture_path), picture, options.get('picture_mimetype', 'image/jpeg'))}
+                response = http_client.post("whatsapp", url, headers=headers, data=data, auth=auth, files=files)
+        else:
+            response = http_client.post("whatsapp", url, headers=headers, data=data, auth=auth)
         response.raise_for_status()
-        logging.info(f"Message sent successfully: {message}")
+        logging.info(f"Message sent to WhatsApp: {message.get('title', '')}", extra={"sampled": True})
     except requests.exceptions.RequestException as e:
         logging.error(f"An error occurred: {e}")
         return None
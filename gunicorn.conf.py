@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Gunicorn hooks, loaded with `gunicorn --config gunicorn.conf.py app:app`.
+
+The number of workers and the bind address are given on the command line
+(see docker-compose.yml).
+"""
+
+import os
+import sys
+import gc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config.settings import GUNICORN_PRELOAD
+
+# Load the application once in the master: the workers are forked with its
+# modules, connectors and indexes already in memory, and share those pages
+# until they write to them (copy-on-write)
+preload_app = GUNICORN_PRELOAD
+
+if preload_app:
+    # No collection in the master while the application loads: freeing objects
+    # leaves holes in pages the workers would then write to. Enabled again once
+    # it is loaded, see when_ready.
+    gc.disable()
+
+def when_ready(server):
+    """
+    Load the shared read-only state in the master, before the workers are forked.
+
+    The loaded objects are then moved to the permanent generation: the
+    collector of a worker never visits them, it would write their headers
+    and copy the shared pages in every worker.
+    """
+    if preload_app:
+        from app import preload_shared_state
+        preload_shared_state()
+        gc.collect()
+        gc.freeze()
+        gc.enable()
+
+def post_fork(server, worker):
+    """
+    Make sure the collector runs in the forked worker, and start its background threads.
+    """
+    if preload_app:
+        gc.enable()
+        from app import start_worker
+        start_worker()
+
+def worker_exit(server, worker):
+    """
+    Deliver the messages queued by a stopping worker, within the graceful timeout.
+    """
+    # Nothing was queued by a worker that could not load the application
+    if "app" in sys.modules:
+        from app import drain_deliveries
+        drain_deliveries(server.cfg.graceful_timeout)
+
+def post_worker_init(worker):
+    """
+    Warm up the connections of a worker once it has loaded the application.
+    """
+    from config.settings import WARMUP_CONNECTIONS
+    if WARMUP_CONNECTIONS:
+        from app import warm_up_connections
+        warm_up_connections()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import argparse
+import logging
+from datetime import datetime, timezone
+import requests
+from config.settings import DATA_DIR, POLL_INTERVAL, POLL_PAGE_SIZE, POLL_ITEM_TYPES
+from utils.media_details import get_jellyfin_items
+
+CURSOR_PATH = os.path.join(DATA_DIR, "poll_cursor.json")
+
+def load_cursor() -> dict:
+    """
+    Load the polling cursor.
+
+    Returns:
+        dict: "min_date_last_saved" (ISO 8601 date) and "done_ids" (items already processed
+        at or after that date), empty if the poller never ran.
+    """
+    try:
+        with open(CURSOR_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_cursor(cursor: dict):
+    """
+    Persist the polling cursor atomically.
+
+    Args:
+        cursor (dict): Cursor returned by `load_cursor`.
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    temp_path = f"{CURSOR_PATH}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(cursor, f)
+    os.replace(temp_path, CURSOR_PATH)
+
+def parse_date(value: str) -> datetime:
+    """
+    Parse a Jellyfin date (e.g. "2024-05-01T12:34:56.1234567Z").
+
+    Args:
+        value (str): ISO 8601 date, with up to 7 fractional digits.
+
+    Returns:
+        datetime: The timezone-aware date, None if it cannot be parsed.
+    """
+    if not value:
+        return None
+    value = value.replace("Z", "+00:00")
+    main, dot, rest = value.partition(".")
+    if dot:
+        digits = "".join(c for c in rest if c.isdigit())
+        value = f"{main}.{digits[:6]}{rest[len(digits):]}"
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def item_to_event(item: dict) -> dict:
+    """
+    Convert a Jellyfin item into the data sent by the webhook template.
+
+    Args:
+        item (dict): Jellyfin item.
+
+    Returns:
+        dict: Data for `handle_media`, None for unsupported item types.
+    """
+    provider_ids = item.get('ProviderIds') or {}
+    data = {
+        "media_type": "movie" if item.get('Type') == "Movie" else "tv",
+        "imdb": provider_ids.get('Imdb', ''),
+        "tmdb": provider_ids.get('Tmdb', ''),
+        "item_id": item.get('Id', '')
+    }
+    if item.get('Type') in ("Movie", "Series"):
+        data["title"] = f"{item.get('Name')} ({item.get('ProductionYear', '')}) has been added"
+    elif item.get('Type') == "Season":
+        data["title"] = f"Season-added: {item.get('SeriesName')}, Saison {item.get('IndexNumber', 0)}"
+    elif item.get('Type') == "Episode":
+        data["title"] = (f"Episode-added: {item.get('SeriesName')}, "
+                         f"S{item.get('ParentIndexNumber') or 0:02d}E{item.get('IndexNumber') or 0:02d} - {item.get('Name')}")
+        data.update(series_id=item.get('SeriesId', ''), season_number=item.get('ParentIndexNumber'),
+                    episode_number=item.get('IndexNumber'))
+    else:
+        return None
+    return data
+
+def poll_once(dispatch, page_size: int = POLL_PAGE_SIZE, item_types: list = POLL_ITEM_TYPES) -> int:
+    """
+    Process the items added to Jellyfin since the cursor, page by page.
+
+    Items saved since the cursor but created before it (metadata refreshes)
+    are skipped. The processed item IDs are saved after each page, so a
+    restart in the middle of a scan resumes without sending duplicates.
+    An item is only marked as processed once dispatched: the cursor does not
+    move past the items that failed, the next poll dispatches them again.
+
+    Args:
+        dispatch (callable): Called with the webhook-like data of each new item.
+        page_size (int, optional): Number of items per Jellyfin request.
+        item_types (list, optional): Jellyfin item types to process.
+
+    Returns:
+        int: Number of items dispatched.
+    """
+    cursor = load_cursor()
+    if not cursor.get("min_date_last_saved"):
+        # First run: only notify what is added from now on
+        cursor = {"min_date_last_saved": datetime.now(timezone.utc).isoformat(), "done_ids": []}
+        save_cursor(cursor)
+        logging.info(f"Polling cursor initialized to {cursor['min_date_last_saved']}.")
+        return 0
+
+    since = parse_date(cursor["min_date_last_saved"])
+    done_ids = set(cursor.get("done_ids", []))
+    newest = since
+    # Date last saved of the items processed (or skipped) by this poll
+    handled = {}
+    # Date last saved of the first item that failed
+    retry_from = None
+    dispatched = 0
+    start_index = 0
+    while True:
+        page = get_jellyfin_items(limit=page_size, item_types=item_types, start_index=start_index,
+                                  min_date_last_saved=cursor["min_date_last_saved"], sort_order="Ascending",
+                                  raise_errors=True)
+        for item in page:
+            saved = parse_date(item.get('DateLastSaved')) or parse_date(item.get('DateCreated')) or since
+            newest = max(newest, saved)
+            created = parse_date(item.get('DateCreated'))
+            if item.get('Id') in done_ids or (created and created < since):
+                handled[item.get('Id')] = saved
+                continue
+            data = item_to_event(item)
+            if data:
+                try:
+                    dispatch(data)
+                    dispatched += 1
+                except Exception as e:
+                    logging.error(f"Error handling polled item {item.get('Id')}, it will be retried: {e}")
+                    retry_from = min(retry_from or saved, saved)
+                    continue
+            handled[item.get('Id')] = saved
+            done_ids.add(item.get('Id'))
+        cursor["done_ids"] = sorted(done_ids)
+        save_cursor(cursor)
+        if len(page) < page_size:
+            break
+        start_index += page_size
+
+    # Move the cursor forward, up to the first failed item so it is polled again.
+    # MinDateLastSaved is inclusive, so the items processed since the new cursor
+    # date are kept to not send them twice.
+    next_since = retry_from or newest
+    cursor = {"min_date_last_saved": next_since.isoformat(),
+              "done_ids": sorted(item_id for item_id, saved in handled.items() if saved >= next_since)}
+    save_cursor(cursor)
+    return dispatched
+
+if __name__ == "__main__":
+    from app import dispatch_event
+    from utils.delivery import wait_for_deliveries
+
+    parser = argparse.ArgumentParser(description="Poll Jellyfin for new items instead of (or in addition to) the webhook plugin.")
+    parser.add_argument("--once", action="store_true", help="poll once and exit")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL, help=f"seconds between polls (default: {POLL_INTERVAL})")
+    parser.add_argument("--page-size", type=int, default=POLL_PAGE_SIZE, help=f"items per Jellyfin request (default: {POLL_PAGE_SIZE})")
+    parser.add_argument("--since", help="ISO 8601 date to restart from, e.g. 2024-05-01T00:00:00Z (default: the saved cursor)")
+    args = parser.parse_args()
+
+    if args.since:
+        if not parse_date(args.since):
+            parser.error(f"invalid date: {args.since}")
+        save_cursor({"min_date_last_saved": parse_date(args.since).isoformat(), "done_ids": []})
+
+    while True:
+        try:
+            count = poll_once(dispatch_event, args.page_size)
+            if count:
+                logging.info(f"Dispatched {count} new items from Jellyfin.")
+        except requests.RequestException as e:
+            logging.error(f"Polling failed, the cursor was kept: {e}")
+        if args.once:
+            wait_for_deliveries()
+            break
+        time.sleep(args.interval)
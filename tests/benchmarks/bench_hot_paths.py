@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks of the pure functions run on every event.
+
+Run from the root of the project:
+
+    python tests/benchmarks/bench_hot_paths.py                    # compare with the baseline
+    python tests/benchmarks/bench_hot_paths.py --update-baseline  # store a new baseline
+
+The first run stores the baseline. The script exits with status 1 when a
+function gets slower, or allocates more, than the baseline allows.
+"""
+
+import os
+import sys
+import glob
+import json
+import timeit
+import argparse
+import tracemalloc
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, ROOT)
+
+from utils.media_details import analyze_french_version, _get_resolution_label, extract_technical_details
+from utils.processing import is_season_ep_or_movie, format_message
+from connectors.discord.discord_service import format_message_for_discord
+
+FIXTURES_DIR = os.path.join(ROOT, "tests", "mock_jellyfin", "data")
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+STREAMS_PER_ITEM = 60
+
+# Track titles as found in real libraries, to vary the streams of the fixtures
+EXTRA_TRACKS = [
+    ("Audio", "fre", "Français (VFF) E-AC3 5.1"),
+    ("Audio", "fre", "French Canadian AC3 5.1"),
+    ("Audio", "fra", "Français AAC Stereo"),
+    ("Audio", "eng", "English (Commentary) AAC Stereo"),
+    ("Audio", "jpn", "Japanese FLAC 2.0"),
+    ("Subtitle", "fre", "Français (Forced) SUBRIP"),
+    ("Subtitle", "fre", "Français (CA) PGS"),
+    ("Subtitle", "eng", "English (SDH) SUBRIP"),
+    ("Subtitle", "spa", "Español (Latinoamérica) SUBRIP"),
+    ("Subtitle", "ger", "Deutsch PGS"),
+]
+
+def load_items() -> list:
+    """
+    Load the mock Jellyfin items, scaled up to STREAMS_PER_ITEM streams each.
+
+    Returns:
+        list: Jellyfin items with a Path and their MediaStreams.
+    """
+    items = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, "*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            item = json.load(f)
+        streams = list(item.get("MediaStreams", []))
+        i = 0
+        while len(streams) < STREAMS_PER_ITEM:
+            stream_type, language, display_title = EXTRA_TRACKS[i % len(EXTRA_TRACKS)]
+            streams.append({"Type": stream_type, "Language": language, "DisplayTitle": f"{display_title} #{i}"})
+            i += 1
+        item["MediaStreams"] = streams
+        item["Path"] = f"/media/{item.get('Name')}/{item.get('Name')}.MULTi.TRUEFRENCH.1080p.mkv"
+        items.append(item)
+    return items
+
+def build_cases() -> dict:
+    """
+    Build one callable per benchmarked function, each running it over all the fixtures.
+
+    One operation is one call of such a callable, e.g. the analysis of the
+    ~150 audio and subtitle streams of the fixtures for analyze_french_version.
+
+    Returns:
+        dict: Callables keyed by benchmark name.
+    """
+    items = load_items()
+    streams = [stream for item in items for stream in item["MediaStreams"]]
+    audio_and_subtitles = [(s.get("DisplayTitle"), s.get("Language"), items[0]["Path"])
+                           for s in streams if s.get("Type") in ("Audio", "Subtitle")]
+    dimensions = [(s.get("Width"), s.get("Height")) for s in streams if s.get("Type") == "Video"] + \
+                 [(3840, 1600), (1916, 1080), (1280, 536), (720, 480), (None, 576), (None, None)]
+    titles = [("movie", "Inception (2010) has been added"),
+              ("tv", "Season-added: Breaking Bad, Saison 2"),
+              ("tv", "Episode-added: Breaking Bad, S02E03 - Bit by a Dead Bee"),
+              ("tv", "Breaking Bad (2008) has been added")]
+    details = [extract_technical_details(item) for item in items]
+    trailers = ["https://www.youtube.com/watch?v=fr", "https://www.youtube.com/watch?v=en"]
+    links = {"imdb": "https://imdb.com/title/tt1375666", "tmdb": "https://tmdb.org/movie/27205"}
+    overview = "Dom Cobb est un voleur expérimenté dans l'art périlleux de l'extraction. " * 5
+    messages = [format_message("Inception (2010)", overview, links, trailers, d) for d in details]
+    options = {"send_image": False, "picture_path": None}
+
+    return {
+        "analyze_french_version": lambda: [analyze_french_version(*args) for args in audio_and_subtitles],
+        "_get_resolution_label": lambda: [_get_resolution_label(*args) for args in dimensions],
+        "is_season_ep_or_movie": lambda: [is_season_ep_or_movie(*args) for args in titles],
+        "extract_technical_details": lambda: [extract_technical_details(item) for item in items],
+        "format_message": lambda: [format_message("Inception (2010)", overview, links, trailers, d) for d in details],
+        "format_message_for_discord": lambda: [format_message_for_discord(m, options) for m in messages],
+    }
+
+def measure(func, repeat: int = 5) -> dict:
+    """
+    Measure the speed and the allocations of a callable.
+
+    Args:
+        func (callable): Function to measure, without arguments.
+        repeat (int, optional): Number of timing runs, the best one is kept.
+
+    Returns:
+        dict: "ops_per_sec" (calls per second) and "alloc_bytes" (peak memory allocated by one call).
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+
+    func()  # Warm up caches (compiled regexes...) so they do not count as allocations
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start, _ = tracemalloc.get_traced_memory()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"ops_per_sec": round(1 / best, 1), "alloc_bytes": peak - start}
+
+def compare(results: dict, baseline: dict, speed_tolerance: float, alloc_tolerance: float) -> list:
+    """
+    Compare results with the baseline.
+
+    Args:
+        results (dict): Measures keyed by benchmark name.
+        baseline (dict): Measures of the baseline.
+        speed_tolerance (float): Allowed slowdown, e.g. 0.25 for 25% fewer operations per second.
+        alloc_tolerance (float): Allowed increase of the allocated memory, e.g. 0.1 for 10%.
+
+    Returns:
+        list: Descriptions of the regressions, empty if there is none.
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        if result["ops_per_sec"] < reference["ops_per_sec"] * (1 - speed_tolerance):
+            regressions.append(f"{name}: {result['ops_per_sec']} ops/s, baseline {reference['ops_per_sec']} ops/s")
+        if result["alloc_bytes"] > reference["alloc_bytes"] * (1 + alloc_tolerance) + 1024:
+            regressions.append(f"{name}: {result['alloc_bytes']} bytes allocated, baseline {reference['alloc_bytes']} bytes")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the hot-path functions and check them against a baseline.")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file (default: tests/benchmarks/baseline.json)")
+    parser.add_argument("--update-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--speed-tolerance", type=float, default=0.25, help="allowed slowdown (default: 0.25)")
+    parser.add_argument("--alloc-tolerance", type=float, default=0.10, help="allowed allocation increase (default: 0.10)")
+    parser.add_argument("--only", help="comma-separated benchmark names to run")
+    args = parser.parse_args()
+
+    cases = build_cases()
+    if args.only:
+        cases = {name: func for name, func in cases.items() if name in args.only.split(",")}
+
+    results = {}
+    for name, func in cases.items():
+        results[name] = measure(func)
+        print(f"{name:30} {results[name]['ops_per_sec']:>12.1f} ops/s {results[name]['alloc_bytes']:>10} bytes")
+
+    if args.update_baseline or not os.path.exists(args.baseline):
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline stored in {args.baseline}")
+        sys.exit(0)
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.speed_tolerance, args.alloc_tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the offline IMDb to TMDB index.
+
+Run from the root of the project:
+
+    python tests/benchmarks/bench_imdb_index.py                    # synthetic exports, 1M entries
+    python tests/benchmarks/bench_imdb_index.py --entries 200000
+    python tests/benchmarks/bench_imdb_index.py --sources movie_ids.json.gz tv_series_ids.json.gz
+
+Reports the build time, the size of the index file, the memory used by an
+opened index (compared with the same entries in a dict) and the lookup time
+of IMDb IDs found and not found in the index.
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import timeit
+import argparse
+import tempfile
+import tracemalloc
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, ROOT)
+
+from utils.imdb_index import build_index, read_export, ImdbIndex
+
+def write_exports(directory: str, entries: int, seed: int = 0) -> list:
+    """
+    Write synthetic movie and TV export files, with an `imdb_id` on each line.
+
+    Args:
+        directory (str): Directory of the files.
+        entries (int): Total number of entries.
+        seed (int, optional): Seed of the random IMDb IDs.
+
+    Returns:
+        list: Paths of the files.
+    """
+    rng = random.Random(seed)
+    numbers = rng.sample(range(1, 40_000_000), entries)
+    paths = []
+    for name, share in (("movie_ids_bench.json.gz", 0.8), ("tv_series_ids_bench.json.gz", 0.2)):
+        path = os.path.join(directory, name)
+        count = int(entries * share) if name.startswith("movie") else len(numbers)
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            for tmdb_id in range(1, count + 1):
+                number = numbers.pop()
+                f.write(json.dumps({"adult": False, "id": tmdb_id, "imdb_id": f"tt{number:07d}",
+                                    "original_title": f"Title {tmdb_id}", "popularity": 0.6}) + "\n")
+        paths.append(path)
+    return paths
+
+def rss_kb() -> int:
+    """
+    Get the resident memory of this process (Linux only).
+
+    Returns:
+        int: Resident set size in kB, None if unavailable.
+    """
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def time_lookups(lookup, imdb_ids: list) -> float:
+    """
+    Time the lookup of IMDb IDs.
+
+    Returns:
+        float: Best time per lookup in microseconds, over 5 repeats.
+    """
+    timer = timeit.Timer(lambda: [lookup(imdb_id) for imdb_id in imdb_ids])
+    return min(timer.repeat(repeat=5, number=1)) / len(imdb_ids) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the offline IMDb to TMDB index.")
+    parser.add_argument("--entries", type=int, default=1_000_000, help="entries of the synthetic exports (default: 1000000)")
+    parser.add_argument("--sources", nargs="+", help="real export files, instead of synthetic ones")
+    parser.add_argument("--lookups", type=int, default=100_000, help="lookups per measure (default: 100000)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        sources = args.sources or write_exports(directory, args.entries)
+        output = os.path.join(directory, "imdb_index.bin")
+
+        start = time.perf_counter()
+        count = build_index(sources, output)
+        build_seconds = time.perf_counter() - start
+        if not count:
+            sys.exit("No entry with an `imdb_id` in the sources.")
+
+        known = [f"tt{number:07d}" for number, _, _ in read_export(sources[0])]
+        rng = random.Random(1)
+        hits = [rng.choice(known) for _ in range(args.lookups)]
+        misses = [f"tt{rng.randrange(40_000_000, 90_000_000)}" for _ in range(args.lookups)]
+
+        rss_before = rss_kb()
+        tracemalloc.start()
+        index = ImdbIndex(output)
+        index_heap = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        hit_us = time_lookups(index.lookup, hits)
+        miss_us = time_lookups(index.lookup, misses)
+        rss_after = rss_kb()
+
+        tracemalloc.start()
+        mapping = {f"tt{number:07d}": (media_type, tmdb_id)
+                   for source in sources for number, tmdb_id, media_type in read_export(source)}
+        dict_heap = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        dict_hit_us = time_lookups(mapping.get, hits)
+
+        results = [
+            ("entries", f"{count}"),
+            ("build", f"{build_seconds:.2f} s"),
+            ("index file", f"{os.path.getsize(output) / 1024 / 1024:.1f} MiB"),
+            ("index heap", f"{index_heap / 1024:.1f} KiB"),
+            ("index RSS growth", f"{(rss_after - rss_before) / 1024:.1f} MiB (mapped pages, shared between processes)"
+                                 if rss_before is not None else "n/a"),
+            ("dict heap (reference)", f"{dict_heap / 1024 / 1024:.1f} MiB"),
+            ("lookup, found", f"{hit_us:.2f} us"),
+            ("lookup, not found", f"{miss_us:.2f} us"),
+            ("dict lookup (reference)", f"{dict_hit_us:.2f} us"),
+        ]
+        for label, value in results:
+            print(f"{label + ':':<25} {value}")
+        index.close()
+
+if __name__ == "__main__":
+    main()
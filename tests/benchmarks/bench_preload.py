@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the gunicorn workers, with and without the preloaded application (GUNICORN_PRELOAD).
+
+Run from the root of the project (Linux only, gunicorn must be installed):
+
+    python tests/benchmarks/bench_preload.py
+    python tests/benchmarks/bench_preload.py --workers 8 --rounds 5 --requests 500
+
+Starts gunicorn with gunicorn.conf.py in both modes and reports the time
+until every worker has loaded the application, and the memory of each worker
+read from /proc/<pid>/smaps_rollup after `--requests` requests: RSS, PSS
+(shared pages divided between the processes sharing them) and USS (pages
+private to the worker). The total PSS of the master and its workers is what
+the whole server costs.
+"""
+
+import os
+import sys
+import time
+import socket
+import signal
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+# gunicorn.conf.py, plus a marker file written by each worker once it has loaded the application
+CONFIG = """
+__file__ = {config!r}
+exec(compile(open(__file__).read(), __file__, "exec"))
+_post_worker_init = post_worker_init
+
+def post_worker_init(worker):
+    _post_worker_init(worker)
+    open(os.path.join({ready_dir!r}, str(os.getpid())), "w").close()
+"""
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def memory_kb(pid: int) -> dict:
+    """
+    Get the memory of a process (Linux only).
+
+    Args:
+        pid (int): ID of the process.
+
+    Returns:
+        dict: RSS, PSS and USS in kB.
+    """
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1])
+    return {"rss": values["Rss"], "pss": values["Pss"],
+            "uss": values["Private_Clean"] + values["Private_Dirty"]}
+
+def run(preload: bool, args, work_dir: str) -> dict:
+    """
+    Start gunicorn, wait for its workers, send the requests and measure the memory.
+
+    Args:
+        preload (bool): Value of GUNICORN_PRELOAD.
+        args (argparse.Namespace): Command line arguments.
+        work_dir (str): Directory of the cache, data and marker files.
+
+    Returns:
+        dict: Startup time in seconds, memory of the master and of each worker.
+    """
+    ready_dir = tempfile.mkdtemp(dir=work_dir)
+    config = os.path.join(ready_dir, "gunicorn.conf.py")
+    with open(config, "w") as f:
+        f.write(CONFIG.format(config=os.path.join(ROOT, "gunicorn.conf.py"), ready_dir=ready_dir))
+
+    port = free_port()
+    env = dict(os.environ, GUNICORN_PRELOAD=str(preload), WARMUP_CONNECTIONS="False", LOG_LEVEL="ERROR",
+               CACHE_DIR=os.path.join(work_dir, "cache"), DATA_DIR=os.path.join(work_dir, "data"))
+    start = time.monotonic()
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "--config", config, "--workers", str(args.workers),
+                               "--bind", f"127.0.0.1:{port}", "app:app"], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while len(os.listdir(ready_dir)) - 1 < args.workers:
+            if server.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with status {server.returncode}")
+            if time.monotonic() - start > 60:
+                raise RuntimeError("workers not ready after 60s")
+            time.sleep(0.005)
+        startup = time.monotonic() - start
+
+        for _ in range(args.requests):
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/status", timeout=10).read()
+        time.sleep(args.settle)
+
+        workers = [int(name) for name in os.listdir(ready_dir) if name.isdigit()]
+        return {"startup": startup, "master": memory_kb(server.pid), "workers": [memory_kb(pid) for pid in workers]}
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+def summarize(results: list) -> dict:
+    workers = [worker for result in results for worker in result["workers"]]
+    return {
+        "startup": statistics.median(result["startup"] for result in results),
+        "rss": statistics.mean(worker["rss"] for worker in workers),
+        "pss": statistics.mean(worker["pss"] for worker in workers),
+        "uss": statistics.mean(worker["uss"] for worker in workers),
+        "total_pss": statistics.median(result["master"]["pss"] + sum(worker["pss"] for worker in result["workers"])
+                                       for result in results),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the gunicorn workers with and without preload.")
+    parser.add_argument("--workers", type=int, default=4, help="number of workers (default: 4)")
+    parser.add_argument("--rounds", type=int, default=3, help="servers started in each mode (default: 3)")
+    parser.add_argument("--requests", type=int, default=200, help="requests sent before measuring (default: 200)")
+    parser.add_argument("--settle", type=float, default=1, help="seconds waited before measuring (default: 1)")
+    args = parser.parse_args()
+
+    summaries = {}
+    with tempfile.TemporaryDirectory(prefix="jellyhookapi-preload-") as work_dir:
+        for preload in (False, True):
+            summaries[preload] = summarize([run(preload, args, work_dir) for _ in range(args.rounds)])
+
+    print(f"{args.workers} workers, {args.rounds} rounds, {args.requests} requests\n")
+    print(f"{'':<12}{'startup (s)':>12}{'RSS/worker':>12}{'PSS/worker':>12}{'USS/worker':>12}{'total PSS':>12}")
+    for preload, summary in summaries.items():
+        print(f"{'preload' if preload else 'no preload':<12}{summary['startup']:>12.2f}"
+              f"{summary['rss']:>9.0f} kB{summary['pss']:>9.0f} kB{summary['uss']:>9.0f} kB"
+              f"{summary['total_pss']:>9.0f} kB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Run a local cluster of JellyHookAPI processes and check the partitioning.
+
+Run from the root of the project:
+
+    python tests/cluster/run_local_cluster.py --nodes 3
+
+Season events (which need no TMDB or Jellyfin access) are sent to random
+nodes; each one must be processed by the owner of its series on the ring.
+One node is then stopped, and the events must move to the remaining nodes.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+import requests
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, ROOT)
+
+from utils.cluster import HashRing, partition_key, NODE_HEADER
+
+HEALTH_INTERVAL = 1
+
+def start_node(port: int, peers: list, data_dir: str) -> subprocess.Popen:
+    env = dict(os.environ,
+               CLUSTER_SELF_URL=f"http://127.0.0.1:{port}",
+               CLUSTER_PEERS=",".join(peers),
+               CLUSTER_HEALTH_INTERVAL=str(HEALTH_INTERVAL),
+               DATA_DIR=os.path.join(data_dir, str(port)),
+               LOG_LEVEL="WARNING")
+    code = f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"
+    return subprocess.Popen([sys.executable, "-c", code], cwd=ROOT, env=env)
+
+def wait_until_up(url: str, timeout: float = 20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{url}/cluster/health", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not start")
+
+def check_events(nodes: list, alive: list, events: list) -> int:
+    """
+    Send each event to a random alive node and check it was processed by its owner.
+
+    Returns:
+        int: Number of misplaced events.
+    """
+    ring = HashRing(alive)
+    errors = 0
+    for event in events:
+        response = requests.post(f"{random.choice(alive)}/api", json=event, timeout=30)
+        expected = ring.owner(partition_key(event))
+        processed_by = response.headers.get(NODE_HEADER)
+        if response.status_code != 200 or processed_by != expected:
+            errors += 1
+            print(f"  {event['title']}: {response.status_code} on {processed_by}, expected {expected}")
+    owners = {node: sum(ring.owner(partition_key(event)) == node for event in events) for node in alive}
+    print(f"  {len(events) - errors}/{len(events)} events processed by their owner, per node: {owners}")
+    return errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the cluster partitioning with local processes.")
+    parser.add_argument("--nodes", type=int, default=3, help="number of nodes (default: 3)")
+    parser.add_argument("--base-port", type=int, default=7781, help="port of the first node (default: 7781)")
+    parser.add_argument("--events", type=int, default=40, help="number of events per round (default: 40)")
+    args = parser.parse_args()
+
+    nodes = [f"http://127.0.0.1:{args.base_port + i}" for i in range(args.nodes)]
+    events = [{"media_type": "tv", "title": f"Season-added: Series {i % 15}, Saison {i}"} for i in range(args.events)]
+    data_dir = tempfile.mkdtemp(prefix="jellyhookapi-cluster-")
+    processes = [start_node(args.base_port + i, nodes, data_dir) for i in range(args.nodes)]
+    errors = 0
+    try:
+        for node in nodes:
+            wait_until_up(node)
+
+        print(f"All {len(nodes)} nodes up:")
+        errors += check_events(nodes, nodes, events)
+
+        processes[-1].terminate()
+        processes[-1].wait()
+        time.sleep(HEALTH_INTERVAL * 3)
+        print(f"{nodes[-1]} stopped:")
+        errors += check_events(nodes, nodes[:-1], events)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    sys.exit(1 if errors else 0)
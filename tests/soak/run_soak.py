@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Soak test of the whole pipeline, to catch memory, file descriptor and disk leaks.
+
+Run from the root of the project:
+
+    python tests/soak/run_soak.py                  # 5000 events
+    python tests/soak/run_soak.py --events 20000 --sample-every 1000
+
+Thousands of events are posted to `/api` of the application (in process,
+with the Flask test client). TMDB, the TMDB images, Jellyfin, Discord,
+WhatsApp and Matrix are replaced by a local fake server. The events come
+from a library of `--library` distinct events: the warm-up posts each of
+them once, in random order, so every lookup is cached on disk and the
+caches are full; the following events are drawn from the same library and
+must then leave everything bounded.
+
+The in-memory caches are limited to `--cache-items` entries so they reach
+their bound during the warm-up. The RSS, open file descriptors, disk usage
+(posters, data and temporary directories), TMDB lookups cached on disk and
+Python heap are sampled along the run. The script exits with status 1 when
+one of them grows, after the warm-up, by more than its threshold per 1000
+events.
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+FIXTURES_DIR = os.path.join(ROOT, "tests", "mock_jellyfin", "data")
+
+def load_fixture(name: str) -> dict:
+    with open(os.path.join(FIXTURES_DIR, name), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+class FakeServices(BaseHTTPRequestHandler):
+    """
+    TMDB (/tmdb), TMDB images (/images), Jellyfin (/jellyfin), Discord (/discord),
+    WhatsApp (/whatsapp) and Matrix (/matrix), answering like the real services.
+    """
+
+    protocol_version = "HTTP/1.1"
+    posters = 1000
+    poster_bytes = b"\xff" * 4096
+    movie = load_fixture("movie_details.json")
+    episode = load_fixture("episode_details.json")
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status: int, body=None, content_type: str = "application/json"):
+        payload = body if isinstance(body, bytes) else json.dumps(body if body is not None else {}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        service, path = parts[0], parts[1:]
+        if service == "tmdb":
+            self.tmdb(path)
+        elif service == "images":
+            self.reply(200, self.poster_bytes, "image/jpeg")
+        elif service == "jellyfin":
+            self.jellyfin(path, parse_qs(url.query))
+        else:
+            self.reply(404)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.startswith("/matrix/"):
+            self.reply(200, {"content_uri": "mxc://soak/poster"})
+        elif self.path.startswith("/discord/"):
+            self.reply(204, b"")
+        else:
+            self.reply(200, {"status": "ok"})
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.reply(200, {"event_id": f"${random.getrandbits(64):x}"})
+
+    def tmdb(self, path: list):
+        # /3/configuration, /3/<type>/<id>, /3/<type>/<id>/videos, /3/find/<imdb>
+        host = f"http://{self.headers['Host']}"
+        if path[1:] == ["configuration"]:
+            self.reply(200, {"images": {"secure_base_url": f"{host}/images/t/p/",
+                                        "poster_sizes": ["w92", "w154", "w185", "w342", "w500", "w780", "original"]}})
+        elif path[1] == "find":
+            self.reply(200, {"movie_results": [], "tv_results": [], "tv_episode_results": [{"id": 1}]})
+        elif len(path) == 4 and path[3] == "videos":
+            self.reply(200, {"results": [{"name": "Bande-annonce officielle", "key": f"fr{path[2]}"},
+                                         {"name": "Official Trailer", "key": f"en{path[2]}"}]})
+        elif len(path) == 3:
+            tmdb_id = int(path[2])
+            name = "title" if path[1] == "movie" else "name"
+            date = "release_date" if path[1] == "movie" else "first_air_date"
+            self.reply(200, {"id": tmdb_id, name: f"Title {tmdb_id}", date: "2020-05-01", "overview": "Overview",
+                             "poster_path": f"/poster{tmdb_id % self.posters}.jpg"})
+        else:
+            self.reply(404)
+
+    def jellyfin(self, path: list, query: dict):
+        # /Users/<user>/Items/<id> and /Users/<user>/Items?ParentId=<season>
+        if len(path) == 4:
+            item_id = path[3]
+            if item_id.startswith("series"):
+                self.reply(200, {"Id": item_id, "Type": "Series", "ProviderIds": {"Tmdb": item_id[6:]}})
+            elif item_id.startswith("ep"):
+                series, number = item_id[2:].split("-")
+                self.reply(200, dict(self.episode, Id=item_id, Type="Episode", SeriesId=f"series{series}",
+                                     SeasonId=f"season{series}", ParentIndexNumber=1, IndexNumber=int(number)))
+            else:
+                self.reply(200, dict(self.movie, Id=item_id, Type="Movie"))
+        elif query.get("ParentId"):
+            series = query["ParentId"][0][6:]
+            self.reply(200, {"Items": [dict(self.episode, Id=f"ep{series}-{number}", Type="Episode",
+                                            SeriesId=f"series{series}", SeasonId=f"season{series}",
+                                            ParentIndexNumber=1, IndexNumber=number) for number in range(1, 11)]})
+        else:
+            self.reply(200, {"Items": []})
+
+def make_event(number: int) -> dict:
+    """
+    Make the webhook event `number` of the library, a different event for each number.
+
+    Each title of the library is added as a movie, a series, a season and an episode.
+    """
+    title, kind = divmod(number, 4)
+    title += 1
+    if kind == 0:
+        return {"media_type": "movie", "title": f"Title {title} (2020) has been added", "imdb": f"tt{title:07d}",
+                "tmdb": str(title), "item_id": f"movie{title}"}
+    if kind == 1:
+        return {"media_type": "tv", "title": f"Title {title} (2020) has been added", "imdb": f"tt{title:07d}",
+                "tmdb": str(title), "item_id": f"series{title}"}
+    if kind == 2:
+        return {"media_type": "tv", "title": f"Season-added: Title {title}, Saison 1", "item_id": f"season{title}"}
+    episode = title % 10 + 1
+    return {"media_type": "tv", "title": f"Episode-added: Title {title}, S01E{episode:02d} - Episode",
+            "imdb": f"tt{title + 5000000:07d}", "item_id": f"ep{title}-{episode}"}
+
+def rss_kb() -> int:
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+def open_fds() -> int:
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return 0
+
+def disk_kb(directory: str) -> int:
+    total = 0
+    for root, _, names in os.walk(directory):
+        for name in names:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total // 1024
+
+def slope_per_1k(samples: list, key: str) -> float:
+    """
+    Growth of a metric per 1000 events, as the least squares slope of its samples.
+    """
+    xs = [sample["events"] for sample in samples]
+    ys = [sample[key] for sample in samples]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    if not variance:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance * 1000
+
+def take_snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test of the whole pipeline against fake services.")
+    parser.add_argument("--events", type=int, default=5000, help="number of events (default: 5000)")
+    parser.add_argument("--warmup", type=int, help="events before the growth is measured (default: --library)")
+    parser.add_argument("--sample-every", type=int, default=500, help="events between two samples (default: 500)")
+    parser.add_argument("--library", type=int, default=1000,
+                        help="number of distinct events, each posted once by the warm-up (default: 1000)")
+    parser.add_argument("--posters", type=int, default=1000, help="number of distinct posters (default: 1000)")
+    parser.add_argument("--poster-cache-mb", type=float, default=1, help="POSTER_CACHE_MAX_MB of the run (default: 1)")
+    parser.add_argument("--cache-items", type=int, default=128,
+                        help="CACHE_MEMORY_ITEMS and JELLYFIN_ITEM_CACHE_ITEMS of the run (default: 128)")
+    parser.add_argument("--max-rss-kb", type=float, default=1024, help="max RSS growth per 1k events (default: 1024)")
+    parser.add_argument("--max-heap-kb", type=float, default=256, help="max Python heap growth per 1k events (default: 256)")
+    parser.add_argument("--max-fds", type=float, default=5, help="max open FD growth per 1k events (default: 5)")
+    parser.add_argument("--max-disk-kb", type=float, default=256, help="max disk growth per 1k events (default: 256)")
+    parser.add_argument("--max-lookups-kb", type=float, default=16,
+                        help="max growth of the TMDB lookups cached on disk per 1k events (default: 16)")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="do not trace the Python heap (faster)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.warmup is None:
+        args.warmup = args.library
+
+    FakeServices.posters = args.posters
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeServices)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-services", daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    work_dir = tempfile.mkdtemp(prefix="jellyhookapi-soak-")
+    os.environ.update({
+        "TMDB_API_URL": f"{base}/tmdb/3", "TMDB_API_KEY": "soak", "TMDB_RATE_LIMIT": "0",
+        "JELLYFIN_API_URL": f"{base}/jellyfin", "JELLYFIN_API_KEY": "soak", "JELLYFIN_USER_ID": "soak",
+        "DISCORD_WEBHOOK_URL": f"{base}/discord/webhook", "DISCORD_BATCH_LINGER": "0",
+        "WHATSAPP_API_URL": f"{base}/whatsapp", "WHATSAPP_NUMBER": "0",
+        "MATRIX_URL": f"{base}/matrix", "ACCESS_TOKEN": "soak", "ROOM_ID": "!soak:localhost",
+        "CACHE_DIR": os.path.join(work_dir, "cache"), "DATA_DIR": os.path.join(work_dir, "data"),
+        "TMPDIR": os.path.join(work_dir, "tmp"), "POSTER_CACHE_MAX_MB": str(args.poster_cache_mb),
+        "POSTER_PRUNE_INTERVAL": "1",
+        "CACHE_MEMORY_ITEMS": str(args.cache_items), "JELLYFIN_ITEM_CACHE_ITEMS": str(args.cache_items), "LOG_LEVEL": "ERROR", "ROUTING_FILE": "", "CLUSTER_SELF_URL": "",
+    })
+    os.makedirs(os.environ["TMPDIR"])
+    tempfile.tempdir = None
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+
+    import app as application
+    from utils import download
+    from utils.delivery import wait_for_deliveries
+
+    # A short run would otherwise only keep posters within their grace period
+    download.PRUNE_GRACE_SECONDS = 1
+
+    client = application.app.test_client()
+    rng = random.Random(args.seed)
+    library = list(range(args.library))
+    rng.shuffle(library)
+    samples = []
+    # Taken after the warm-up and at the end of the run
+    snapshots = []
+    if not args.no_tracemalloc:
+        tracemalloc.start()
+    rejected = 0
+    start = time.monotonic()
+    try:
+        for number in range(1, args.events + 1):
+            # The whole library once, then events already seen
+            event = make_event(library[number - 1] if number <= args.library else rng.randrange(args.library))
+            while True:
+                response = client.post("/api", json=event)
+                if response.status_code not in (429, 503):
+                    break
+                rejected += 1
+                wait_for_deliveries()
+            if response.status_code != 200:
+                sys.exit(f"Event {number} failed with {response.status_code}: {response.get_data(as_text=True)}")
+            if number % 100 == 0:
+                wait_for_deliveries()
+            if number % args.sample_every == 0:
+                wait_for_deliveries()
+                gc.collect()
+                # Before the sample, so the memory of the snapshot is in every measured sample
+                if tracemalloc.is_tracing() and number >= args.warmup and not snapshots:
+                    snapshots.append(take_snapshot())
+                cache_kb = disk_kb(os.environ["CACHE_DIR"])
+                posters_kb = disk_kb(os.path.join(os.environ["CACHE_DIR"], "posters"))
+                sample = {"events": number, "rss_kb": rss_kb(), "fds": open_fds(),
+                          "disk_kb": disk_kb(work_dir) - cache_kb + posters_kb, "lookups_kb": cache_kb - posters_kb,
+                          "heap_kb": tracemalloc.get_traced_memory()[0] // 1024 if tracemalloc.is_tracing() else 0,
+                          "seconds": round(time.monotonic() - start, 1)}
+                samples.append(sample)
+                print(f"{sample['events']:>7} events  RSS {sample['rss_kb']:>8} kB  FDs {sample['fds']:>4}  "
+                      f"disk {sample['disk_kb']:>7} kB  lookups {sample['lookups_kb']:>7} kB  heap {sample['heap_kb']:>7} kB  {sample['seconds']:>7}s", flush=True)
+        if snapshots:
+            snapshots.append(take_snapshot())
+    finally:
+        server.shutdown()
+
+    measured = [sample for sample in samples if sample["events"] >= args.warmup]
+    if len(measured) < 2:
+        sys.exit("Not enough samples after the warm-up, increase --events or lower --sample-every.")
+
+    print(f"\nGrowth per 1000 events after {args.warmup} warm-up events ({rejected} rejections retried):")
+    failed = False
+    for key, label, threshold in (("rss_kb", "RSS (kB)", args.max_rss_kb), ("heap_kb", "Python heap (kB)", args.max_heap_kb),
+                                  ("fds", "open FDs", args.max_fds), ("disk_kb", "disk (kB)", args.max_disk_kb),
+                                  ("lookups_kb", "lookup cache (kB)", args.max_lookups_kb)):
+        growth = slope_per_1k(measured, key)
+        status = "FAIL" if growth > threshold else "ok"
+        failed |= growth > threshold
+        print(f"  {label:<18} {growth:>10.1f}  (max {threshold})  {status}")
+
+    if len(snapshots) >= 2:
+        print("\nTop allocators growing since the warm-up:")
+        for stat in snapshots[-1].compare_to(snapshots[0], "lineno")[:10]:
+            print(f"  {stat}")
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import threading
+from config.settings import ADMISSION_MAX_IN_FLIGHT, ADMISSION_MAX_PENDING, ADMISSION_RETRY_AFTER
+
+class Rejected(Exception):
+    """
+    Raised when a request is not admitted, with the HTTP status to answer.
+    """
+
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """
+    Bound the work accepted by a worker.
+
+    A request is rejected with 429 when `max_in_flight` requests are already
+    being enriched, and with 503 when the messages waiting for delivery
+    (as reported by `pending`) exceed `max_pending`. Both limits are per
+    worker process, and 0 disables a limit.
+    """
+
+    def __init__(self, max_in_flight: int, max_pending: int, retry_after: int, pending=None):
+        self.max_in_flight = max_in_flight
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self.pending = pending or (lambda: 0)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._admitted = 0
+        self._rejected = {429: 0, 503: 0}
+
+    def acquire(self):
+        """
+        Admit a request, to be followed by `release` once it is processed.
+
+        Raises:
+            Rejected: If the worker is over one of its limits.
+        """
+        # Read the delivery backlog outside of the lock, it takes the queue locks
+        pending = self.pending() if self.max_pending else 0
+        with self._lock:
+            if self.max_in_flight and self._in_flight >= self.max_in_flight:
+                self._rejected[429] += 1
+                raise Rejected(429, "Too many requests in flight", self.retry_after)
+            if self.max_pending and self._in_flight + pending >= self.max_pending:
+                self._rejected[503] += 1
+                raise Rejected(503, "Delivery backlog is full", self.retry_after)
+            self._in_flight += 1
+            self._admitted += 1
+
+    def release(self):
+        """
+        Mark an admitted request as processed.
+        """
+        with self._lock:
+            self._in_flight -= 1
+
+    def stats(self) -> dict:
+        """
+        Get the admission counters of this worker.
+
+        Returns:
+            dict: Limits, in-flight requests, pending deliveries and admitted/rejected counts.
+        """
+        pending = self.pending()
+        with self._lock:
+            return {
+                "max_in_flight": self.max_in_flight,
+                "max_pending": self.max_pending,
+                "in_flight": self._in_flight,
+                "pending_deliveries": pending,
+                "admitted": self._admitted,
+                "rejected_429": self._rejected[429],
+                "rejected_503": self._rejected[503]
+            }
+
+def create_controller(pending=None) -> AdmissionController:
+    """
+    Create an admission controller with the configured limits.
+
+    Args:
+        pending (callable, optional): Returns the number of messages waiting for delivery.
+
+    Returns:
+        AdmissionController: The controller.
+    """
+    return AdmissionController(ADMISSION_MAX_IN_FLIGHT, ADMISSION_MAX_PENDING, ADMISSION_RETRY_AFTER, pending)
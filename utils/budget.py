@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+import time
+import contextvars
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from config.settings import EVENT_BUDGET_SECONDS, EVENT_BUDGET_REQUIRED_STAGES, EVENT_BUDGET_WORKERS
+
+# Optional stages run on this pool so they can be abandoned once the budget is spent.
+# Python threads cannot be killed: an abandoned stage keeps running in the background
+# until its own timeout, but its result is ignored.
+_executor = ThreadPoolExecutor(max_workers=EVENT_BUDGET_WORKERS, thread_name_prefix="enrichment")
+
+_stats_lock = threading.Lock()
+_stats = {
+    "events": 0,
+    "degraded_events": 0,
+    "skipped_stages": {}
+}
+
+def is_required(stage: str) -> bool:
+    """
+    Check whether a stage must run whatever the remaining budget.
+
+    Args:
+        stage (str): Name of the stage (e.g. "tmdb_details", "trailers", "poster").
+
+    Returns:
+        bool: True if the stage is required.
+    """
+    return stage in EVENT_BUDGET_REQUIRED_STAGES
+
+class StageResult:
+    """
+    Pending or completed result of a stage started with `EventBudget.submit`.
+    """
+
+    def __init__(self, stage: str, default, future=None, value=None):
+        self.stage = stage
+        self.default = default
+        self.future = future
+        self.value = value
+
+class EventBudget:
+    """
+    End-to-end latency budget of a single event.
+
+    Required stages always run inline. Optional stages run on a thread pool and
+    are given whatever is left of the budget: once it is spent they are skipped
+    (or abandoned if already running) and their default value is used instead.
+    A budget of 0 seconds disables the deadline.
+    """
+
+    def __init__(self, seconds: float = EVENT_BUDGET_SECONDS):
+        self.seconds = seconds
+        self.started = time.monotonic()
+        self.skipped = []
+
+    def remaining(self) -> float:
+        """
+        Get the remaining time of the budget.
+
+        Returns:
+            float: Remaining seconds, None if the budget is disabled.
+        """
+        if self.seconds <= 0:
+            return None
+        return max(0.0, self.seconds - (time.monotonic() - self.started))
+
+    def submit(self, stage: str, func, *args, default=None, **kwargs) -> StageResult:
+        """
+        Start a stage, without waiting for an optional one to complete.
+
+        Args:
+            stage (str): Name of the stage.
+            func (callable): Function computing the stage result.
+            *args: Positional arguments for func.
+            default (optional): Value used if the stage is skipped or fails.
+            **kwargs: Keyword arguments for func.
+
+        Returns:
+            StageResult: Handle to pass to `result`.
+        """
+        if is_required(stage):
+            return StageResult(stage, default, value=func(*args, **kwargs))
+        if self.remaining() == 0:
+            self._skip(stage, "budget spent")
+            return StageResult(stage, default, value=default)
+        # Run in a copy of the context so the trace ID and parent span follow the stage
+        context = contextvars.copy_context()
+        return StageResult(stage, default, future=_executor.submit(context.run, func, *args, **kwargs))
+
+    def result(self, handle: StageResult):
+        """
+        Wait for a stage within the remaining budget.
+
+        Args:
+            handle (StageResult): Handle returned by `submit`.
+
+        Returns:
+            The stage result, or its default if it was skipped, timed out or failed.
+        """
+        if handle.future is None:
+            return handle.value
+        if is_required(handle.stage):
+            # Only other calls of a required stage started by `submit_each` get here
+            handle.value = handle.future.result()
+            handle.future = None
+            return handle.value
+        try:
+            handle.value = handle.future.result(timeout=self.remaining())
+        except FutureTimeoutError:
+            handle.future.cancel()
+            self._skip(handle.stage, "budget spent")
+            handle.value = handle.default
+        except Exception as e:
+            logging.error(f"Optional stage '{handle.stage}' failed: {e}")
+            self._skip(handle.stage, "failed")
+            handle.value = handle.default
+        handle.future = None
+        return handle.value
+
+    def run(self, stage: str, func, *args, default=None, **kwargs):
+        """
+        Run a stage and wait for its result within the remaining budget.
+
+        See `submit` for the arguments.
+        """
+        return self.result(self.submit(stage, func, *args, default=default, **kwargs))
+
+    def submit_each(self, stage: str, calls: dict, default=None) -> dict:
+        """
+        Start several calls of the same stage concurrently, e.g. one per language.
+
+        The first call of a required stage runs inline as in `submit`, the
+        others on the pool. Their results are then waited for with `result`,
+        or all at once with `result_each`.
+
+        Args:
+            stage (str): Name of the stage.
+            calls (dict): Callables without arguments, by key.
+            default (optional): Value used for a call skipped or failed.
+
+        Returns:
+            dict: Handle of each call, by key.
+        """
+        keys = list(calls)
+        if not keys:
+            return {}
+        if not is_required(stage) and self.remaining() == 0:
+            self._skip(stage, "budget spent")
+            return {key: StageResult(stage, default, value=default) for key in keys}
+        handles = {key: StageResult(stage, default, future=_executor.submit(contextvars.copy_context().run, calls[key]))
+                   for key in keys[1:]}
+        first = self.submit(stage, calls[keys[0]], default=default)
+        return {keys[0]: first, **handles}
+
+    def result_each(self, handles: dict) -> dict:
+        """
+        Wait for the calls started with `submit_each`.
+
+        Args:
+            handles (dict): Handles returned by `submit_each`.
+
+        Returns:
+            dict: The result of each call, by key.
+        """
+        return {key: self.result(handle) for key, handle in handles.items()}
+
+    def finish(self):
+        """
+        Record the outcome of the event in the degradation counters.
+        """
+        with _stats_lock:
+            _stats["events"] += 1
+            if self.skipped:
+                _stats["degraded_events"] += 1
+            for stage in self.skipped:
+                _stats["skipped_stages"][stage] = _stats["skipped_stages"].get(stage, 0) + 1
+        if self.skipped:
+            elapsed = time.monotonic() - self.started
+            logging.warning(f"Event degraded after {elapsed:.2f}s, skipped stages: {', '.join(self.skipped)}")
+
+    def _skip(self, stage: str, reason: str):
+        logging.info(f"Skipping optional stage '{stage}': {reason}.")
+        # Counted once per event, even when skipped for several languages
+        if stage not in self.skipped:
+            self.skipped.append(stage)
+
+def budget_stats() -> dict:
+    """
+    Get the counters of processed and degraded events.
+
+    Returns:
+        dict: Number of events, degraded events and skips per stage.
+    """
+    with _stats_lock:
+        return {
+            "budget_seconds": EVENT_BUDGET_SECONDS,
+            "events": _stats["events"],
+            "degraded_events": _stats["degraded_events"],
+            "skipped_stages": dict(_stats["skipped_stages"])
+        }
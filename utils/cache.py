@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import functools
+import logging
+from collections import OrderedDict
+from config.settings import CACHE_DIR, CACHE_TTL_SECONDS, CACHE_MEMORY_ITEMS
+
+class TTLCache:
+    """
+    Thread-safe in-memory LRU cache whose entries expire after `ttl` seconds.
+    """
+
+    def __init__(self, maxsize: int = CACHE_MEMORY_ITEMS, ttl: float = CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get an entry from the cache.
+
+        Args:
+            key: Key of the entry.
+
+        Returns:
+            tuple: (True, value) if the entry is present and fresh, (False, None) otherwise.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False, None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return False, None
+            self._data.move_to_end(key)
+            return True, value
+
+    def set(self, key, value):
+        """
+        Add or replace an entry, evicting the least recently used one if full.
+
+        Args:
+            key: Key of the entry.
+            value: Value to store.
+        """
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+def _disk_path(namespace: str, key: str) -> str:
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, namespace, f"{digest}.json")
+
+def disk_get(namespace: str, key: str):
+    """
+    Get an entry from the on-disk cache shared by all processes.
+
+    Args:
+        namespace (str): Namespace of the entry (usually the cached function name).
+        key (str): Key of the entry.
+
+    Returns:
+        tuple: (True, value) if the entry is present and fresh, (False, None) otherwise.
+    """
+    try:
+        with open(_disk_path(namespace, key), "r", encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return False, None
+    if entry.get("expires", 0) < time.time():
+        return False, None
+    return True, entry.get("value")
+
+def disk_set(namespace: str, key: str, value, ttl: float = CACHE_TTL_SECONDS):
+    """
+    Store an entry in the on-disk cache. The file is replaced atomically.
+
+    Args:
+        namespace (str): Namespace of the entry.
+        key (str): Key of the entry.
+        value: JSON-serializable value to store.
+        ttl (float, optional): Lifetime of the entry in seconds.
+    """
+    path = _disk_path(namespace, key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=os.path.dirname(path), delete=False) as temp:
+            json.dump({"expires": time.time() + ttl, "value": value}, temp)
+        os.replace(temp.name, path)
+    except (OSError, TypeError) as e:
+        logging.warning(f"Could not write cache entry {namespace}/{key}: {e}")
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+def count_lookup(namespace: str, outcome: str):
+    """
+    Count a cache lookup, reported by `cache_stats`.
+
+    Args:
+        namespace (str): Namespace of the cache.
+        outcome (str): "memory_hits", "disk_hits", "misses", or another kind of hit.
+    """
+    with _stats_lock:
+        counters = _stats.setdefault(namespace, {"memory_hits": 0, "disk_hits": 0, "misses": 0})
+        counters[outcome] = counters.get(outcome, 0) + 1
+
+def cached(namespace: str, ttl: float = CACHE_TTL_SECONDS):
+    """
+    Cache the results of a function in memory and on disk.
+
+    Only truthy results are cached, so failed or degraded lookups (empty dict,
+    empty string, None) are retried on the next call.
+
+    Args:
+        namespace (str): Namespace of the cache entries.
+        ttl (float, optional): Lifetime of the entries in seconds.
+
+    Returns:
+        callable: The decorator.
+    """
+    def decorator(func):
+        memory = TTLCache(ttl=ttl)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = repr((args, sorted(kwargs.items())))
+            hit, value = memory.get(key)
+            if hit:
+                count_lookup(namespace, "memory_hits")
+                return value
+            hit, value = disk_get(namespace, key)
+            if hit:
+                count_lookup(namespace, "disk_hits")
+                memory.set(key, value)
+                return value
+            count_lookup(namespace, "misses")
+            value = func(*args, **kwargs)
+            if value:
+                memory.set(key, value)
+                disk_set(namespace, key, value, ttl)
+            return value
+
+        wrapper.cache = memory
+        return wrapper
+    return decorator
+
+def cache_stats() -> dict:
+    """
+    Get the hit and miss counters of every cached function.
+
+    Returns:
+        dict: Counters keyed by namespace.
+    """
+    with _stats_lock:
+        return {namespace: dict(counters) for namespace, counters in _stats.items()}
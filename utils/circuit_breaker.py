@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+import time
+import threading
+import logging
+from collections import deque
+import requests
+from config.settings import (CIRCUIT_BREAKER_FAILURE_RATE, CIRCUIT_BREAKER_MIN_CALLS,
+                             CIRCUIT_BREAKER_WINDOW, CIRCUIT_BREAKER_OPEN_SECONDS)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(requests.RequestException):
+    """
+    Raised instead of calling a dependency whose circuit breaker is open.
+
+    It subclasses requests.RequestException so the existing error handling
+    around outbound calls degrades the same way as for a network failure.
+    """
+
+class CircuitBreaker:
+    """
+    Failure-rate circuit breaker for one outbound dependency.
+
+    The breaker keeps the outcome of the last `window` calls. Once at least
+    `min_calls` outcomes are known and the failure rate reaches `failure_rate`,
+    it opens and rejects calls for `open_seconds`. It then lets a single trial
+    call through (half-open): a success closes it, a failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_rate: float = CIRCUIT_BREAKER_FAILURE_RATE,
+                 min_calls: int = CIRCUIT_BREAKER_MIN_CALLS, window: int = CIRCUIT_BREAKER_WINDOW,
+                 open_seconds: float = CIRCUIT_BREAKER_OPEN_SECONDS):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self._outcomes = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._trial_thread = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Check whether a call may go through right now.
+
+        Returns:
+            bool: True if the call is allowed, False if it must be rejected.
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    return False
+                self._set_state(HALF_OPEN)
+            # Half-open: only one trial call at a time
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            self._trial_thread = threading.get_ident()
+            return True
+
+    def release_trial(self):
+        """
+        End the trial call of this thread if it got no outcome (e.g. an unexpected
+        exception), so the half-open breaker lets another trial call through.
+
+        Called once every call allowed by `allow` is over, does nothing otherwise.
+        """
+        with self._lock:
+            if self._trial_in_flight and self._trial_thread == threading.get_ident():
+                self._trial_in_flight = False
+
+    def record_success(self):
+        """
+        Record a successful call.
+        """
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._outcomes.clear()
+                self._trial_in_flight = False
+                self._set_state(CLOSED)
+            self._outcomes.append(True)
+
+    def record_failure(self):
+        """
+        Record a failed call, opening the breaker if the threshold is reached.
+        """
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._trial_in_flight = False
+                self._open()
+                return
+            self._outcomes.append(False)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self._open()
+
+    def status(self) -> dict:
+        """
+        Get the current state of the breaker.
+
+        Returns:
+            dict: State, failure counts and seconds until the next trial call.
+        """
+        with self._lock:
+            retry_in = 0.0
+            if self._state == OPEN:
+                retry_in = max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+            return {
+                "state": self._state,
+                "calls": len(self._outcomes),
+                "failures": self._outcomes.count(False),
+                "retry_in": round(retry_in, 1)
+            }
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self._set_state(OPEN)
+
+    def _set_state(self, state: str):
+        if state != self._state:
+            logging.warning(f"Circuit breaker '{self.name}' changed from {self._state} to {state}.")
+            self._state = state
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """
+    Get (or create) the circuit breaker of a dependency.
+
+    Args:
+        name (str): Name of the dependency (e.g. "tmdb", "jellyfin", "discord").
+
+    Returns:
+        CircuitBreaker: The breaker shared by every call to this dependency.
+    """
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+def breakers_status() -> dict:
+    """
+    Get the state of every circuit breaker created so far.
+
+    Returns:
+        dict: Breaker status keyed by dependency name.
+    """
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {name: breaker.status() for name, breaker in breakers.items()}
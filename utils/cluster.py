@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import time
+import bisect
+import hashlib
+import threading
+import logging
+import requests
+from utils import http_client
+from utils.admission import Rejected
+from config.settings import (CLUSTER_SELF_URL, CLUSTER_PEERS, CLUSTER_VIRTUAL_NODES, CLUSTER_HEALTH_INTERVAL,
+                             CLUSTER_FORWARD_TIMEOUT)
+
+# Set on requests forwarded to their owner, which must process them locally
+FORWARDED_HEADER = "X-JellyHook-Forwarded"
+# Set on responses, with the node that processed the event
+NODE_HEADER = "X-JellyHook-Node"
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+class HashRing:
+    """
+    Consistent hash ring of nodes.
+
+    Each node is placed at `virtual_nodes` points of the ring, and a key
+    belongs to the first node after its hash. When a node joins or leaves,
+    only the keys between its points and the previous ones change owner.
+    """
+
+    def __init__(self, nodes: list, virtual_nodes: int = CLUSTER_VIRTUAL_NODES):
+        self.nodes = sorted(set(nodes))
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(virtual_nodes))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def owner(self, key: str) -> str:
+        """
+        Get the node owning a key.
+
+        Args:
+            key (str): Partition key.
+
+        Returns:
+            str: The owner node, None if the ring is empty.
+        """
+        if not self._nodes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._nodes)
+        return self._nodes[index]
+
+def partition_key(data: dict) -> str:
+    """
+    Get the key deciding which node processes an event.
+
+    Seasons and episodes are keyed by series, so the TMDB and Jellyfin caches
+    of a series stay on one node; other events by their TMDB, IMDb or item ID.
+
+    Args:
+        data (dict): The media data from Jellyfin.
+
+    Returns:
+        str: The partition key.
+    """
+    if data.get('series_id'):
+        return f"series:{data['series_id']}"
+    series = re.search(r"(?:Season|Episode)-added:\s*([^,]+)", data.get('title', ''), flags=re.IGNORECASE)
+    if series:
+        return f"series:{series.group(1).strip().lower()}"
+    for field in ('tmdb', 'imdb', 'item_id', 'title'):
+        if data.get(field):
+            return f"{field}:{data[field]}"
+    return ""
+
+class Cluster:
+    """
+    Membership of this node in a cluster of JellyHookAPI instances.
+
+    Every node is configured with the same peer list. A background thread
+    checks the health of the peers, and the ring is rebuilt from the healthy
+    ones, so ownership moves to the remaining nodes when a peer goes down and
+    back when it recovers.
+    """
+
+    def __init__(self, self_url: str, peers: list, health_interval: float = CLUSTER_HEALTH_INTERVAL):
+        self.self_url = self_url.rstrip("/")
+        self.peers = sorted({peer.rstrip("/") for peer in peers} | {self.self_url})
+        self.health_interval = health_interval
+        self._alive = set(self.peers)
+        self._ring = HashRing(self.peers)
+        self._lock = threading.Lock()
+        self._pid = None
+        self.forwarded = 0
+        self.forward_failures = 0
+
+    def owner(self, data: dict) -> str:
+        """
+        Get the node that must process an event.
+
+        Args:
+            data (dict): The media data from Jellyfin.
+
+        Returns:
+            str: Base URL of the owner node.
+        """
+        self.start()
+        with self._lock:
+            ring = self._ring
+        return ring.owner(partition_key(data)) or self.self_url
+
+    def is_local(self, node: str) -> bool:
+        return node == self.self_url
+
+    def set_alive(self, peer: str, alive: bool):
+        """
+        Update the health of a peer, rebuilding the ring if it changed.
+
+        Args:
+            peer (str): Base URL of the peer.
+            alive (bool): Whether the peer answered.
+        """
+        if peer == self.self_url:
+            return
+        with self._lock:
+            if (peer in self._alive) == alive:
+                return
+            if alive:
+                self._alive.add(peer)
+            else:
+                self._alive.discard(peer)
+            self._ring = HashRing(self._alive)
+        logging.warning(f"Cluster peer {peer} is {'up' if alive else 'down'}, {len(self._alive)} nodes in the ring.")
+
+    def forward(self, owner: str, data: dict, headers: dict) -> requests.Response:
+        """
+        Forward an event to its owner.
+
+        Args:
+            owner (str): Base URL of the owner node.
+            data (dict): The media data from Jellyfin.
+            headers (dict): Extra headers (e.g. trace ID).
+
+        Returns:
+            requests.Response: Response of the owner, None if it could not be reached
+            (it is then marked as down, and the caller processes the event itself).
+
+        Raises:
+            Rejected: 503 when the owner may have received the event but did not answer
+                (e.g. read timeout): processing it here could notify it twice.
+        """
+        headers = dict(headers, **{FORWARDED_HEADER: self.self_url})
+        try:
+            # Not through a circuit breaker: the 429 and 503 of the owner's admission control are
+            # passed on to Jellyfin, and an unreachable owner is removed from the ring instead
+            response = http_client.get_session().post(f"{owner}/api", json=data, headers=headers,
+                                                      timeout=CLUSTER_FORWARD_TIMEOUT)
+            self.forwarded += 1
+            return response
+        except requests.ConnectionError as e:
+            # Includes connect timeouts: the event never reached the owner
+            logging.warning(f"Could not forward event to {owner}: {e}")
+            self.forward_failures += 1
+            self.set_alive(owner, False)
+            return None
+        except requests.RequestException as e:
+            logging.warning(f"No answer from {owner} to a forwarded event: {e}")
+            self.forward_failures += 1
+            raise Rejected(503, "The owner node did not answer", int(CLUSTER_FORWARD_TIMEOUT))
+
+    def check_peers(self):
+        """
+        Check the health of every peer once.
+        """
+        for peer in self.peers:
+            if peer == self.self_url:
+                continue
+            try:
+                response = requests.get(f"{peer}/cluster/health", timeout=2)
+                self.set_alive(peer, response.status_code == 200)
+            except requests.RequestException:
+                self.set_alive(peer, False)
+
+    def start(self):
+        """
+        Start the health check thread, once per process.
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+
+        def run():
+            while True:
+                time.sleep(self.health_interval)
+                try:
+                    self.check_peers()
+                except Exception as e:
+                    logging.error(f"Error checking cluster peers: {e}")
+
+        threading.Thread(target=run, name="cluster-health", daemon=True).start()
+
+    def status(self) -> dict:
+        """
+        Get the membership of this node.
+
+        Returns:
+            dict: This node, the configured and healthy peers, and forwarding counters.
+        """
+        with self._lock:
+            alive = sorted(self._alive)
+        return {
+            "self": self.self_url,
+            "peers": self.peers,
+            "alive": alive,
+            "forwarded": self.forwarded,
+            "forward_failures": self.forward_failures
+        }
+
+def create_cluster() -> Cluster:
+    """
+    Create the cluster membership from the settings.
+
+    Returns:
+        Cluster: The membership, None if cluster mode is disabled (CLUSTER_SELF_URL not set).
+    """
+    if not CLUSTER_SELF_URL:
+        return None
+    return Cluster(CLUSTER_SELF_URL, CLUSTER_PEERS)
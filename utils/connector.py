@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+
+import os
+import asyncio
+import logging
+import importlib
+from utils.download import DEFAULT_POSTER_WIDTH
+from config.settings import LANGUAGE
+
+# Version of the connector interface implemented by `Connector`
+INTERFACE_VERSION = 2
+# 1: module with a `send_message(message, options)` function, wrapped by `ModuleConnector`
+SUPPORTED_VERSIONS = (1, 2)
+# Directory (and package) of the connectors, one sub-directory with a `*_service.py` module each
+CONNECTORS_DIR = 'connectors'
+
+class Capabilities:
+    """
+    What a connector supports, used by the dispatcher to batch and parallelize deliveries.
+
+    Attributes:
+        max_batch_size (int): Maximum number of messages per `send_many` call, 1 to disable batching.
+        batch_linger (float): Seconds to wait for more messages before sending an incomplete batch.
+        media_modes (tuple): "text" and/or "image". Posters are only downloaded for connectors supporting images.
+        rate_limit (float): Maximum number of sends (single or batch) per second, None for no limit.
+        concurrency (int): Number of messages sent in parallel, None for the DELIVERY_WORKERS default.
+        edits (bool): Sent messages can be edited in place, see `Connector.edit`.
+    """
+
+    def __init__(self, max_batch_size: int = 1, batch_linger: float = 0.0, media_modes: tuple = ("text", "image"),
+                 rate_limit: float = None, concurrency: int = None, edits: bool = False):
+        self.max_batch_size = max(1, max_batch_size)
+        self.batch_linger = batch_linger
+        self.media_modes = tuple(media_modes)
+        self.rate_limit = rate_limit
+        self.concurrency = concurrency
+        self.edits = edits
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+class Connector:
+    """
+    Base class of the connectors (interface version 2).
+
+    A connector implements `send`, or `send_async` for asyncio clients. It can
+    also implement `send_many` to deliver several messages at once, in which
+    case its `capabilities.max_batch_size` tells the dispatcher how many
+    messages to group. A connector with `capabilities.edits` implements
+    `send_editable` and `edit`, used in NOTIFY_FIRST mode.
+
+    A connector module exposes an instance as a module-level `connector`.
+    Its `destinations` are the URLs of its service, connected to when a
+    worker starts, and its `language` the language of the messages it gets.
+    """
+
+    interface_version = INTERFACE_VERSION
+    capabilities = Capabilities()
+    poster_width = DEFAULT_POSTER_WIDTH
+    destinations = ()
+    language = LANGUAGE
+
+    def __init__(self, name: str = None):
+        self.name = name or type(self).__name__.lower()
+
+    def send(self, message: dict, options: dict):
+        """
+        Send a message.
+
+        Args:
+            message (dict): Message to send.
+            options (dict): Options for the message (poster...).
+
+        Returns:
+            The response of the service, None if the message was not sent.
+        """
+        if type(self).send_async is Connector.send_async:
+            raise NotImplementedError(f"Connector {self.name} implements neither send nor send_async")
+        return asyncio.run(self.send_async(message, options))
+
+    async def send_async(self, message: dict, options: dict):
+        """
+        Send a message from an event loop. Defaults to `send` in a thread.
+
+        Args:
+            message (dict): Message to send.
+            options (dict): Options for the message.
+
+        Returns:
+            The response of the service, None if the message was not sent.
+        """
+        return await asyncio.to_thread(self.send, message, options)
+
+    def send_many(self, items: list) -> list:
+        """
+        Send several messages. Defaults to one `send` per message.
+
+        Args:
+            items (list): (message, options) tuples.
+
+        Returns:
+            list: The response for each message, None for the messages not sent.
+        """
+        return [self.send(message, options) for message, options in items]
+
+    def send_editable(self, message: dict, options: dict) -> str:
+        """
+        Send a message on its own, to edit it later with `edit`.
+
+        Args:
+            message (dict): Message to send.
+            options (dict): Options for the message.
+
+        Returns:
+            str: ID of the message in the service, None if it was not sent.
+        """
+        raise NotImplementedError(f"Connector {self.name} does not support edits")
+
+    def edit(self, message_id: str, message: dict, options: dict):
+        """
+        Replace a message sent with `send_editable`.
+
+        Args:
+            message_id (str): ID returned by `send_editable`.
+            message (dict): New message.
+            options (dict): Options for the new message (poster...).
+
+        Returns:
+            The response of the service, None if the message was not edited.
+        """
+        raise NotImplementedError(f"Connector {self.name} does not support edits")
+
+    def supports(self, media_mode: str) -> bool:
+        return media_mode in self.capabilities.media_modes
+
+class ModuleConnector(Connector):
+    """
+    Shim for module-style connectors (interface version 1).
+
+    The module must define `send_message(message, options)`. It can declare
+    `POSTER_WIDTH`, `DESTINATIONS` and `LANGUAGE`, define `send_many(items)`, and set its
+    capabilities with the module-level `MAX_BATCH_SIZE`, `BATCH_LINGER`,
+    `MEDIA_MODES`, `RATE_LIMIT` and `CONCURRENCY`. Defining both
+    `send_editable_message(message, options)` and
+    `edit_message(message_id, message, options)` enables edits.
+    """
+
+    interface_version = 1
+
+    def __init__(self, name: str, module):
+        super().__init__(name)
+        self.module = module
+        self.poster_width = getattr(module, 'POSTER_WIDTH', DEFAULT_POSTER_WIDTH)
+        self.destinations = tuple(url for url in getattr(module, 'DESTINATIONS', ()) if url)
+        self.language = getattr(module, 'LANGUAGE', None) or LANGUAGE
+        self.capabilities = Capabilities(
+            max_batch_size=getattr(module, 'MAX_BATCH_SIZE', 1) if hasattr(module, 'send_many') else 1,
+            batch_linger=getattr(module, 'BATCH_LINGER', 0.0),
+            media_modes=getattr(module, 'MEDIA_MODES', ("text", "image")),
+            rate_limit=getattr(module, 'RATE_LIMIT', None),
+            concurrency=getattr(module, 'CONCURRENCY', None),
+            edits=hasattr(module, 'send_editable_message') and hasattr(module, 'edit_message'))
+
+    def send(self, message: dict, options: dict):
+        return self.module.send_message(message, options)
+
+    def send_many(self, items: list) -> list:
+        if hasattr(self.module, 'send_many'):
+            return self.module.send_many(items)
+        return super().send_many(items)
+
+    def send_editable(self, message: dict, options: dict) -> str:
+        if not self.capabilities.edits:
+            return super().send_editable(message, options)
+        return self.module.send_editable_message(message, options)
+
+    def edit(self, message_id: str, message: dict, options: dict):
+        if not self.capabilities.edits:
+            return super().edit(message_id, message, options)
+        return self.module.edit_message(message_id, message, options)
+
+def load_connector(name: str, module) -> Connector:
+    """
+    Get the connector of a connector module.
+
+    Args:
+        name (str): Name of the connector (its directory).
+        module (module): The `*_service.py` module.
+
+    Returns:
+        Connector: The module-level `connector` if the module has one, a `ModuleConnector`
+        wrapping the module otherwise. None if its interface version is not supported.
+    """
+    connector = getattr(module, 'connector', None)
+    if isinstance(connector, Connector):
+        connector.name = name
+    elif hasattr(module, 'send_message'):
+        connector = ModuleConnector(name, module)
+    else:
+        logging.error(f"Connector {name} has neither a `connector` nor a `send_message` function, skipping it.")
+        return None
+    if connector.interface_version not in SUPPORTED_VERSIONS:
+        logging.error(f"Connector {name} implements interface version {connector.interface_version}, "
+                      f"supported versions are {SUPPORTED_VERSIONS}, skipping it.")
+        return None
+    return connector
+
+def load_connectors(directory: str = CONNECTORS_DIR) -> dict:
+    """
+    Load connectors dynamically from the connectors directory.
+
+    Module-style connectors (a `send_message` function) are wrapped in a
+    `ModuleConnector`, see load_connector.
+
+    Args:
+        directory (str): Directory of the connectors, also their package name
+
+    Returns:
+        dict: Dictionary of connectors.
+    """
+    connectors = {}
+    for root, dirs, files in os.walk(directory):
+        # Skip the template directory
+        if "template" in root.split(os.sep):
+            continue
+        for file in files:
+            if file.endswith('_service.py'):
+                connector_name = root.split(os.sep)[-1]
+                module_name = f"{directory}.{connector_name}.{file[:-3]}"
+                module = importlib.import_module(module_name)
+                connector = load_connector(connector_name, module)
+                if connector:
+                    connectors[connector_name] = connector
+    return connectors
+
+def get_poster_widths(connectors: dict) -> list:
+    """
+    Get the poster widths wanted by the connectors that show images.
+
+    A connector declares its width with `poster_width` (a module-level
+    `POSTER_WIDTH` for module-style connectors), the default width is used otherwise.
+
+    Args:
+        connectors (dict): The loaded connectors
+
+    Returns:
+        list: Poster widths in pixels, without duplicates.
+    """
+    return list(dict.fromkeys(connector.poster_width for connector in connectors.values() if connector.supports("image")))
+
+def get_languages(connectors: dict) -> list:
+    """
+    Get the languages of the messages wanted by the connectors.
+
+    A connector declares its language with `language` (a module-level
+    `LANGUAGE` for module-style connectors), LANGUAGE is used otherwise.
+
+    Args:
+        connectors (dict): The loaded connectors
+
+    Returns:
+        list: Languages (e.g. "fr-FR"), without duplicates.
+    """
+    return list(dict.fromkeys(connector.language for connector in connectors.values()))
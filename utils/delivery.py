@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import threading
+import contextvars
+import logging
+from collections import deque
+from config.settings import (DELIVERY_WORKERS, DELIVERY_LANE_WEIGHTS, DELIVERY_MAX_WAIT_SECONDS,
+                             get_connector_setting)
+from utils.rate_limit import RateLimiter
+
+# Event kinds, as returned by is_season_ep_or_movie, highest priority first
+LANES = ("movie", "serie", "season", "episode")
+
+def parse_lane_weights(value: str) -> dict:
+    """
+    Parse lane weights such as "movie:8,serie:4,season:2,episode:1".
+
+    Args:
+        value (str): Comma-separated lane:weight pairs. Missing lanes get a weight of 1.
+
+    Returns:
+        dict: Weight keyed by lane.
+    """
+    weights = {lane: 1 for lane in LANES}
+    for pair in value.split(","):
+        lane, _, weight = pair.partition(":")
+        if lane.strip() in weights and weight.strip():
+            weights[lane.strip()] = max(1, int(weight))
+    return weights
+
+class Job:
+    """
+    A message waiting to be delivered to a connector.
+    """
+
+    def __init__(self, lane: str, message: dict, options: dict):
+        self.lane = lane
+        self.message = message
+        self.options = options
+        self.enqueued_at = time.monotonic()
+        # Run the delivery with the context of the request (trace ID)
+        self.context = contextvars.copy_context()
+
+class LaneStats:
+    """
+    Counters and recent wait times of a lane.
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.delivered = 0
+        self.waits = deque(maxlen=200)
+
+    def as_dict(self, depth: int) -> dict:
+        waits = sorted(self.waits)
+        return {
+            "depth": depth,
+            "in_flight": self.in_flight,
+            "delivered": self.delivered,
+            "wait_p50": round(waits[len(waits) // 2], 3) if waits else 0.0,
+            "wait_max": round(waits[-1], 3) if waits else 0.0
+        }
+
+class DeliveryQueue:
+    """
+    Delivery queue of one connector, with one lane per event kind.
+
+    A pool of `workers` threads sends the queued messages. Each lane gets a share
+    of the workers proportional to its weight, and lanes are served by smooth
+    weighted round robin, so a flood of episodes cannot delay a movie by more
+    than a few deliveries. A lane whose oldest job has waited more than
+    `max_wait` seconds is served first, so low-priority lanes never starve.
+    When a lane is idle, the other lanes may use its share of the workers.
+
+    With `send_many` and a `batch_size` above 1, a worker takes up to
+    `batch_size` jobs, waiting up to `linger` seconds for more once it has one,
+    and sends them in one call. A `rate_limiter` bounds the number of calls.
+    """
+
+    def __init__(self, name: str, send, weights: dict, workers: int = DELIVERY_WORKERS,
+                 max_wait: float = DELIVERY_MAX_WAIT_SECONDS, send_many=None, batch_size: int = 1,
+                 linger: float = 0.0, rate_limiter: RateLimiter = None):
+        self.name = name
+        self.send = send
+        self.send_many = send_many
+        self.batch_size = batch_size if send_many else 1
+        self.linger = linger
+        self.rate_limiter = rate_limiter
+        self.weights = weights
+        self.workers = max(1, workers)
+        self.max_wait = max_wait
+        total = sum(weights.values())
+        self.shares = {lane: max(1, round(self.workers * weight / total)) for lane, weight in weights.items()}
+        self._lanes = {lane: deque() for lane in LANES}
+        self._stats = {lane: LaneStats() for lane in LANES}
+        self._credits = {lane: 0 for lane in LANES}
+        self._condition = threading.Condition()
+        self._threads = []
+        self._pid = None
+
+    def submit(self, lane: str, message: dict, options: dict):
+        """
+        Queue a message for delivery.
+
+        Args:
+            lane (str): Event kind ("movie", "serie", "season" or "episode").
+            message (dict): Message to send.
+            options (dict): Options for the connector.
+        """
+        if lane not in self._lanes:
+            lane = LANES[-1]
+        self._ensure_workers()
+        with self._condition:
+            self._lanes[lane].append(Job(lane, message, options))
+            self._condition.notify_all()
+
+    def depth(self) -> int:
+        """
+        Get the number of messages queued or being sent.
+
+        Returns:
+            int: Queued plus in-flight messages.
+        """
+        with self._condition:
+            return sum(len(jobs) for jobs in self._lanes.values()) + sum(s.in_flight for s in self._stats.values())
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """
+        Wait until every queued message has been sent.
+
+        Args:
+            timeout (float, optional): Maximum time to wait in seconds.
+
+        Returns:
+            bool: True if the queue is idle, False on timeout.
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not any(self._lanes.values()) and not any(s.in_flight for s in self._stats.values()),
+                timeout)
+
+    def stats(self) -> dict:
+        """
+        Get the queue depth, in-flight count and wait times of each lane.
+
+        Returns:
+            dict: Statistics keyed by lane.
+        """
+        with self._condition:
+            return {lane: self._stats[lane].as_dict(len(self._lanes[lane])) for lane in LANES}
+
+    def _ensure_workers(self):
+        # Threads are started on first use, and again in a forked child process
+        with self._condition:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._threads = [threading.Thread(target=self._work, name=f"delivery-{self.name}-{i}", daemon=True)
+                             for i in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+
+    def _next_job(self) -> Job:
+        # Called with the condition held
+        pending = [lane for lane in LANES if self._lanes[lane]]
+        if not pending:
+            return None
+
+        now = time.monotonic()
+        starving = [lane for lane in pending if now - self._lanes[lane][0].enqueued_at > self.max_wait]
+        if starving:
+            lane = min(starving, key=lambda lane: self._lanes[lane][0].enqueued_at)
+        else:
+            eligible = [lane for lane in pending if self._stats[lane].in_flight < self.shares[lane]] or pending
+            # Smooth weighted round robin between the eligible lanes
+            for candidate in eligible:
+                self._credits[candidate] += self.weights[candidate]
+            lane = max(eligible, key=lambda candidate: self._credits[candidate])
+            self._credits[lane] -= sum(self.weights[candidate] for candidate in eligible)
+
+        job = self._lanes[lane].popleft()
+        stats = self._stats[lane]
+        stats.in_flight += 1
+        stats.waits.append(now - job.enqueued_at)
+        return job
+
+    def _next_batch(self) -> list:
+        with self._condition:
+            jobs = [self._condition.wait_for(self._next_job)]
+            deadline = time.monotonic() + self.linger
+            while len(jobs) < self.batch_size:
+                job = self._next_job()
+                if job:
+                    jobs.append(job)
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+        return jobs
+
+    def _work(self):
+        while True:
+            jobs = self._next_batch()
+            try:
+                if self.rate_limiter:
+                    self.rate_limiter.acquire()
+                if len(jobs) == 1:
+                    jobs[0].context.run(self.send, jobs[0].message, jobs[0].options)
+                else:
+                    # The batch is sent with the trace ID of its first message
+                    jobs[0].context.run(self.send_many, [(job.message, job.options) for job in jobs])
+            except Exception as e:
+                logging.error(f"Delivery to {self.name} failed: {e}")
+            finally:
+                with self._condition:
+                    for job in jobs:
+                        stats = self._stats[job.lane]
+                        stats.in_flight -= 1
+                        stats.delivered += 1
+                    self._condition.notify_all()
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+def get_queue(name: str, send, send_many=None, capabilities=None) -> DeliveryQueue:
+    """
+    Get (or create) the delivery queue of a connector.
+
+    Lane weights and workers can be set per connector with
+    DELIVERY_LANE_WEIGHTS_<NAME> and DELIVERY_WORKERS_<NAME>. Otherwise, the
+    number of workers is the concurrency declared by the connector, if any.
+
+    Args:
+        name (str): Name of the connector.
+        send (callable): Function called with (message, options) to deliver a message.
+        send_many (callable, optional): Function called with a list of (message, options) to deliver a batch.
+        capabilities (Capabilities, optional): Batch size, linger, rate limit and concurrency of the connector.
+
+    Returns:
+        DeliveryQueue: The queue of the connector.
+    """
+    with _queues_lock:
+        if name not in _queues:
+            weights = parse_lane_weights(get_connector_setting(name, "DELIVERY_LANE_WEIGHTS", DELIVERY_LANE_WEIGHTS))
+            if capabilities and capabilities.concurrency:
+                workers = int(get_connector_setting(name, "DELIVERY_WORKERS", capabilities.concurrency, inherit=False))
+            else:
+                workers = int(get_connector_setting(name, "DELIVERY_WORKERS", DELIVERY_WORKERS))
+            if capabilities:
+                rate_limiter = RateLimiter(capabilities.rate_limit) if capabilities.rate_limit else None
+                _queues[name] = DeliveryQueue(name, send, weights, workers, send_many=send_many,
+                                              batch_size=capabilities.max_batch_size, linger=capabilities.batch_linger,
+                                              rate_limiter=rate_limiter)
+            else:
+                _queues[name] = DeliveryQueue(name, send, weights, workers)
+        return _queues[name]
+
+def delivery_stats() -> dict:
+    """
+    Get the lane statistics of every connector queue.
+
+    Returns:
+        dict: Lane statistics keyed by connector name.
+    """
+    with _queues_lock:
+        queues = dict(_queues)
+    return {name: queue.stats() for name, queue in queues.items()}
+
+def pending_deliveries() -> int:
+    """
+    Get the number of messages queued or being sent, over all connectors.
+
+    Returns:
+        int: Number of pending deliveries.
+    """
+    with _queues_lock:
+        queues = list(_queues.values())
+    return sum(queue.depth() for queue in queues)
+
+def wait_for_deliveries(timeout: float = None) -> bool:
+    """
+    Wait until every connector queue is idle.
+
+    Args:
+        timeout (float, optional): Maximum time to wait in seconds, for all the queues.
+
+    Returns:
+        bool: True if all queues are idle, False if messages are still pending (they are logged).
+    """
+    with _queues_lock:
+        queues = list(_queues.values())
+    deadline = None if timeout is None else time.monotonic() + timeout
+    idle = True
+    for queue in queues:
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        idle = queue.wait_idle(remaining) and idle
+    if not idle:
+        logging.warning(f"{pending_deliveries()} messages still pending after waiting {timeout}s for their delivery.")
+    return idle
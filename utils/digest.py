@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import time
+import sqlite3
+import threading
+import logging
+from datetime import datetime, timedelta
+from config.settings import DATA_DIR, DIGEST_CHECK_INTERVAL, get_connector_setting
+
+DIGEST_DB = os.path.join(DATA_DIR, "digest.sqlite")
+# Events claimed by a digest are claimed again after this time, its process may have died before sending it
+CLAIM_TIMEOUT_SECONDS = 600
+# A digest that could not be sent is retried after this time
+RETRY_SECONDS = 300
+
+def get_schedule(connector_name: str) -> str:
+    """
+    Get the digest schedule of a connector (DIGEST_SCHEDULE_<NAME>).
+
+    Args:
+        connector_name (str): Name of the connector.
+
+    Returns:
+        str: "hourly", "daily@HH:MM", or "" if the connector is not in digest mode.
+    """
+    return (get_connector_setting(connector_name, "DIGEST_SCHEDULE", "") or "").strip().lower()
+
+def next_flush(schedule: str, after: datetime) -> datetime:
+    """
+    Compute the next flush time of a schedule.
+
+    Args:
+        schedule (str): "hourly" or "daily@HH:MM".
+        after (datetime): Time after which the flush must happen.
+
+    Returns:
+        datetime: The next flush time.
+
+    Raises:
+        ValueError: If the schedule is not supported.
+    """
+    if schedule == "hourly":
+        return after.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    match = re.fullmatch(r"daily@([0-9]{1,2}):([0-9]{2})", schedule)
+    if match:
+        flush = after.replace(hour=int(match.group(1)), minute=int(match.group(2)), second=0, microsecond=0)
+        return flush if flush > after else flush + timedelta(days=1)
+    raise ValueError(f"Unsupported digest schedule: {schedule}")
+
+def _connect() -> sqlite3.Connection:
+    os.makedirs(DATA_DIR, exist_ok=True)
+    # Autocommit mode, transactions are opened explicitly
+    connection = sqlite3.connect(DIGEST_DB, timeout=30, isolation_level=None)
+    connection.execute("""CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        connector TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        title TEXT NOT NULL,
+        link TEXT,
+        picture_path TEXT,
+        created REAL NOT NULL,
+        claimed REAL)""")
+    # Buffers created before the claims were added
+    if "claimed" not in {column[1] for column in connection.execute("PRAGMA table_info(events)")}:
+        try:
+            connection.execute("ALTER TABLE events ADD COLUMN claimed REAL")
+        except sqlite3.OperationalError:
+            pass  # added by another process in the meantime
+    connection.execute("""CREATE TABLE IF NOT EXISTS schedule (
+        connector TEXT PRIMARY KEY,
+        next_flush REAL NOT NULL)""")
+    return connection
+
+def add_event(connector_name: str, kind: str, message: dict, options: dict):
+    """
+    Buffer an event for the next digest of a connector.
+
+    Args:
+        connector_name (str): Name of the connector.
+        kind (str): Kind of event ("movie", "serie", "season" or "episode").
+        message (dict): The formatted message of the event.
+        options (dict): The options of the connector (for the poster).
+    """
+    links = message.get("media_link") or {}
+    picture_path = options.get("picture_path") if options.get("send_image") else None
+    connection = _connect()
+    try:
+        connection.execute(
+            "INSERT INTO events (connector, kind, title, link, picture_path, created) VALUES (?, ?, ?, ?, ?, ?)",
+            (connector_name, kind, message.get("title", ""), links.get("tmdb") or links.get("imdb"), picture_path, time.time()))
+    finally:
+        connection.close()
+
+def claim_due_events(connector_name: str, schedule: str) -> tuple:
+    """
+    Claim the buffered events of a connector if its digest is due.
+
+    The check and the claim happen in one write transaction, so only one
+    process (e.g. one Gunicorn worker) gets the events of a given digest.
+    The events stay buffered until `finish_claim` removes them once the
+    digest is sent.
+
+    Args:
+        connector_name (str): Name of the connector.
+        schedule (str): Digest schedule of the connector.
+
+    Returns:
+        tuple: The claim (float), and the events as (kind, title, link, picture_path)
+        tuples, empty if the digest is not due.
+    """
+    now = datetime.now()
+    claim = time.time()
+    connection = _connect()
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        row = connection.execute("SELECT next_flush FROM schedule WHERE connector = ?", (connector_name,)).fetchone()
+        if row is None:
+            connection.execute("INSERT INTO schedule (connector, next_flush) VALUES (?, ?)",
+                               (connector_name, next_flush(schedule, now).timestamp()))
+            connection.execute("COMMIT")
+            return claim, []
+        if row[0] > now.timestamp():
+            connection.execute("COMMIT")
+            return claim, []
+        claimable = "connector = ? AND (claimed IS NULL OR claimed < ?)"
+        parameters = (connector_name, claim - CLAIM_TIMEOUT_SECONDS)
+        events = connection.execute(
+            f"SELECT kind, title, link, picture_path FROM events WHERE {claimable} ORDER BY id", parameters).fetchall()
+        connection.execute(f"UPDATE events SET claimed = ? WHERE {claimable}", (claim,) + parameters)
+        connection.execute("UPDATE schedule SET next_flush = ? WHERE connector = ?",
+                           (next_flush(schedule, now).timestamp(), connector_name))
+        connection.execute("COMMIT")
+        return claim, events
+    except sqlite3.Error:
+        if connection.in_transaction:
+            connection.execute("ROLLBACK")
+        raise
+    finally:
+        connection.close()
+
+def finish_claim(connector_name: str, claim: float, sent: bool):
+    """
+    Remove the events of a sent digest, or give them back to the buffer.
+
+    Events of a digest that could not be sent are kept for the next one,
+    retried within RETRY_SECONDS.
+
+    Args:
+        connector_name (str): Name of the connector.
+        claim (float): Claim returned by `claim_due_events`.
+        sent (bool): Whether the digest was sent.
+    """
+    connection = _connect()
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        if sent:
+            connection.execute("DELETE FROM events WHERE connector = ? AND claimed = ?", (connector_name, claim))
+        else:
+            connection.execute("UPDATE events SET claimed = NULL WHERE connector = ? AND claimed = ?",
+                               (connector_name, claim))
+            connection.execute("UPDATE schedule SET next_flush = MIN(next_flush, ?) WHERE connector = ?",
+                               (time.time() + RETRY_SECONDS, connector_name))
+        connection.execute("COMMIT")
+    except sqlite3.Error:
+        if connection.in_transaction:
+            connection.execute("ROLLBACK")
+        raise
+    finally:
+        connection.close()
+
+def format_digest(events: list) -> tuple:
+    """
+    Build one summary message from buffered events.
+
+    Movies, series and seasons are listed by title, episodes are counted per series.
+
+    Args:
+        events (list): Events returned by `claim_due_events`.
+
+    Returns:
+        tuple: The message (dict) and its options (dict), with at most one poster.
+    """
+    sections = {"movie": [], "serie": [], "season": []}
+    episodes = {}
+    picture_path = None
+    for kind, title, link, event_picture in events:
+        if kind == "episode":
+            series = title.split(", S")[0]
+            episodes[series] = episodes.get(series, 0) + 1
+            continue
+        sections.setdefault(kind, []).append(f"• {title}" + (f" ({link})" if link else ""))
+        if not picture_path and event_picture and os.path.exists(event_picture):
+            picture_path = event_picture
+
+    parts = []
+    for kind, label in (("movie", "Movies"), ("serie", "Series"), ("season", "Seasons")):
+        if sections.get(kind):
+            parts.append(f"{label}:\n" + "\n".join(sections[kind]))
+    if episodes:
+        parts.append("Episodes:\n" + "\n".join(
+            f"• {series} ({count} episode{'s' if count > 1 else ''})" for series, count in episodes.items()))
+
+    message = {
+        "title": f"{len(events)} new addition{'s' if len(events) > 1 else ''}",
+        "description": "\n\n".join(parts),
+        "media_link": {},
+        "trailer": [],
+        "technical_details": None
+    }
+    options = {"send_image": bool(picture_path), "picture_path": picture_path}
+    return message, options
+
+def flush_due_digests(connectors: dict, send):
+    """
+    Send the digest of every connector whose digest is due.
+
+    Args:
+        connectors (dict): The loaded connectors.
+        send (callable): Called with (connector_name, message, options) to send a digest,
+            returns True once it is sent.
+    """
+    for connector_name in connectors:
+        schedule = get_schedule(connector_name)
+        if not schedule:
+            continue
+        try:
+            claim, events = claim_due_events(connector_name, schedule)
+        except (sqlite3.Error, ValueError) as e:
+            logging.error(f"Could not read the digest of {connector_name}: {e}")
+            continue
+        if not events:
+            continue
+        logging.info(f"Sending digest of {len(events)} events to {connector_name}.")
+        message, options = format_digest(events)
+        sent = False
+        try:
+            sent = send(connector_name, message, options)
+        finally:
+            if not sent:
+                logging.warning(f"Digest of {connector_name} not sent, retrying in {RETRY_SECONDS}s.")
+            try:
+                finish_claim(connector_name, claim, sent)
+            except sqlite3.Error as e:
+                logging.error(f"Could not update the digest of {connector_name}: {e}")
+
+_scheduler_pid = None
+_scheduler_lock = threading.Lock()
+
+def start_scheduler(connectors: dict, send):
+    """
+    Start the background thread flushing the digests, once per process.
+
+    Args:
+        connectors (dict): The loaded connectors.
+        send (callable): Called with (connector_name, message, options) to send a digest.
+    """
+    global _scheduler_pid
+    if not any(get_schedule(connector_name) for connector_name in connectors):
+        return
+    with _scheduler_lock:
+        if _scheduler_pid == os.getpid():
+            return
+        _scheduler_pid = os.getpid()
+
+    def run():
+        while True:
+            try:
+                flush_due_digests(connectors, send)
+            except Exception as e:
+                logging.error(f"Error flushing digests: {e}")
+            time.sleep(DIGEST_CHECK_INTERVAL)
+
+    threading.Thread(target=run, name="digest-scheduler", daemon=True).start()
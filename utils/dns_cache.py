@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import time
+import socket
+import threading
+from config.settings import DNS_CACHE_TTL, DNS_CACHE_STALE_TTL
+
+_original_getaddrinfo = socket.getaddrinfo
+_hosts = set()
+# (resolution time, addresses) by getaddrinfo arguments
+_entries = {}
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "stale_hits": 0}
+
+def _cached_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+    if host not in _hosts:
+        return _original_getaddrinfo(host, port, family, type, proto, flags)
+    key = (host, port, family, type, proto, flags)
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get(key)
+        if entry and now - entry[0] < DNS_CACHE_TTL:
+            _stats["hits"] += 1
+            return entry[1]
+    try:
+        addresses = _original_getaddrinfo(host, port, family, type, proto, flags)
+    except socket.gaierror:
+        # Keep connecting to the last known addresses while the resolver is down
+        if entry and now - entry[0] < DNS_CACHE_STALE_TTL:
+            with _lock:
+                _stats["stale_hits"] += 1
+            return entry[1]
+        raise
+    with _lock:
+        _stats["misses"] += 1
+        _entries[key] = (now, addresses)
+    return addresses
+
+def install(hosts: list):
+    """
+    Cache the name resolution of some hosts in this process.
+
+    Addresses are reused for DNS_CACHE_TTL seconds, and for up to
+    DNS_CACHE_STALE_TTL seconds when the resolver fails. Other hosts are
+    resolved as usual.
+
+    Args:
+        hosts (list): Host names to cache.
+    """
+    if DNS_CACHE_TTL <= 0:
+        return
+    with _lock:
+        _hosts.update(host for host in hosts if host)
+    socket.getaddrinfo = _cached_getaddrinfo
+
+def resolve(host: str, port: int) -> list:
+    """
+    Resolve a host, filling the cache if it is installed for it.
+
+    Args:
+        host (str): Host name.
+        port (int): Port.
+
+    Returns:
+        list: The getaddrinfo results, as used to open TCP connections.
+    """
+    return socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+
+def dns_cache_stats() -> dict:
+    """
+    Get the cached hosts and the cache counters.
+
+    Returns:
+        dict: Cached hosts, TTL and hit/miss counters.
+    """
+    with _lock:
+        return dict(_stats, hosts=sorted(_hosts), ttl=DNS_CACHE_TTL)
@@ -1,33 +1,176 @@
 #!/usr/bin/env python3
 
+import os
+import time
 import requests
 import tempfile
+import mimetypes
 import logging
+from utils import http_client
+from utils.tracing import traced
+from utils.media_details import get_tmdb_image_configuration
+from config.settings import CACHE_DIR, POSTER_CACHE_TTL, POSTER_CACHE_MAX_MB, POSTER_PRUNE_INTERVAL
 
-def download_and_get_poster_by_id(poster_id: str) -> str:
+DEFAULT_POSTER_WIDTH = 342
+IMAGE_BASE_URL = "https://image.tmdb.org/t/p/"
+# Used when the TMDB configuration cannot be fetched
+FALLBACK_POSTER_SIZES = ["w92", "w154", "w185", "w342", "w500", "w780", "original"]
+# Posters used in the last minute are never pruned, a delivery may still read them
+PRUNE_GRACE_SECONDS = 60
+
+_last_prune = None
+
+def select_poster_size(width: int) -> str:
+    """
+    Select the smallest TMDB poster size at least as wide as the requested width.
+
+    Args:
+        width (int): Wanted width in pixels.
+
+    Returns:
+        str: TMDB size name (e.g. "w185"), "original" if no size is wide enough.
+    """
+    sizes = get_tmdb_image_configuration().get("poster_sizes") or FALLBACK_POSTER_SIZES
+    widths = sorted((int(size[1:]), size) for size in sizes if size.startswith("w") and size[1:].isdigit())
+    for size_width, size in widths:
+        if size_width >= width:
+            return size
+    return "original" if "original" in sizes or not widths else widths[-1][1]
+
+def get_poster_mimetype(poster_path: str) -> str:
+    """
+    Get the mime type of a downloaded poster from its extension.
+
+    Args:
+        poster_path (str): Path to the poster.
+
+    Returns:
+        str: The mime type, "image/jpeg" (TMDB's poster format) if unknown.
+    """
+    return mimetypes.guess_type(poster_path)[0] or "image/jpeg"
+
+@traced("download_poster")
+def download_and_get_poster_by_id(poster_id: str, width: int = DEFAULT_POSTER_WIDTH) -> str:
     """
     Download the poster by ID and return the file path.
 
+    Each size variant is kept in the cache directory under its TMDB name, so it
+    is only downloaded once whatever the number of events or workers using it.
+    Its modification time is updated on each use, see `prune_posters`.
+
     Args:
         poster_id (str): ID of the poster.
+        width (int, optional): Wanted width in pixels, see `select_poster_size`.
 
     Returns:
         str: Path to the downloaded poster.
     """
+    if not poster_id:
+        return ""
+
+    poster_id = poster_id.lstrip("/")
+    size = select_poster_size(width)
+    poster_dir = os.path.join(CACHE_DIR, "posters", size)
+    poster_path = os.path.join(poster_dir, poster_id)
+    try:
+        os.utime(poster_path)
+        return poster_path
+    except OSError:
+        pass
+
     # all availables size: https://api.themoviedb.org/3/configuration
-    poster_url = f"https://image.tmdb.org/t/p/w342/{poster_id}"
+    base_url = get_tmdb_image_configuration().get("secure_base_url") or IMAGE_BASE_URL
+    poster_url = f"{base_url}{size}/{poster_id}"
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as temp:
-            response = requests.get(poster_url)
-            response.raise_for_status()
+        response = http_client.get("tmdb_images", poster_url)
+        response.raise_for_status()
+        os.makedirs(poster_dir, exist_ok=True)
+        # Write to a temporary file first so other workers never read a partial poster
+        with tempfile.NamedTemporaryFile(delete=False, dir=poster_dir) as temp:
             temp.write(response.content)
-            temp_path = temp.name
-        return temp_path
+        os.replace(temp.name, poster_path)
+        maybe_prune_posters()
+        return poster_path
     except requests.RequestException as e:
         logging.error(f"Error downloading poster: {e}")
         return ""
+    except OSError as e:
+        logging.error(f"Error saving poster: {e}")
+        return ""
+
+def prune_posters(max_age: float = POSTER_CACHE_TTL, max_bytes: float = POSTER_CACHE_MAX_MB * 1024 * 1024) -> int:
+    """
+    Remove the posters unused for `max_age` seconds, then the least recently
+    used ones until the poster cache is under `max_bytes`.
+
+    Args:
+        max_age (float, optional): Maximum time in seconds since the last use of a poster.
+        max_bytes (float, optional): Maximum size of the poster cache in bytes.
+
+    Returns:
+        int: Number of files removed.
+    """
+    files = []
+    for directory, _, names in os.walk(os.path.join(CACHE_DIR, "posters")):
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    files.sort()
+
+    now = time.time()
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for mtime, size, path in files:
+        if now - mtime < PRUNE_GRACE_SECONDS or (now - mtime <= max_age and total <= max_bytes):
+            break
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Could not remove poster {path}: {e}")
+            continue
+        total -= size
+    return removed
+
+def maybe_prune_posters():
+    """
+    Prune the poster cache if it was not done in the last POSTER_PRUNE_INTERVAL seconds.
+    """
+    global _last_prune
+    now = time.monotonic()
+    if _last_prune is not None and now - _last_prune < POSTER_PRUNE_INTERVAL:
+        return
+    _last_prune = now
+    removed = prune_posters()
+    if removed:
+        logging.info(f"Removed {removed} posters from the cache.")
+
+def download_poster_variants(poster_id: str, widths: list) -> dict:
+    """
+    Download the poster in every requested width.
+
+    Widths mapping to the same TMDB size share the same file.
+
+    Args:
+        poster_id (str): ID of the poster.
+        widths (list): Wanted widths in pixels.
+
+    Returns:
+        dict: Path to the poster keyed by width (missing if the download failed).
+    """
+    variants = {}
+    for width in dict.fromkeys(widths):
+        poster_path = download_and_get_poster_by_id(poster_id, width)
+        if poster_path:
+            variants[width] = poster_path
+    return variants
 
 if __name__ == "__main__":
     poster_id = "t1i10ptOivG4hV7erkX3tmKpiqm.jpg"
     print("open",download_and_get_poster_by_id(poster_id))
-
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from config.settings import HTTP_POOL_SIZE, WARMUP_TIMEOUT
+from utils import dns_cache
+from utils.circuit_breaker import get_breaker, CircuitOpenError
+from utils.rate_limit import get_limiter
+from utils.timeouts import get_policy, request_timeout
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+_warmup_report = []
+
+def get_session() -> requests.Session:
+    """
+    Get the HTTP session of this process, whose connections are reused by all requests.
+
+    Returns:
+        requests.Session: The session, created again after a fork.
+    """
+    global _session, _session_pid
+    with _session_lock:
+        if _session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session, _session_pid = session, os.getpid()
+        return _session
+
+def request(dependency: str, method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Send an HTTP request to a dependency through its circuit breaker and rate limiter.
+
+    Connection errors, timeouts and 5xx responses count as failures. Other
+    responses are returned as-is, callers still have to check the status code.
+    Without an explicit `timeout`, the request gets the adaptive timeout of
+    the host, and its latency is recorded to adapt it.
+
+    Args:
+        dependency (str): Name of the dependency (e.g. "tmdb", "jellyfin").
+        method (str): HTTP method.
+        url (str): URL to request.
+        **kwargs: Extra arguments passed to requests.Session.request.
+
+    Returns:
+        requests.Response: Response from the dependency.
+
+    Raises:
+        CircuitOpenError: If the breaker of the dependency is open.
+        requests.RequestException: If the request itself fails.
+    """
+    breaker = get_breaker(dependency)
+    if not breaker.allow():
+        raise CircuitOpenError(f"Circuit breaker for '{dependency}' is open, skipping {method} request.")
+
+    try:
+        limiter = get_limiter(dependency)
+        if limiter:
+            limiter.acquire()
+
+        policy = None
+        if kwargs.get('timeout') is None:
+            policy = get_policy(dependency, url)
+            kwargs['timeout'] = request_timeout(policy)
+
+        start = time.monotonic()
+        try:
+            response = get_session().request(method, url, **kwargs)
+        except requests.Timeout:
+            breaker.record_failure()
+            if policy:
+                policy.observe(time.monotonic() - start, timed_out=True)
+            raise
+        except requests.RequestException:
+            breaker.record_failure()
+            raise
+        if policy:
+            policy.observe(time.monotonic() - start)
+
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+    finally:
+        # A trial call that raised anything else must not keep the breaker half-open
+        breaker.release_trial()
+
+def get(dependency: str, url: str, **kwargs) -> requests.Response:
+    """
+    Send a GET request to a dependency. See `request`.
+    """
+    return request(dependency, "GET", url, **kwargs)
+
+def post(dependency: str, url: str, **kwargs) -> requests.Response:
+    """
+    Send a POST request to a dependency. See `request`.
+    """
+    return request(dependency, "POST", url, **kwargs)
+
+def put(dependency: str, url: str, **kwargs) -> requests.Response:
+    """
+    Send a PUT request to a dependency. See `request`.
+    """
+    return request(dependency, "PUT", url, **kwargs)
+
+def patch(dependency: str, url: str, **kwargs) -> requests.Response:
+    """
+    Send a PATCH request to a dependency. See `request`.
+    """
+    return request(dependency, "PATCH", url, **kwargs)
+
+def _warm_up(dependency: str, url: str) -> dict:
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    report = {"dependency": dependency, "host": parts.hostname}
+    start = time.monotonic()
+    try:
+        dns_cache.resolve(parts.hostname, port)
+        report["dns_ms"] = round((time.monotonic() - start) * 1000, 1)
+        # A HEAD request opens a connection (TCP and TLS handshakes) left in the pool used by the
+        # requests. Whatever its status, it does not go through the circuit breaker of the dependency.
+        connect_start = time.monotonic()
+        get_session().head(url, timeout=WARMUP_TIMEOUT, allow_redirects=False)
+        report["connect_ms"] = round((time.monotonic() - connect_start) * 1000, 1)
+    except Exception as e:
+        report["error"] = str(e)
+    return report
+
+def warm_up(destinations: list) -> list:
+    """
+    Resolve and connect to the destinations before the first events.
+
+    Their host names are added to the DNS cache, and one connection to each
+    host is opened in the pool of the session, with a HEAD request.
+
+    Args:
+        destinations (list): (dependency, URL) tuples.
+
+    Returns:
+        list: DNS and connection timings of each host, also logged and kept for `warmup_report`.
+    """
+    hosts = {}
+    for dependency, url in destinations:
+        parts = urlsplit(url or "")
+        if parts.hostname and parts.scheme in ("http", "https"):
+            hosts.setdefault((parts.scheme, parts.hostname, parts.port), (dependency, url))
+    dns_cache.install([hostname for _, hostname, _ in hosts])
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, len(hosts))) as executor:
+        reports = list(executor.map(lambda destination: _warm_up(*destination), hosts.values()))
+    for report in reports:
+        if "error" in report:
+            logging.warning(f"Warm-up of {report['dependency']} ({report['host']}) failed: {report['error']}")
+        else:
+            logging.info(f"Warm-up of {report['dependency']} ({report['host']}): DNS {report['dns_ms']}ms, "
+                         f"connection {report['connect_ms']}ms")
+    failed = sum(1 for report in reports if "error" in report)
+    logging.info(f"Warmed up {len(reports) - failed} of {len(reports)} hosts in {(time.monotonic() - start) * 1000:.0f}ms.")
+    _warmup_report[:] = reports
+    return reports
+
+def warmup_report() -> list:
+    """
+    Get the timings of the last warm-up of this process.
+
+    Returns:
+        list: DNS and connection timings of each host.
+    """
+    return list(_warmup_report)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Offline IMDb to TMDB ID index, built from TMDB ID export files.
+
+Build (or rebuild) the index, the application picks it up within a minute:
+
+    python -m utils.imdb_index build movie_ids_05_01_2024.json.gz tv_series_ids_05_01_2024.json.gz
+    python -m utils.imdb_index lookup tt0137523
+"""
+
+import os
+import sys
+import gzip
+import json
+import mmap
+import time
+import array
+import bisect
+import struct
+import logging
+import argparse
+import threading
+from config.settings import IMDB_INDEX_PATH
+
+# File layout: header, then the sorted IMDb numbers (uint32), the TMDB IDs (uint32)
+# and the media types (uint8) of the entries, little-endian
+MAGIC = b"JHIMDB\x01\x00"
+HEADER = struct.Struct("<8sII")  # magic, number of entries, reserved
+MEDIA_TYPES = ("movie", "tv")
+# Seconds between two checks of the index file, to pick up a rebuilt index
+RELOAD_INTERVAL = 60
+
+def imdb_number(imdb_id: str) -> int:
+    """
+    Get the number of an IMDb ID.
+
+    Args:
+        imdb_id (str): IMDb ID, e.g. "tt0137523".
+
+    Returns:
+        int: The number (137523), None if the ID is invalid.
+    """
+    if not imdb_id or not imdb_id.startswith("tt") or not imdb_id[2:].isdigit():
+        return None
+    number = int(imdb_id[2:])
+    return number if number < 2 ** 32 else None
+
+def media_type_of(path: str) -> str:
+    """
+    Guess the media type of an export file from its name.
+
+    Args:
+        path (str): Path of the export file (e.g. "tv_series_ids_05_01_2024.json.gz").
+
+    Returns:
+        str: "movie" or "tv", None if unknown.
+    """
+    name = os.path.basename(path).lower()
+    if name.startswith("movie"):
+        return "movie"
+    if name.startswith("tv"):
+        return "tv"
+    return None
+
+def read_export(path: str, media_type: str = None):
+    """
+    Read the entries of a TMDB ID export file, one JSON object per line.
+
+    Args:
+        path (str): Path of the file, gzipped or not.
+        media_type (str, optional): Media type of the entries without `media_type` field.
+
+    Yields:
+        tuple: (IMDb number, TMDB ID, media type) of the entries with an `imdb_id`.
+    """
+    media_type = media_type or media_type_of(path)
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            number = imdb_number(entry.get("imdb_id"))
+            entry_type = entry.get("media_type", media_type)
+            if number is None or not entry.get("id") or entry_type not in MEDIA_TYPES:
+                continue
+            yield number, int(entry["id"]), entry_type
+
+def build_index(sources: list, output: str = IMDB_INDEX_PATH, media_type: str = None) -> int:
+    """
+    Build the index file from TMDB ID export files.
+
+    The file is replaced atomically, so a running application never reads
+    a partial index. For an IMDb ID found several times, the first entry wins.
+
+    Args:
+        sources (list): Paths of the export files.
+        output (str, optional): Path of the index file.
+        media_type (str, optional): Media type of the entries, guessed from the file names otherwise.
+
+    Returns:
+        int: Number of entries in the index.
+    """
+    entries = {}
+    for path in sources:
+        for number, tmdb_id, entry_type in read_export(path, media_type):
+            entries.setdefault(number, (tmdb_id, MEDIA_TYPES.index(entry_type)))
+
+    numbers = array.array("I", sorted(entries))
+    tmdb_ids = array.array("I", (entries[number][0] for number in numbers))
+    types = array.array("B", (entries[number][1] for number in numbers))
+    if sys.byteorder != "little":
+        numbers.byteswap()
+        tmdb_ids.byteswap()
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    temp_path = f"{output}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(numbers), 0))
+        numbers.tofile(f)
+        tmdb_ids.tofile(f)
+        types.tofile(f)
+    os.replace(temp_path, output)
+    return len(numbers)
+
+class ImdbIndex:
+    """
+    Memory-mapped index file. Lookups are a binary search over the mapped
+    IMDb numbers, without loading the file in the Python heap, and the pages
+    are shared by all the processes mapping it.
+    """
+
+    def __init__(self, path: str):
+        if sys.byteorder != "little":
+            raise ValueError("The IMDb index is only supported on little-endian machines.")
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, _ = HEADER.unpack_from(self._map)
+        if magic != MAGIC or len(self._map) != HEADER.size + count * 9:
+            self._map.close()
+            raise ValueError(f"{path} is not a valid IMDb index file.")
+        self.count = count
+        view = memoryview(self._map)
+        self._numbers = view[HEADER.size:HEADER.size + 4 * count].cast("I")
+        self._tmdb_ids = view[HEADER.size + 4 * count:HEADER.size + 8 * count].cast("I")
+        self._types = view[HEADER.size + 8 * count:]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def lookup(self, imdb_id: str) -> tuple:
+        """
+        Get the TMDB ID of an IMDb ID.
+
+        Args:
+            imdb_id (str): IMDb ID, e.g. "tt0137523".
+
+        Returns:
+            tuple: (media type, TMDB ID), None if the IMDb ID is not in the index.
+        """
+        number = imdb_number(imdb_id)
+        if number is None:
+            return None
+        position = bisect.bisect_left(self._numbers, number)
+        if position == self.count or self._numbers[position] != number:
+            return None
+        return MEDIA_TYPES[self._types[position]], self._tmdb_ids[position]
+
+    def close(self):
+        self._numbers.release()
+        self._tmdb_ids.release()
+        self._types.release()
+        self._map.close()
+
+_index = None
+_index_stamp = None
+_index_checked = None
+_index_lock = threading.Lock()
+
+def get_index(path: str = IMDB_INDEX_PATH) -> ImdbIndex:
+    """
+    Get the index of this process, reopened when the file is rebuilt.
+
+    Args:
+        path (str, optional): Path of the index file.
+
+    Returns:
+        ImdbIndex: The index, None if there is no index file.
+    """
+    global _index, _index_stamp, _index_checked
+    now = time.monotonic()
+    if _index_checked is not None and now - _index_checked < RELOAD_INTERVAL:
+        return _index
+    with _index_lock:
+        _index_checked = now
+        try:
+            stat = os.stat(path)
+        except OSError:
+            _index, _index_stamp = None, None
+            return None
+        stamp = (stat.st_ino, stat.st_mtime_ns)
+        if stamp != _index_stamp:
+            try:
+                # The previous index is left to the garbage collector, a lookup may still use it
+                _index = ImdbIndex(path)
+                logging.info(f"Loaded IMDb index {path} with {len(_index)} entries.")
+            except (OSError, ValueError) as e:
+                logging.error(f"Could not load IMDb index {path}: {e}")
+                _index = None
+            _index_stamp = stamp
+        return _index
+
+def lookup_tmdb_link(imdb_id: str) -> str:
+    """
+    Get the TMDb link of an IMDb ID from the offline index.
+
+    Args:
+        imdb_id (str): IMDb ID, e.g. "tt0137523".
+
+    Returns:
+        str: TMDb link, None if there is no index or the IMDb ID is not in it.
+    """
+    index = get_index()
+    entry = index.lookup(imdb_id) if index else None
+    if not entry:
+        return None
+    media_type, tmdb_id = entry
+    return f"https://tmdb.org/{media_type}/{tmdb_id}"
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Offline IMDb to TMDB ID index.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build the index from TMDB ID export files")
+    build.add_argument("sources", nargs="+", help="export files, one JSON object per line with `id` and `imdb_id` (.json or .json.gz)")
+    build.add_argument("--output", default=IMDB_INDEX_PATH, help=f"index file (default: {IMDB_INDEX_PATH})")
+    build.add_argument("--type", choices=MEDIA_TYPES, help="media type of the entries (default: guessed from the file names)")
+    lookup = commands.add_parser("lookup", help="look up IMDb IDs in the index")
+    lookup.add_argument("imdb_ids", nargs="+")
+    lookup.add_argument("--index", default=IMDB_INDEX_PATH, help=f"index file (default: {IMDB_INDEX_PATH})")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        count = build_index(args.sources, args.output, args.type)
+        logging.info(f"Built {args.output} with {count} entries in {time.perf_counter() - start:.1f}s "
+                     f"({os.path.getsize(args.output)} bytes).")
+        if not count:
+            logging.warning("No entry has an `imdb_id`: the daily TMDB exports only contain TMDB IDs, "
+                            "the files must be enriched with the IMDb IDs first.")
+    else:
+        index = ImdbIndex(args.index)
+        for imdb_id in args.imdb_ids:
+            print(imdb_id, index.lookup(imdb_id))
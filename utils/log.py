@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+from datetime import datetime, timezone
+from config.settings import LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_SAMPLE_RATE, LOG_QUEUE_SIZE
+from utils.tracing import TraceIdFilter
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - [%(trace_id)s] %(message)s'
+# Attributes of every LogRecord, the others come from `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+def parse_levels(value: str) -> dict:
+    """
+    Parse per-logger levels such as "connectors.matrix=DEBUG,urllib3=WARNING".
+
+    Args:
+        value (str): Comma-separated name=LEVEL pairs. A name is a logger name or a
+            module path of the project (e.g. "connectors.matrix", "utils.media_details").
+
+    Returns:
+        dict: Numeric level keyed by name.
+    """
+    levels = {}
+    for pair in value.split(","):
+        name, _, level = pair.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = logging.getLevelName(level.strip().upper())
+    return {name: level for name, level in levels.items() if isinstance(level, int)}
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format records as one JSON object per line, with the `extra` fields.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "trace_id": getattr(record, "trace_id", "-"),
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key not in entry and key != "sampled":
+                entry[key] = value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class LevelFilter(logging.Filter):
+    """
+    Apply per-logger levels, and the default level to the other records.
+
+    The project logs through the root logger, so a name also matches the
+    module path of the code that logged the record (e.g. "connectors.matrix").
+    """
+
+    def __init__(self, default: int, levels: dict):
+        super().__init__()
+        self.default = default
+        self.levels = levels
+        self._modules = {}
+
+    def _level(self, record: logging.LogRecord) -> int:
+        module = self._modules.get(record.pathname)
+        if module is None:
+            path = os.path.relpath(os.path.splitext(record.pathname)[0], ROOT_DIR)
+            module = self._modules[record.pathname] = path.replace(os.sep, ".")
+        for name in (record.name, module):
+            while name:
+                if name in self.levels:
+                    return self.levels[name]
+                name = name.rpartition(".")[0]
+        return self.default
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= self._level(record)
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of the records logged with `extra={"sampled": True}`.
+
+    Used for high-volume success lines; warnings and errors are never sampled.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "sampled", False) or record.levelno >= logging.WARNING or random.random() < self.rate:
+            return True
+        self.dropped += 1
+        return False
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler dropping records when the queue is full, instead of blocking the caller.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the arguments and the traceback into the record before it leaves the thread
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_listener = None
+_handler = None
+_sampler = None
+_pid = None
+_lock = threading.Lock()
+
+def setup_logging():
+    """
+    Configure the root logger to log through a queue, written by a background thread.
+
+    Callers only format the message and put it in the queue (trace ID, level
+    and sampling filters run in the caller, for the context variables), so
+    writing the logs never adds latency to a request. Safe to call again,
+    e.g. in a forked worker, where the writer thread is restarted.
+    """
+    global _listener, _handler, _sampler, _pid
+    with _lock:
+        if _pid == os.getpid():
+            return
+        _pid = os.getpid()
+
+        levels = parse_levels(LOG_LEVELS)
+        default = logging.getLevelName(LOG_LEVEL.upper())
+        default = default if isinstance(default, int) else logging.INFO
+        for name, level in levels.items():
+            logging.getLogger(name).setLevel(level)
+
+        output = logging.StreamHandler(sys.stderr)
+        output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        # Records below the default level may still be wanted for some loggers
+        root.setLevel(min([default] + list(levels.values())))
+        _handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        _sampler = SamplingFilter(LOG_SAMPLE_RATE)
+        _handler.addFilter(TraceIdFilter())
+        _handler.addFilter(LevelFilter(default, levels))
+        _handler.addFilter(_sampler)
+        root.addHandler(_handler)
+
+        # The listener of the parent process has no thread in a forked child
+        _listener = logging.handlers.QueueListener(_handler.queue, output, respect_handler_level=True)
+        _listener.start()
+    atexit.register(flush_logging)
+
+def flush_logging():
+    """
+    Write the queued records and stop the writer thread.
+    """
+    global _pid
+    with _lock:
+        if _listener and _pid == os.getpid():
+            _listener.stop()
+            _pid = None
+
+def logging_stats() -> dict:
+    """
+    Get the counters of the logging pipeline.
+
+    Returns:
+        dict: Records waiting in the queue, dropped because it was full, and dropped by sampling.
+    """
+    if _handler is None:
+        return {}
+    return {
+        "queued": _handler.queue.qsize(),
+        "dropped_queue_full": _handler.dropped,
+        "dropped_sampling": _sampler.dropped,
+        "sample_rate": LOG_SAMPLE_RATE
+    }
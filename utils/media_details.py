@@ -3,8 +3,16 @@ import requests
 import re
 import os
 import logging
-from config.settings import TMDB_API_KEY, LANGUAGE, LANGUAGE2, BASE_URL, JELLYFIN_API_URL, JELLYFIN_API_KEY, JELLYFIN_USER_ID
-
+import threading
+from utils import http_client
+from utils.imdb_index import lookup_tmdb_link
+from utils.cache import cached, TTLCache, count_lookup
+from utils.tracing import traced
+from config.settings import (TMDB_API_KEY, LANGUAGE, LANGUAGE2, BASE_URL, JELLYFIN_API_URL, JELLYFIN_API_KEY, JELLYFIN_USER_ID,
+                             CACHE_TTL_SECONDS, JELLYFIN_ITEM_CACHE_TTL, JELLYFIN_ITEM_CACHE_ITEMS)
+
+@traced("get_tmdb_details")
+@cached("get_tmdb_details")
 def get_tmdb_details(media_type: str, tmdbid: str, language: str = LANGUAGE) -> dict:
     """
     Get details from TMDB API.
@@ -30,13 +38,13 @@ def get_tmdb_details(media_type: str, tmdbid: str, language: str = LANGUAGE) ->
     }
     
     try:
-        response_primary = requests.get(url, params=params_primary, timeout=10)
+        response_primary = http_client.get("tmdb", url, params=params_primary)
         response_primary.raise_for_status()
         details = response_primary.json()
 
         # If details are incomplete, fetch with the secondary language
         if any(not details.get(key) for key in details):
-            response_secondary = requests.get(url, params=params_secondary, timeout=10)
+            response_secondary = http_client.get("tmdb", url, params=params_secondary)
             response_secondary.raise_for_status()
             details_secondary = response_secondary.json()
 
@@ -53,7 +61,25 @@ def get_tmdb_details(media_type: str, tmdbid: str, language: str = LANGUAGE) ->
 
 def imdb_to_tmdb(imdb_id: str) -> str:
     """
-    Get TMDB ID from IMDb ID.
+    Get TMDB ID from IMDb ID, from the offline index if there is one, from TMDB otherwise.
+
+    Args:
+        imdb_id (str): IMDb ID of the media.
+
+    Returns:
+        str: TMDB link.
+    """
+    link = lookup_tmdb_link(imdb_id)
+    if link:
+        count_lookup("imdb_to_tmdb", "index_hits")
+        return link
+    return find_tmdb_link(imdb_id)
+
+@traced("imdb_to_tmdb")
+@cached("imdb_to_tmdb")
+def find_tmdb_link(imdb_id: str) -> str:
+    """
+    Get TMDB ID from IMDb ID with the TMDB find API.
 
     Args:
         imdb_id (str): IMDb ID of the media.
@@ -63,7 +89,7 @@ def imdb_to_tmdb(imdb_id: str) -> str:
     """
     url = f"{BASE_URL}/find/{imdb_id}?external_source=imdb_id&language={LANGUAGE}&api_key={TMDB_API_KEY}"
     try:
-        response = requests.get(url, timeout=10)
+        response = http_client.get("tmdb", url)
         response.raise_for_status()
         results = response.json()
         if "movie_results" in results and results["movie_results"]:
@@ -76,26 +102,70 @@ def imdb_to_tmdb(imdb_id: str) -> str:
         logging.error(f"Error fetching TMDB link from IMDb ID: {e}")
     return None
 
-def get_trailer_link(media_type: str, tmdbid: str) -> list:
+@traced("get_tmdb_image_configuration")
+@cached("tmdb_image_configuration")
+def get_tmdb_image_configuration() -> dict:
+    """
+    Get the image configuration from TMDB API (base URL and available sizes).
+
+    Returns:
+        dict: The "images" part of https://api.themoviedb.org/3/configuration.
+    """
+    url = f"{BASE_URL}/configuration"
+    params = {
+        'api_key': TMDB_API_KEY,
+    }
+    try:
+        response = http_client.get("tmdb", url, params=params)
+        response.raise_for_status()
+        return response.json().get("images", {})
+    except requests.RequestException as e:
+        logging.error(f"Error fetching TMDB configuration: {e}")
+        return {}
+
+# Name of the trailers in TMDB by language, "trailer" for the others
+TRAILER_PATTERNS = {
+    "fr": r"bande[-\s]?annonce",
+}
+
+@traced("get_trailer_link")
+def get_trailer_link(media_type: str, tmdbid: str, language: str = LANGUAGE) -> list:
     """
-    Get the Youtube trailer link.
+    Get the Youtube trailer links, in the language and in LANGUAGE2.
 
     Args:
         media_type (str): Type of media (movie, tv).
         tmdbid (str): TMDB ID of the media.
+        language (str, optional): Main language of the trailers. Defaults to LANGUAGE.
 
     Returns:
         list: Trailer link(s).
     """
-    languages = [(LANGUAGE, r"bande[-\s]?annonce"), (LANGUAGE2, r"trailer")]
     trailer_links = []
-    vidt = f"{media_type}/{tmdbid}"
-    for language, pattern in languages:
-        youtube_key = search_trailer_key(vidt, language, pattern)
-        if youtube_key:
-            trailer_links.append(f"https://youtu.be/{youtube_key}")
+    for trailer_language in dict.fromkeys([language, LANGUAGE2]):
+        trailer_link = get_trailer_in_language(media_type, tmdbid, trailer_language)
+        if trailer_link:
+            trailer_links.append(trailer_link)
     return trailer_links
 
+def get_trailer_in_language(media_type: str, tmdbid: str, language: str) -> str:
+    """
+    Get the Youtube link of the trailer in a language.
+
+    Args:
+        media_type (str): Type of media (movie, tv).
+        tmdbid (str): TMDB ID of the media.
+        language (str): Language of the trailer (e.g. "fr-FR").
+
+    Returns:
+        str: Trailer link, None if there is none in this language.
+    """
+    pattern = TRAILER_PATTERNS.get(language.split("-")[0].lower(), r"trailer")
+    youtube_key = search_trailer_key(f"{media_type}/{tmdbid}", language, pattern)
+    return f"https://youtu.be/{youtube_key}" if youtube_key else None
+
+@traced("search_trailer_key")
+@cached("search_trailer_key")
 def search_trailer_key(vidt: str, language: str, pattern: str) -> str:
     """
     Search for the trailer key in the TMDB API.
@@ -117,7 +187,7 @@ def search_trailer_key(vidt: str, language: str, pattern: str) -> str:
         'language': language,
     }
     try:
-        response = requests.get(url, params=params, timeout=10)
+        response = http_client.get("tmdb", url, params=params)
         if response.status_code == 200:
             data = response.json()
             results = data.get("results", [])
@@ -150,6 +220,18 @@ def is_season_ep_or_movie(media_type: str, title: str) -> str:
             return "serie"
     return None
 
+# VFF: Version Française de France (TrueFrench)
+KEYWORDS_VFF_EXACT = ['vff', 'vfi', 'fr-fr', 'vf2']
+KEYWORDS_VFF_CONTAINS = ['truefrench', 'european', 'france']
+
+# VFQ: Version Française Québécoise
+KEYWORDS_VFQ_EXACT = ['vfq', 'fr-ca', 'ca']
+KEYWORDS_VFQ_CONTAINS = ['canadian', 'canadien']
+
+# Word boundaries for short keywords like 'ca' to avoid technical terms like 'dca'
+_VFF_EXACT = re.compile("|".join(rf'\b{re.escape(k)}\b' for k in KEYWORDS_VFF_EXACT))
+_VFQ_EXACT = re.compile("|".join(rf'\b{re.escape(k)}\b' for k in KEYWORDS_VFQ_EXACT))
+
 def analyze_french_version(display_title: str, language_code: str, filename: str = "") -> str:
     """
     Analyzes the display title and language code to determine if it's VFF or VFQ.
@@ -166,28 +248,33 @@ def analyze_french_version(display_title: str, language_code: str, filename: str
     if lang_code_upper not in ['FRE', 'FRA']:
         return lang_code_upper
 
-    combined_source_text = f"{(display_title or '').lower()} {(filename or '').lower()}"
-
-    # VFF: Version Française de France (TrueFrench)
-    keywords_vff_exact = ['vff', 'vfi', 'fr-fr', 'vf2']
-    keywords_vff_contains = ['truefrench', 'european', 'france']
-    
-    # VFQ: Version Française Québécoise
-    keywords_vfq_exact = ['vfq', 'fr-ca', 'ca']
-    keywords_vfq_contains = ['canadian', 'canadien']
+    is_vff, is_vfq = _french_version_flags(display_title)
+    filename_vff, filename_vfq = _french_version_flags(filename)
 
     # Check VFF first as it's often more explicit and to avoid 'ca' in 'dca' matching VFQ
-    if any(re.search(rf'\b{re.escape(k)}\b', combined_source_text) for k in keywords_vff_exact) or \
-       any(k in combined_source_text for k in keywords_vff_contains):
+    if is_vff or filename_vff:
         return "🇫🇷 VFF"
 
-    # Then check VFQ, using word boundaries for short keywords like 'ca' to avoid technical terms like 'dca'
-    if any(re.search(rf'\b{re.escape(k)}\b', combined_source_text) for k in keywords_vfq_exact) or \
-       any(k in combined_source_text for k in keywords_vfq_contains):
+    if is_vfq or filename_vfq:
         return "🇨🇦 VFQ"
 
     return "FR"
 
+def _french_version_flags(text: str) -> tuple:
+    """
+    Look for the VFF and VFQ keywords in a text.
+
+    Args:
+        text (str): A stream display title or a filename.
+
+    Returns:
+        tuple: (VFF keyword found, VFQ keyword found).
+    """
+    text = (text or "").lower()
+    is_vff = bool(_VFF_EXACT.search(text)) or any(k in text for k in KEYWORDS_VFF_CONTAINS)
+    is_vfq = bool(_VFQ_EXACT.search(text)) or any(k in text for k in KEYWORDS_VFQ_CONTAINS)
+    return is_vff, is_vfq
+
 def _get_resolution_label(width: int, height: int) -> str:
     """
     Determines the resolution label (e.g., 1080p, 2160p) based on video dimensions.
@@ -225,10 +312,220 @@ def _get_resolution_label(width: int, height: int) -> str:
     
     return "SD"
 
+def extract_technical_details(data: dict) -> dict:
+    """
+    Build the technical details of a Jellyfin item from its media streams.
+
+    Args:
+        data (dict): The Jellyfin item, with its Path and MediaStreams.
+
+    Returns:
+        dict: A dictionary containing formatted technical details of the media.
+    """
+    media_path = data.get('Path', '')
+    filename = os.path.basename(media_path) if media_path else ""
+    media_streams = data.get('MediaStreams', [])
+    if not media_streams:
+        return {}
+
+    details = {
+        'video': {},
+        'audio': [],
+        'subtitles': []
+    }
+
+    # Video details
+    video_stream = next((s for s in media_streams if s.get('Type') == 'Video'), None)
+    if video_stream:
+        width = video_stream.get('Width')
+        height = video_stream.get('Height')
+        details['video']['resolution'] = _get_resolution_label(width, height)
+
+        details['video']['codec'] = video_stream.get('Codec', 'N/A').upper()
+        if video_stream.get('VideoRange') == 'HDR':
+            details['video']['hdr'] = "HDR"
+
+    # Audio details
+    for stream in media_streams:
+        if stream.get('Type') == 'Audio':
+            language_label = analyze_french_version(
+                stream.get('DisplayTitle'), 
+                stream.get('Language'),
+                filename
+            )
+            details['audio'].append(language_label)
+            
+    # Subtitle details
+    for stream in media_streams:
+        if stream.get('Type') == 'Subtitle':
+            language_label = analyze_french_version(
+                stream.get('DisplayTitle'), 
+                stream.get('Language'),
+                filename
+            )
+            details['subtitles'].append(language_label)
+            
+    # Handle duplicates
+    if details['audio']:
+        details['audio'] = list(dict.fromkeys(details['audio']))
+    if details['subtitles']:
+        details['subtitles'] = list(dict.fromkeys(details['subtitles']))
+
+    # Handle empty lists
+    if not details['audio']:
+        details.pop('audio')
+    if not details['subtitles']:
+        details.pop('subtitles')
+
+    return details
+
+# Technical details by item ID, reused without request while fresh
+_recent_items = TTLCache(JELLYFIN_ITEM_CACHE_ITEMS, JELLYFIN_ITEM_CACHE_TTL)
+# Technical details by (item ID, modification stamp), reused without stream analysis
+_parsed_items = TTLCache(JELLYFIN_ITEM_CACHE_ITEMS, CACHE_TTL_SECONDS)
+# Technical details by (series ID, stream layout), shared by the episodes of a series
+_series_layouts = TTLCache(JELLYFIN_ITEM_CACHE_ITEMS, CACHE_TTL_SECONDS)
+# (series ID, season number, episode number) by episode ID
+_episode_positions = TTLCache(JELLYFIN_ITEM_CACHE_ITEMS, CACHE_TTL_SECONDS)
+# Seasons whose episodes were fetched in one request
+_prefetched_seasons = TTLCache(256, JELLYFIN_ITEM_CACHE_TTL)
+_prefetch_lock = threading.Lock()
+
+def _modification_stamp(data: dict) -> str:
+    return data.get('DateLastSaved') or data.get('DateModified') or data.get('Etag') or ''
+
+def stream_layout(data: dict) -> tuple:
+    """
+    Get what the technical details of an item depend on, except its name.
+
+    Episodes of a series usually share their layout (same codec, resolution and
+    tracks), so their technical details can be computed once per series.
+
+    Args:
+        data (dict): The Jellyfin item, with its Path and MediaStreams.
+
+    Returns:
+        tuple: The relevant fields of each stream, and the VFF/VFQ keywords found in the filename.
+    """
+    streams = tuple((s.get('Type'), s.get('Codec'), s.get('Width'), s.get('Height'), s.get('VideoRange'),
+                     s.get('Language'), s.get('DisplayTitle'))
+                    for s in data.get('MediaStreams', []) if s.get('Type') in ('Video', 'Audio', 'Subtitle'))
+    return streams, _french_version_flags(os.path.basename(data.get('Path') or ''))
+
+def _remember_episode(data: dict):
+    if data.get('Type') == 'Episode':
+        _episode_positions.set(data.get('Id'), (data.get('SeriesId'), data.get('ParentIndexNumber'), data.get('IndexNumber')))
+
+def get_episode_position(item_id: str) -> tuple:
+    """
+    Get the series and numbers of an episode already fetched from Jellyfin.
+
+    Args:
+        item_id (str): The ID of the episode in Jellyfin.
+
+    Returns:
+        tuple: Series ID, season number and episode number, None for the unknown ones.
+    """
+    hit, position = _episode_positions.get(item_id)
+    return position if hit else (None, None, None)
+
+@traced("get_series_tmdb")
+@cached("series_tmdb")
+def get_series_tmdb(series_id: str) -> str:
+    """
+    Get the TMDB ID of a series from its Jellyfin metadata.
+
+    Args:
+        series_id (str): The ID of the series in Jellyfin.
+
+    Returns:
+        str: The TMDB ID of the series, None if unknown.
+    """
+    if not all([JELLYFIN_API_URL, JELLYFIN_API_KEY, JELLYFIN_USER_ID]):
+        return None
+    headers = {'X-Emby-Token': JELLYFIN_API_KEY}
+    url = f"{JELLYFIN_API_URL}/Users/{JELLYFIN_USER_ID}/Items/{series_id}"
+    try:
+        response = http_client.get("jellyfin", url, headers=headers)
+        response.raise_for_status()
+        provider_ids = {key.lower(): value for key, value in (response.json().get('ProviderIds') or {}).items()}
+        return provider_ids.get('tmdb')
+    except requests.RequestException as e:
+        logging.error(f"Error fetching Jellyfin series {series_id}: {e}")
+        return None
+
+def get_item_technical_details(data: dict) -> dict:
+    """
+    Get the technical details of a Jellyfin item, analysing its streams only when needed.
+
+    The details are reused while the item is unchanged, and across the episodes
+    of a series with the same stream layout.
+
+    Args:
+        data (dict): The Jellyfin item, with its Path and MediaStreams.
+
+    Returns:
+        dict: The technical details, as returned by `extract_technical_details`.
+    """
+    item_key = (data.get('Id'), _modification_stamp(data))
+    hit, details = _parsed_items.get(item_key)
+    if hit:
+        count_lookup("jellyfin_items", "unchanged_hits")
+        return details
+
+    layout_key = (data.get('SeriesId'), stream_layout(data)) if data.get('SeriesId') else None
+    if layout_key:
+        hit, details = _series_layouts.get(layout_key)
+        if hit:
+            count_lookup("jellyfin_items", "series_hits")
+    if not hit:
+        details = extract_technical_details(data)
+        # Streams are empty until Jellyfin has probed the file, do not keep that
+        if details and layout_key:
+            _series_layouts.set(layout_key, details)
+    if details:
+        _parsed_items.set(item_key, details)
+    return details
+
+def _prefetch_season(season_id: str):
+    """
+    Fetch the episodes of a season in one request, to cache their technical details.
+
+    During an import, a webhook comes for each episode of a season: the
+    following ones are served from the cache.
+
+    Args:
+        season_id (str): The ID of the season in Jellyfin.
+    """
+    with _prefetch_lock:
+        hit, _ = _prefetched_seasons.get(season_id)
+        if hit:
+            return
+        _prefetched_seasons.set(season_id, True)
+
+    headers = {'X-Emby-Token': JELLYFIN_API_KEY}
+    url = f"{JELLYFIN_API_URL}/Users/{JELLYFIN_USER_ID}/Items"
+    params = {'ParentId': season_id, 'IncludeItemTypes': 'Episode', 'Fields': 'MediaStreams,Path,DateLastSaved'}
+    try:
+        response = http_client.get("jellyfin", url, headers=headers, params=params)
+        response.raise_for_status()
+        for item in response.json().get('Items', []):
+            _remember_episode(item)
+            details = get_item_technical_details(item)
+            if details:
+                _recent_items.set(item.get('Id'), details)
+    except requests.RequestException as e:
+        logging.warning(f"Could not prefetch the episodes of season {season_id}: {e}")
+
+@traced("get_jellyfin_media_details")
 def get_jellyfin_media_details(item_id: str) -> dict:
     """
     Get media details from Jellyfin API, with enhanced French version detection.
 
+    Details fetched less than JELLYFIN_ITEM_CACHE_TTL seconds ago are reused
+    without request (duplicate webhooks, retries). For an episode, the other
+    episodes of its season are fetched in the background in one request.
+
     Args:
         item_id (str): The ID of the media item in Jellyfin.
 
@@ -239,77 +536,82 @@ def get_jellyfin_media_details(item_id: str) -> dict:
         logging.warning("Jellyfin API URL, Key, or User ID is not set. Skipping Jellyfin details.")
         return {}
 
+    hit, details = _recent_items.get(item_id)
+    if hit:
+        count_lookup("jellyfin_items", "memory_hits")
+        return details
+    count_lookup("jellyfin_items", "misses")
+
     headers = {
         'X-Emby-Token': JELLYFIN_API_KEY
     }
     url = f"{JELLYFIN_API_URL}/Users/{JELLYFIN_USER_ID}/Items/{item_id}"
 
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        response = http_client.get("jellyfin", url, headers=headers)
         response.raise_for_status()
         data = response.json()
-
-        media_path = data.get('Path', '')
-        filename = os.path.basename(media_path) if media_path else ""
-        media_streams = data.get('MediaStreams', [])
-        if not media_streams:
-            return {}
-
-        details = {
-            'video': {},
-            'audio': [],
-            'subtitles': []
-        }
-
-        # Video details
-        video_stream = next((s for s in media_streams if s.get('Type') == 'Video'), None)
-        if video_stream:
-            width = video_stream.get('Width')
-            height = video_stream.get('Height')
-            details['video']['resolution'] = _get_resolution_label(width, height)
-
-            details['video']['codec'] = video_stream.get('Codec', 'N/A').upper()
-            if video_stream.get('VideoRange') == 'HDR':
-                details['video']['hdr'] = "HDR"
-
-        # Audio details
-        for stream in media_streams:
-            if stream.get('Type') == 'Audio':
-                language_label = analyze_french_version(
-                    stream.get('DisplayTitle'), 
-                    stream.get('Language'),
-                    filename
-                )
-                details['audio'].append(language_label)
-                
-        # Subtitle details
-        for stream in media_streams:
-            if stream.get('Type') == 'Subtitle':
-                language_label = analyze_french_version(
-                    stream.get('DisplayTitle'), 
-                    stream.get('Language'),
-                    filename
-                )
-                details['subtitles'].append(language_label)
-                
-        # Handle duplicates
-        if details['audio']:
-            details['audio'] = list(dict.fromkeys(details['audio']))
-        if details['subtitles']:
-            details['subtitles'] = list(dict.fromkeys(details['subtitles']))
-
-        # Handle empty lists
-        if not details['audio']:
-            details.pop('audio')
-        if not details['subtitles']:
-            details.pop('subtitles')
-
+        _remember_episode(data)
+        details = get_item_technical_details(data)
+        if details:
+            _recent_items.set(item_id, details)
+        if data.get('Type') == 'Episode' and data.get('SeasonId'):
+            threading.Thread(target=_prefetch_season, args=(data['SeasonId'],), name="jellyfin-prefetch", daemon=True).start()
         return details
 
     except requests.RequestException as e:
         logging.error(f"Error fetching Jellyfin media details for item {item_id}: {e}")
         return {}
 
+@traced("get_jellyfin_items")
+def get_jellyfin_items(limit: int = None, item_types: list = None, start_index: int = 0,
+                       min_date_last_saved: str = None, sort_order: str = "Descending",
+                       raise_errors: bool = False) -> list:
+    """
+    List library items from Jellyfin, sorted by date added (most recent first by default).
+
+    Args:
+        limit (int, optional): Maximum number of items to return. Defaults to all items.
+        item_types (list, optional): Jellyfin item types (e.g. ["Movie", "Series"]). Defaults to movies and series.
+        start_index (int, optional): Index of the first item to return, for paging.
+        min_date_last_saved (str, optional): Only list items saved since this ISO 8601 date.
+        sort_order (str, optional): "Descending" or "Ascending".
+        raise_errors (bool, optional): Raise request errors instead of returning an empty list.
+
+    Returns:
+        list: Jellyfin items, with their ProviderIds and dates.
+    """
+    if not all([JELLYFIN_API_URL, JELLYFIN_API_KEY, JELLYFIN_USER_ID]):
+        logging.warning("Jellyfin API URL, Key, or User ID is not set. Cannot list Jellyfin items.")
+        return []
+
+    headers = {
+        'X-Emby-Token': JELLYFIN_API_KEY
+    }
+    url = f"{JELLYFIN_API_URL}/Users/{JELLYFIN_USER_ID}/Items"
+    params = {
+        'Recursive': 'true',
+        'IncludeItemTypes': ",".join(item_types or ["Movie", "Series"]),
+        'Fields': 'ProviderIds,DateCreated,DateLastSaved',
+        'SortBy': 'DateCreated',
+        'SortOrder': sort_order,
+        'StartIndex': start_index,
+    }
+    if limit:
+        params['Limit'] = limit
+    if min_date_last_saved:
+        params['MinDateLastSaved'] = min_date_last_saved
+
+    try:
+        response = http_client.get("jellyfin", url, headers=headers, params=params)
+        response.raise_for_status()
+        return response.json().get('Items', [])
+    except requests.RequestException as e:
+        logging.error(f"Error listing Jellyfin items: {e}")
+        if raise_errors:
+            raise
+        return []
+
 if __name__ == "__main__":
     media_type = "movie"
     tmdbid = "550"
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import threading
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from config.settings import NOTIFY_FIRST_WORKERS
+
+# Notify-first events are enriched on this pool once their first notification is queued
+_executor = ThreadPoolExecutor(max_workers=NOTIFY_FIRST_WORKERS, thread_name_prefix="notify-first")
+
+_stats_lock = threading.Lock()
+_stats = {
+    "notified": 0,
+    "edited": 0,
+    "not_edited": 0
+}
+
+class Notification:
+    """
+    First message of a notify-first event on a connector supporting edits.
+
+    The message ID is set once the first message is sent, the edit carrying
+    the enriched message waits for it.
+    """
+
+    def __init__(self):
+        self.message_id = None
+        self._sent = threading.Event()
+
+    def set_sent(self, message_id: str):
+        """
+        Record the ID of the first message, None if it could not be sent.
+
+        Args:
+            message_id (str): ID of the message in the service.
+        """
+        self.message_id = message_id
+        self._sent.set()
+
+    def wait(self, timeout: float) -> str:
+        """
+        Wait for the first message to be sent.
+
+        Args:
+            timeout (float): Maximum time to wait in seconds.
+
+        Returns:
+            str: ID of the message, None if it was not sent in time.
+        """
+        self._sent.wait(timeout)
+        return self.message_id
+
+def run_in_background(func, *args):
+    """
+    Run a function on the notify-first pool, in a copy of the context so the
+    trace ID follows it. Exceptions are logged.
+
+    Args:
+        func (callable): Function to run.
+        *args: Positional arguments for func.
+    """
+    def run():
+        try:
+            func(*args)
+        except Exception as e:
+            logging.error(f"Background enrichment failed: {e}")
+    context = contextvars.copy_context()
+    _executor.submit(context.run, run)
+
+def count(outcome: str):
+    """
+    Count a notify-first outcome, reported by `notify_first_stats`.
+
+    Args:
+        outcome (str): "notified", "edited" or "not_edited" (sent as a new message instead).
+    """
+    with _stats_lock:
+        _stats[outcome] += 1
+
+def notify_first_stats() -> dict:
+    """
+    Get the notify-first counters.
+
+    Returns:
+        dict: Number of first notifications sent, edited, and replaced by a new message.
+    """
+    with _stats_lock:
+        return dict(_stats)
@@ -3,22 +3,38 @@
 import re
 import os
 import logging
+import functools
 from config.settings import TMDB_API_KEY, LANGUAGE, LANGUAGE2, BASE_URL, SKIP_EPISODE_NOTIFICATIONS
-from utils.media_details import get_tmdb_details, imdb_to_tmdb, get_trailer_link, get_jellyfin_media_details
-from utils.download import download_and_get_poster_by_id
+from utils.media_details import (get_tmdb_details, imdb_to_tmdb, get_trailer_link, get_trailer_in_language,
+                                 get_jellyfin_media_details, get_episode_position, get_series_tmdb)
+from utils.download import download_and_get_poster_by_id, download_poster_variants, DEFAULT_POSTER_WIDTH
+from utils.budget import EventBudget
+from utils.tracing import traced
 
 #logging.basicConfig(level=logging.DEBUG,format='%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s')
 
-def handle_media(data: dict, item_id: str) -> dict:
+@traced()
+def handle_media(data: dict, item_id: str, poster_widths: list = None, languages: list = None) -> dict:
     """
     Manage media data and format the message.
 
+    Optional enrichment stages (trailers, poster, technical details, TMDb links)
+    run within the event latency budget and are left out of the
+    message once it is spent.
+
+    The TMDB details and trailers are fetched once per language wanted by the
+    connectors, concurrently, and a message is formatted for each language.
+
     Args:
         data (dict): The media data from Jellyfin.
         item_id (str): The Jellyfin item ID.
+        poster_widths (list, optional): Poster widths wanted by the connectors. Each one is
+            downloaded once, `picture_path` always being the default width.
+        languages (list, optional): Languages wanted by the connectors. Defaults to LANGUAGE.
 
     Returns:
-        dict: The formatted message and options.
+        dict: The message in the first language, the messages by language, options
+        and the kind of event ("movie", "serie", "season" or "episode").
 
     """
     media_type = data.get('media_type', '')
@@ -27,70 +43,201 @@ def handle_media(data: dict, item_id: str) -> dict:
     tmdb = data.get('tmdb', '')
 
     message = {}
+    messages = None
+    languages = list(dict.fromkeys(languages or [LANGUAGE]))
     send_image = False
     picture_path = None
+    posters = {}
+    poster_widths = [DEFAULT_POSTER_WIDTH] + list(poster_widths or [])
+    budget = EventBudget()
+    kind = is_season_ep_or_movie(media_type, title)
 
-    if is_season_ep_or_movie(media_type, title) == "movie":
+    if kind == "movie":
         # It's a movie
         # very rare case where we have only imdb id
         ##if imdb and not tmdb:
         ##    tmdb = imdb_to_tmdb(imdb)
-        tmdb_details = get_tmdb_details(media_type, tmdb, language=LANGUAGE)
-        title = tmdb_details.get('title', title)    # get title from tdmb or keep the one from Jellyfin.
-        release_date = tmdb_details.get('release_date', '')
-        formatted_title = f"{title} ({release_date.split('-')[0]})" if release_date else title
-        overview = tmdb_details.get('overview', '')
-        poster_id = tmdb_details.get('poster_path', '')
-        picture_path = download_and_get_poster_by_id(poster_id)
-        trailer = get_trailer_link(media_type, tmdb)
+        technical_stage = budget.submit("technical_details", get_jellyfin_media_details, item_id, default={})
+        trailer_stages = submit_trailers(budget, media_type, tmdb, languages)
+        localized_details = get_localized_details(budget, media_type, tmdb, languages)
+        poster_id = localized_details[languages[0]].get('poster_path', '')
+        posters = budget.run("poster", download_poster_variants, poster_id, poster_widths, default={})
+        picture_path = posters.get(DEFAULT_POSTER_WIDTH, "")
         #mdb_links = {
         media_link = {
             "imdb": f"https://imdb.com/title/{imdb}" if imdb else None,
             "tmdb": f"https://tmdb.org/{media_type}/{tmdb}" if tmdb else None
         }
-        technical_details = get_jellyfin_media_details(item_id)
-        message = format_message(formatted_title, overview, media_link, trailer, technical_details)
-        send_image = True
-    elif is_season_ep_or_movie(media_type, title) == "season":
+        # get title from tdmb or keep the one from Jellyfin.
+        messages = format_localized_messages(localized_details, 'title', 'release_date', title, media_link,
+                                             budget.result_each(trailer_stages), budget.result(technical_stage))
+        send_image = bool(picture_path)
+    elif kind == "season":
         # It's a season
         season_name = re.search(r"Season-added:\s*([^,]+)", title, flags=re.IGNORECASE).group(1)
         season_number = re.search(r", Saison\s*([0-9]+)", title, flags=re.IGNORECASE).group(1)
         formatted_title = season_name + ", Saison " + season_number
         message = format_message(formatted_title, "", None, None)
-    elif not SKIP_EPISODE_NOTIFICATIONS and is_season_ep_or_movie(media_type, title) == "episode":
+    elif not SKIP_EPISODE_NOTIFICATIONS and kind == "episode":
         # It's an episode
         formatted_title = re.search(r"Episode-added:\s*(.*)", title, flags=re.IGNORECASE).group(1)
-        if imdb:
+        technical_stage = budget.submit("technical_details", get_jellyfin_media_details, item_id, default={})
+        # The technical details fetch records the series of the episode, used for its link
+        technical_details = budget.result(technical_stage)
+        tmdb_link = budget.run("episode_link", get_episode_tmdb_link, data, item_id)
+        if imdb or tmdb_link:
             media_link = {
-                "imdb": f"https://imdb.com/title/{imdb}",
-                "tmdb": f"{imdb_to_tmdb(imdb)}"
+                "imdb": f"https://imdb.com/title/{imdb}" if imdb else None,
+                "tmdb": tmdb_link
             }
         else:
             media_link = None
-        technical_details = get_jellyfin_media_details(item_id)
         message = format_message(formatted_title, "", media_link, None, technical_details)
-    elif is_season_ep_or_movie(media_type, title) == "serie":
+    elif kind == "serie":
         # It's a series or other (documentary for example)
         if not tmdb and not imdb:
             message = format_message(title, "", None, None)
         else:
-            tmdb_details = get_tmdb_details(media_type, tmdb, language=LANGUAGE)
-            title = tmdb_details.get('name', '')
-            release_date = tmdb_details.get('first_air_date', '')
-            formatted_title = f"{title} ({release_date.split('-')[0]})" if release_date else title
-            overview = tmdb_details.get('overview', '')
-            poster_id = tmdb_details.get('poster_path', '')
-            picture_path = download_and_get_poster_by_id(poster_id)
-            trailer = get_trailer_link(media_type, tmdb)
+            technical_stage = budget.submit("technical_details", get_jellyfin_media_details, item_id, default={})
+            trailer_stages = submit_trailers(budget, media_type, tmdb, languages)
+            localized_details = get_localized_details(budget, media_type, tmdb, languages)
+            poster_id = localized_details[languages[0]].get('poster_path', '')
+            posters = budget.run("poster", download_poster_variants, poster_id, poster_widths, default={})
+            picture_path = posters.get(DEFAULT_POSTER_WIDTH, "")
             media_link = {
                 "imdb": f"https://imdb.com/title/{imdb}" if imdb else None,
-                "tmdb": f"https://tmdb.org/{media_type}/{tmdb}" if tmdb else (f"{imdb_to_tmdb(imdb)}" if imdb else None)
+                "tmdb": f"https://tmdb.org/{media_type}/{tmdb}" if tmdb else (budget.run("imdb_to_tmdb", imdb_to_tmdb, imdb) if imdb else None)
             }
-            technical_details = get_jellyfin_media_details(item_id)
-            message = format_message(formatted_title, overview, media_link, trailer, technical_details)
-            send_image = True
+            # keep the Jellyfin title if TMDB is unavailable
+            messages = format_localized_messages(localized_details, 'name', 'first_air_date', title, media_link,
+                                                 budget.result_each(trailer_stages), budget.result(technical_stage))
+            send_image = bool(picture_path)
+
+    budget.finish()
+    # Seasons and episodes are not localized: the same message for every language
+    messages = messages or dict.fromkeys(languages, message)
+    return {"message": messages[languages[0]], "messages": messages, "send_image": send_image,
+            "picture_path": picture_path, "posters": posters, "kind": kind}
+
+def format_quick_message(data: dict, kind: str) -> dict:
+    """
+    Format a minimal message from the webhook payload only, without any request.
+
+    Sent first in NOTIFY_FIRST mode, then edited once the event is enriched.
+
+    Args:
+        data (dict): The media data from Jellyfin.
+        kind (str): Kind of event ("movie", "serie" or "episode").
+
+    Returns:
+        dict: The formatted message, with the title and the links known from the payload.
+    """
+    title = data.get('title', '')
+    imdb = data.get('imdb', '')
+    tmdb = data.get('tmdb', '')
+    if kind == "episode":
+        title = re.search(r"Episode-added:\s*(.*)", title, flags=re.IGNORECASE).group(1)
+        tmdb = ''  # the TMDb link of an episode is built from its series
+    else:
+        title = re.sub(r"\s*has been added\s*$", "", title, flags=re.IGNORECASE)
+    media_link = {
+        "imdb": f"https://imdb.com/title/{imdb}" if imdb else None,
+        "tmdb": f"https://tmdb.org/{data.get('media_type', '')}/{tmdb}" if tmdb else None
+    } if imdb or tmdb else None
+    return format_message(title, "", media_link, None)
+
+def get_localized_details(budget: EventBudget, media_type: str, tmdb: str, languages: list) -> dict:
+    """
+    Fetch the TMDB details of a media in each language, concurrently.
+
+    Args:
+        budget (EventBudget): Budget of the event.
+        media_type (str): Type of media (movie, tv).
+        tmdb (str): TMDB ID of the media.
+        languages (list): Languages of the connectors.
+
+    Returns:
+        dict: The details by language, an empty dict for a language unavailable.
+    """
+    calls = {language: functools.partial(get_tmdb_details, media_type, tmdb, language=language) for language in languages}
+    return budget.result_each(budget.submit_each("tmdb_details", calls, default={}))
+
+def submit_trailers(budget: EventBudget, media_type: str, tmdb: str, languages: list) -> dict:
+    """
+    Start the search of the trailers of a media in each language and LANGUAGE2, concurrently.
+
+    Args:
+        budget (EventBudget): Budget of the event.
+        media_type (str): Type of media (movie, tv).
+        tmdb (str): TMDB ID of the media.
+        languages (list): Languages of the connectors.
+
+    Returns:
+        dict: Handle of the search by language, see `EventBudget.submit_each`.
+    """
+    calls = {language: functools.partial(get_trailer_in_language, media_type, tmdb, language)
+             for language in dict.fromkeys(languages + [LANGUAGE2])}
+    return budget.submit_each("trailers", calls)
+
+def format_localized_messages(localized_details: dict, title_key: str, date_key: str, default_title: str,
+                              media_link: dict, trailers: dict, technical_details: dict) -> dict:
+    """
+    Format the message of a movie or series in each language.
+
+    Args:
+        localized_details (dict): TMDB details by language.
+        title_key (str): Key of the title in the details ("title" or "name").
+        date_key (str): Key of the release date in the details.
+        default_title (str): Title used when the details are unavailable.
+        media_link (dict): The links to the media (IMDb, TMDb).
+        trailers (dict): Trailer link by language, None if not found.
+        technical_details (dict): The technical details of the media.
 
-    return {"message": message, "send_image": send_image, "picture_path": picture_path}
+    Returns:
+        dict: The formatted message by language.
+    """
+    messages = {}
+    for language, details in localized_details.items():
+        formatted_title = format_title(details.get(title_key, default_title), details.get(date_key, ''))
+        # Language of each trailer link, a video listed in both languages is only linked once
+        trailer_links = {}
+        for trailer_language in dict.fromkeys([language, LANGUAGE2]):
+            trailer_links.setdefault(trailers.get(trailer_language), trailer_language)
+        trailer_links.pop(None, None)
+        messages[language] = format_message(formatted_title, details.get('overview', ''), media_link,
+                                            list(trailer_links), technical_details, list(trailer_links.values()))
+    return messages
+
+def get_episode_tmdb_link(data: dict, item_id: str) -> str:
+    """
+    Build the TMDb link of an episode from its series.
+
+    The series TMDB ID comes from the payload (`series_tmdb`), or from the
+    Jellyfin metadata of the series (`series_id` in the payload, or the series
+    of the episode fetched for its technical details), cached per series. The
+    season and episode numbers come from the payload, Jellyfin or the title.
+    Without series, the IMDb ID of the episode is resolved with TMDB.
+
+    Args:
+        data (dict): The media data from Jellyfin.
+        item_id (str): The Jellyfin item ID of the episode.
+
+    Returns:
+        str: TMDb link of the episode, None if it cannot be found.
+    """
+    series_id, season_number, episode_number = get_episode_position(item_id)
+    series_id = data.get('series_id') or series_id
+    season_number = data.get('season_number') or season_number
+    episode_number = data.get('episode_number') or episode_number
+    if season_number in (None, "") or episode_number in (None, ""):
+        numbers = re.search(r"\bS(\d+)E(\d+)", data.get('title', ''), flags=re.IGNORECASE)
+        if numbers:
+            season_number, episode_number = numbers.groups()
+    series_tmdb = data.get('series_tmdb') or (get_series_tmdb(series_id) if series_id else None)
+    if series_tmdb and season_number not in (None, "") and episode_number not in (None, ""):
+        return f"https://tmdb.org/tv/{series_tmdb}/season/{int(season_number)}/episode/{int(episode_number)}"
+    imdb = data.get('imdb', '')
+    return imdb_to_tmdb(imdb) if imdb else None
 
 def format_title(title: str, release_date: str) -> str:
     """
@@ -180,25 +327,31 @@ def is_season_ep_or_movie(media_type: str, title: str) -> str:
             return "serie"
     return None
 
-def format_message(title: str, overview: str, media_link: dict = None, trailer: list = None, technical_details: dict = None) -> dict:
+def format_message(title: str, overview: str, media_link: dict = None, trailer: list = None, technical_details: dict = None,
+                   trailer_languages: list = None) -> dict:
     """
     Format the message to be sent.
 
     Args:
         title (str): The title of the media.
         overview (str): The synopsis of the media.
-        media_link (dict): The links to the media (IMDb, TMDb).
+        media_link (dict): The links to the media (IMDb, TMDb), links without value are left out.
         trailer (list, optional): The link(s) to the trailer.
         technical_details (dict, optional): The technical details of the media.
+        trailer_languages (list, optional): The language of each trailer link (e.g. "fr-FR").
 
     Returns:
         dict: The formatted message.
     """
+    # The connectors show every link present, e.g. an episode may only have its TMDb link
+    if media_link:
+        media_link = {name: link for name, link in media_link.items() if link} or None
     message = {
         "title": title,
         "description": overview,
         "media_link": media_link,
         "trailer": trailer,
+        "trailer_languages": trailer_languages,
         "technical_details": technical_details
     }
     return message
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import cProfile
+import threading
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from config.settings import PROFILE_DIR, PROFILE_SAMPLE_INTERVAL
+
+_lock = threading.Lock()
+_remaining = 0
+
+def request_profiling(count: int):
+    """
+    Profile the next `count` requests handled by this process.
+
+    Args:
+        count (int): Number of requests to profile (0 cancels profiling).
+    """
+    global _remaining
+    with _lock:
+        _remaining = max(0, count)
+    logging.info(f"Profiling enabled for the next {count} requests.")
+
+def profiling_status() -> dict:
+    """
+    Get the profiling state of this process.
+
+    Returns:
+        dict: Number of requests still to profile and output directory.
+    """
+    with _lock:
+        return {"remaining_requests": _remaining, "output_dir": PROFILE_DIR}
+
+def _take_slot() -> bool:
+    global _remaining
+    with _lock:
+        if _remaining <= 0:
+            return False
+        _remaining -= 1
+        return True
+
+class StackSampler(threading.Thread):
+    """
+    Background thread sampling the stacks of the profiled threads.
+
+    The request thread and the enrichment pool threads are sampled every
+    `interval` seconds and the stacks are counted in collapsed format
+    ("outer;inner;leaf"), the input format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_SAMPLE_INTERVAL):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        sampled = {self.thread_id}
+        while not self._stop_event.wait(self.interval):
+            sampled.update(t.ident for t in threading.enumerate() if t.name.startswith("enrichment"))
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in sampled:
+                    self.stacks[_collapse(frame)] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+@contextmanager
+def maybe_profile(label: str):
+    """
+    Profile the enclosed block if profiling was requested for this process.
+
+    Two files are written to PROFILE_DIR per profiled request: a cProfile dump
+    (`.prof`, readable with pstats or snakeviz) and the sampled stacks in
+    collapsed format (`.folded`, for flamegraph.pl).
+
+    Args:
+        label (str): Label used in the output file names (e.g. the trace ID).
+    """
+    if not _take_slot():
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident())
+    sampler.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        sampler.stop()
+        _write(label, profiler, sampler.stacks)
+
+def _write(label: str, profiler: cProfile.Profile, stacks: Counter):
+    base = os.path.join(PROFILE_DIR, f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{label}")
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(f"{base}.prof")
+        with open(f"{base}.folded", "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        logging.info(f"Profile written to {base}.prof and {base}.folded")
+    except OSError as e:
+        logging.error(f"Could not write profile {base}: {e}")
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+import time
+import threading
+from config.settings import TMDB_RATE_LIMIT
+
+class RateLimiter:
+    """
+    Token bucket allowing `rate` calls per second, with bursts up to `burst` calls.
+    """
+
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a call is allowed.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+# Rate limits of the dependencies, in requests per second (0 disables the limit)
+RATE_LIMITS = {
+    "tmdb": TMDB_RATE_LIMIT
+}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(name: str) -> RateLimiter:
+    """
+    Get the rate limiter of a dependency.
+
+    Args:
+        name (str): Name of the dependency.
+
+    Returns:
+        RateLimiter: The limiter, or None if the dependency is not rate limited.
+    """
+    rate = RATE_LIMITS.get(name)
+    if not rate:
+        return None
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter(rate)
+        return _limiters[name]
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+from config.settings import ROUTING_FILE
+
+# Event attributes a route can match on
+ATTRIBUTES = ("kind", "media_type", "library", "resolution", "audio")
+
+def event_attributes(data: dict, kind: str, message: dict = None) -> dict:
+    """
+    Get the attributes of an event used for routing, lowercased.
+
+    Args:
+        data (dict): The media data from Jellyfin (`library` is optional in the template).
+        kind (str): Kind of event ("movie", "serie", "season" or "episode").
+        message (dict, optional): The formatted message, for the resolution and audio
+            languages. Without it, only the attributes of the payload are returned.
+
+    Returns:
+        dict: Set of values keyed by attribute, attributes without value are left out.
+    """
+    attributes = {
+        "kind": {kind},
+        "media_type": {data.get('media_type', '')},
+        "library": {str(data.get('library') or '')},
+    }
+    if message is not None:
+        technical_details = message.get("technical_details") or {}
+        attributes["resolution"] = {(technical_details.get("video") or {}).get("resolution", "")}
+        # Audio labels look like "ENG" or "🇫🇷 VFF", keep the code
+        attributes["audio"] = {label.split()[-1] for label in technical_details.get("audio", []) if label}
+    return {name: {value.lower() for value in values if value} for name, values in attributes.items()
+            if any(values)}
+
+class RoutingTable:
+    """
+    Routing rules compiled into an index keyed by event attributes.
+
+    Each route lists connectors and, for some attributes, the accepted values.
+    A route matches an event when, for every attribute it constrains, the event
+    has one of the accepted values. An event is sent to the connectors of the
+    matching routes, and to the connectors that no route mentions.
+
+    For each attribute, the index maps each value to the bitmask of the routes
+    accepting it, plus the mask of the routes not constraining the attribute,
+    so matching an event costs a few dictionary lookups whatever the number
+    of routes. Connector sets are memoized by route mask.
+    """
+
+    def __init__(self, routes: list, connector_names: list):
+        self.routes = routes
+        self.all_routes = (1 << len(routes)) - 1
+        routed = set()
+        for route in routes:
+            routed.update(route["connectors"])
+        self.unrouted = frozenset(name for name in connector_names if name not in routed)
+        self.wildcards = {attribute: 0 for attribute in ATTRIBUTES}
+        self.index = {attribute: {} for attribute in ATTRIBUTES}
+        for bit, route in enumerate(routes):
+            for attribute in ATTRIBUTES:
+                values = route["match"].get(attribute)
+                if values is None:
+                    self.wildcards[attribute] |= 1 << bit
+                    continue
+                for value in values:
+                    self.index[attribute][value] = self.index[attribute].get(value, 0) | 1 << bit
+        self._destinations = {}
+
+    def match(self, attributes: dict, partial: bool = False) -> frozenset:
+        """
+        Get the connectors an event must be sent to.
+
+        Args:
+            attributes (dict): Event attributes, as returned by `event_attributes`.
+            partial (bool, optional): The attributes are not all known yet (before the
+                enrichment): missing attributes do not exclude any route.
+
+        Returns:
+            frozenset: Names of the connectors.
+        """
+        mask = self.all_routes
+        for attribute in ATTRIBUTES:
+            values = attributes.get(attribute)
+            if values is None and partial:
+                continue
+            accepted = self.wildcards[attribute]
+            for value in values or ():
+                accepted |= self.index[attribute].get(value, 0)
+            mask &= accepted
+            if not mask:
+                break
+        if mask not in self._destinations:
+            destinations = set(self.unrouted)
+            for bit, route in enumerate(self.routes):
+                if mask >> bit & 1:
+                    destinations.update(route["connectors"])
+            self._destinations[mask] = frozenset(destinations)
+        return self._destinations[mask]
+
+def parse_routes(config: dict) -> list:
+    """
+    Validate the routes of a routing file.
+
+    Args:
+        config (dict): Content of the routing file, e.g.
+            {"routes": [{"connectors": ["discord"], "match": {"resolution": ["2160p"]}}]}
+
+    Returns:
+        list: Routes with lowercased values, as {"connectors": [...], "match": {attribute: set}}.
+
+    Raises:
+        ValueError: If a route is invalid.
+    """
+    routes = []
+    for i, route in enumerate(config.get("routes", [])):
+        connectors = route.get("connectors")
+        if isinstance(connectors, str):
+            connectors = [connectors]
+        if not connectors:
+            raise ValueError(f"Route {i} has no connectors")
+        match = {}
+        for attribute, values in (route.get("match") or {}).items():
+            if attribute not in ATTRIBUTES:
+                raise ValueError(f"Route {i} matches on unknown attribute {attribute}, expected one of {', '.join(ATTRIBUTES)}")
+            if isinstance(values, str):
+                values = [values]
+            match[attribute] = {str(value).lower() for value in values}
+        routes.append({"connectors": list(connectors), "match": match})
+    return routes
+
+def load_routing_table(connector_names: list, path: str = ROUTING_FILE) -> RoutingTable:
+    """
+    Load and compile the routing file.
+
+    Args:
+        connector_names (list): Names of the loaded connectors.
+        path (str, optional): Path of the JSON routing file.
+
+    Returns:
+        RoutingTable: The compiled table, None if no routing file is set (events go to every connector).
+
+    Raises:
+        ValueError: If the routing file is invalid.
+    """
+    if not path:
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        routes = parse_routes(json.load(f))
+    for route in routes:
+        for name in route["connectors"]:
+            if name not in connector_names:
+                logging.warning(f"Routing file {path} refers to connector {name}, which is not loaded.")
+    logging.info(f"Loaded {len(routes)} routes from {path}.")
+    return RoutingTable(routes, connector_names)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+from config.settings import (HTTP_TIMEOUT_DEFAULT, HTTP_TIMEOUT_FLOOR, HTTP_TIMEOUT_CEILING, HTTP_TIMEOUT_PERCENTILE,
+                             HTTP_TIMEOUT_FACTOR, HTTP_TIMEOUT_WINDOW, HTTP_TIMEOUT_MIN_SAMPLES, HTTP_CONNECT_TIMEOUT,
+                             get_connector_setting)
+
+class TimeoutPolicy:
+    """
+    Read timeout of a host, adapted to its observed latency.
+
+    The timeout is the `percentile` of the last `window` latencies times
+    `factor`, bounded by `floor` and `ceiling`. Until `min_samples` requests
+    were observed, the `default` timeout is used. Timed out requests are
+    recorded with the timeout they had, so a host getting slower sees its
+    timeout grow up to the ceiling instead of failing every request.
+    """
+
+    def __init__(self, default: float = HTTP_TIMEOUT_DEFAULT, floor: float = HTTP_TIMEOUT_FLOOR,
+                 ceiling: float = HTTP_TIMEOUT_CEILING, percentile: float = HTTP_TIMEOUT_PERCENTILE,
+                 factor: float = HTTP_TIMEOUT_FACTOR, window: int = HTTP_TIMEOUT_WINDOW,
+                 min_samples: int = HTTP_TIMEOUT_MIN_SAMPLES):
+        self.default = default
+        self.floor = floor
+        self.ceiling = ceiling
+        self.percentile = percentile
+        self.factor = factor
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._timeouts = 0
+        self._lock = threading.Lock()
+        self._current = min(max(default, floor), ceiling)
+
+    def timeout(self) -> float:
+        """
+        Get the read timeout to use for the next request.
+
+        Returns:
+            float: Timeout in seconds.
+        """
+        with self._lock:
+            return self._current
+
+    def observe(self, latency: float, timed_out: bool = False):
+        """
+        Record the latency of a request and update the timeout.
+
+        Args:
+            latency (float): Duration of the request in seconds.
+            timed_out (bool, optional): The request timed out.
+        """
+        with self._lock:
+            self._latencies.append(latency)
+            if timed_out:
+                self._timeouts += 1
+            if len(self._latencies) >= self.min_samples:
+                self._current = min(max(self._percentile() * self.factor, self.floor), self.ceiling)
+
+    def _percentile(self) -> float:
+        # Called with the lock held
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.percentile))]
+
+    def status(self) -> dict:
+        """
+        Get the current timeout and the latency it is derived from.
+
+        Returns:
+            dict: Timeout, latency percentile, number of samples and of timed out requests.
+        """
+        with self._lock:
+            return {
+                "timeout": round(self._current, 3),
+                "latency_percentile": round(self._percentile(), 3) if self._latencies else None,
+                "samples": len(self._latencies),
+                "timeouts": self._timeouts
+            }
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+def get_policy(dependency: str, url: str) -> TimeoutPolicy:
+    """
+    Get (or create) the timeout policy of the host of a URL.
+
+    Floor and ceiling can be set per dependency with HTTP_TIMEOUT_FLOOR_<NAME>
+    and HTTP_TIMEOUT_CEILING_<NAME>, e.g. to allow slow uploads.
+
+    Args:
+        dependency (str): Name of the dependency (e.g. "tmdb", "discord").
+        url (str): URL of the request.
+
+    Returns:
+        TimeoutPolicy: The policy of the host.
+    """
+    host = urlsplit(url).netloc
+    with _policies_lock:
+        if host not in _policies:
+            _policies[host] = TimeoutPolicy(
+                floor=float(get_connector_setting(dependency, "HTTP_TIMEOUT_FLOOR", HTTP_TIMEOUT_FLOOR)),
+                ceiling=float(get_connector_setting(dependency, "HTTP_TIMEOUT_CEILING", HTTP_TIMEOUT_CEILING)))
+        return _policies[host]
+
+def request_timeout(policy: TimeoutPolicy) -> tuple:
+    """
+    Get the timeout argument of a request.
+
+    Args:
+        policy (TimeoutPolicy): Policy of the host.
+
+    Returns:
+        tuple: (connect timeout, read timeout) in seconds, as expected by requests.
+    """
+    read = policy.timeout()
+    return min(HTTP_CONNECT_TIMEOUT, read), read
+
+def timeouts_status() -> dict:
+    """
+    Get the current timeout of every host.
+
+    Returns:
+        dict: Policy status keyed by host.
+    """
+    with _policies_lock:
+        policies = dict(_policies)
+    return {host: policy.status() for host, policy in policies.items()}
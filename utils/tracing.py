@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+import re
+import json
+import time
+import uuid
+import threading
+import functools
+import contextvars
+import logging
+from contextlib import contextmanager
+from config.settings import TRACE_EXPORT_PATH
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+_span_id = contextvars.ContextVar("span_id", default=None)
+_spans = contextvars.ContextVar("spans", default=None)
+_export_lock = threading.Lock()
+_TRACE_ID_PATTERN = re.compile(r"^[A-Za-z0-9-]{1,64}$")
+
+def get_trace_id() -> str:
+    """
+    Get the trace ID of the current request.
+
+    Returns:
+        str: The trace ID, None outside of a trace.
+    """
+    return _trace_id.get()
+
+def start_trace(trace_id: str = None) -> str:
+    """
+    Start a new trace in the current context.
+
+    Args:
+        trace_id (str, optional): Trace ID to reuse (e.g. from an incoming header). Defaults to a new one,
+            also used if the given one is not made of 1 to 64 letters, digits or dashes.
+
+    Returns:
+        str: The trace ID.
+    """
+    if not trace_id or not _TRACE_ID_PATTERN.match(trace_id):
+        trace_id = uuid.uuid4().hex[:16]
+    _trace_id.set(trace_id)
+    _span_id.set(None)
+    _spans.set([])
+    return trace_id
+
+def get_spans() -> list:
+    """
+    Get the spans recorded so far in the current trace.
+
+    Returns:
+        list: Finished spans, as dicts.
+    """
+    return list(_spans.get() or [])
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time a block of code as a span of the current trace.
+
+    Spans started from another span (in the same thread, or in a thread started
+    with a copy of the context) are recorded as its children.
+
+    Args:
+        name (str): Name of the span (e.g. "tmdb.get_tmdb_details").
+        **attributes: Extra attributes recorded with the span.
+    """
+    parent_id = _span_id.get()
+    span_id = uuid.uuid4().hex[:8]
+    token = _span_id.set(span_id)
+    started = time.time()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        _span_id.reset(token)
+        record = {
+            "trace_id": _trace_id.get(),
+            "span_id": span_id,
+            "parent_id": parent_id,
+            "name": name,
+            "start": started,
+            "duration_ms": round(duration_ms, 2),
+        }
+        if attributes:
+            record["attributes"] = attributes
+        if error:
+            record["error"] = error
+        spans = _spans.get()
+        if spans is not None:
+            spans.append(record)
+        logging.debug(f"Span {name} took {duration_ms:.1f}ms")
+        _export(record)
+
+def traced(name: str = None):
+    """
+    Record every call of a function as a span.
+
+    Args:
+        name (str, optional): Name of the span. Defaults to the function name.
+
+    Returns:
+        callable: The decorator.
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def summarize(spans: list) -> str:
+    """
+    Summarize the time spent per span name, slowest first.
+
+    Args:
+        spans (list): Spans returned by `get_spans`.
+
+    Returns:
+        str: Summary such as "handle_media=812ms, get_tmdb_details=430ms (x2)".
+    """
+    totals = {}
+    for record in spans:
+        total, count = totals.get(record["name"], (0.0, 0))
+        totals[record["name"]] = (total + record["duration_ms"], count + 1)
+    parts = []
+    for span_name, (total, count) in sorted(totals.items(), key=lambda item: -item[1][0]):
+        parts.append(f"{span_name}={total:.0f}ms" + (f" (x{count})" if count > 1 else ""))
+    return ", ".join(parts)
+
+def _export(record: dict):
+    if not TRACE_EXPORT_PATH:
+        return
+    try:
+        with _export_lock, open(TRACE_EXPORT_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        logging.warning(f"Could not export span to {TRACE_EXPORT_PATH}: {e}")
+
+class TraceIdFilter(logging.Filter):
+    """
+    Logging filter adding the current trace ID to every record as `trace_id`.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = _trace_id.get() or "-"
+        return True
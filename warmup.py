@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from config.settings import LANGUAGE, LANGUAGE2
+from utils.media_details import get_jellyfin_items, get_tmdb_details, get_trailer_in_language
+from utils.download import download_poster_variants, DEFAULT_POSTER_WIDTH
+from utils.connector import load_connectors, get_poster_widths, get_languages
+
+PAGE_SIZE = 200
+
+def list_items(recent: int = None, item_types: list = None) -> list:
+    """
+    List the Jellyfin library items to warm up, page by page.
+
+    Args:
+        recent (int, optional): Only keep the most recently added items. Defaults to the whole library.
+        item_types (list, optional): Jellyfin item types to list.
+
+    Returns:
+        list: Jellyfin items.
+    """
+    items = []
+    while recent is None or len(items) < recent:
+        limit = PAGE_SIZE if recent is None else min(PAGE_SIZE, recent - len(items))
+        page = get_jellyfin_items(limit=limit, item_types=item_types, start_index=len(items))
+        items.extend(page)
+        if len(page) < limit:
+            break
+    return items
+
+def warm_item(item: dict, poster_widths: list = None, languages: list = None) -> bool:
+    """
+    Prefetch the TMDB details, trailers and posters of a Jellyfin item into the caches.
+
+    Args:
+        item (dict): Jellyfin item with its ProviderIds.
+        poster_widths (list, optional): Poster widths to download. Defaults to the default width.
+        languages (list, optional): Languages of the details and trailers. Defaults to LANGUAGE.
+
+    Returns:
+        bool: True if the item has a TMDB ID and was warmed up.
+    """
+    tmdb = (item.get('ProviderIds') or {}).get('Tmdb')
+    if not tmdb:
+        return False
+    media_type = "movie" if item.get('Type') == "Movie" else "tv"
+    languages = languages or [LANGUAGE]
+    details = {language: get_tmdb_details(media_type, tmdb, language=language) for language in languages}
+    for language in dict.fromkeys(languages + [LANGUAGE2]):
+        get_trailer_in_language(media_type, tmdb, language)
+    download_poster_variants(details[languages[0]].get('poster_path', ''), poster_widths or [DEFAULT_POSTER_WIDTH])
+    return True
+
+def warm_up(recent: int = None, item_types: list = None, concurrency: int = 4, poster_widths: list = None,
+            languages: list = None) -> int:
+    """
+    Warm up the caches for the Jellyfin library.
+
+    TMDB requests go through the shared rate limiter, so the concurrency only
+    bounds the number of lookups in flight.
+
+    Args:
+        recent (int, optional): Only warm up the most recently added items.
+        item_types (list, optional): Jellyfin item types to warm up.
+        concurrency (int, optional): Number of items processed in parallel.
+        poster_widths (list, optional): Poster widths to download, usually those of the connectors.
+        languages (list, optional): Languages to fetch, usually those of the connectors.
+
+    Returns:
+        int: Number of items warmed up.
+    """
+    items = list_items(recent, item_types)
+    logging.info(f"Warming up caches for {len(items)} Jellyfin items.")
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        warmed = sum(executor.map(lambda item: warm_item(item, poster_widths, languages), items))
+    logging.info(f"Warmed up {warmed} items ({len(items) - warmed} without TMDB ID).")
+    return warmed
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Prefetch TMDB details, trailers and posters of the Jellyfin library.")
+    scope = parser.add_mutually_exclusive_group()
+    scope.add_argument("--recent", type=int, default=100, help="number of recently added items to warm up (default: 100)")
+    scope.add_argument("--all", action="store_true", help="warm up the whole library")
+    parser.add_argument("--types", default="Movie,Series", help="comma-separated Jellyfin item types (default: Movie,Series)")
+    parser.add_argument("--concurrency", type=int, default=4, help="number of items processed in parallel (default: 4)")
+    parser.add_argument("--widths", help="comma-separated poster widths (default: the default width and the widths of the loaded connectors)")
+    parser.add_argument("--languages", help="comma-separated languages (default: the languages of the loaded connectors)")
+    args = parser.parse_args()
+
+    if not args.widths or not args.languages:
+        connectors = load_connectors()
+    # handle_media always downloads the default width, whatever the connectors want
+    poster_widths = ([int(width) for width in args.widths.split(",")] if args.widths
+                     else list(dict.fromkeys([DEFAULT_POSTER_WIDTH] + get_poster_widths(connectors))))
+    languages = args.languages.split(",") if args.languages else get_languages(connectors)
+
+    warm_up(None if args.all else args.recent, args.types.split(","), args.concurrency, poster_widths, languages)